@@ -16,8 +16,9 @@ from sqlalchemy.schema import (ForeignKeyConstraint,
                                UniqueConstraint,
                                Index)
 
-from migrate import exceptions
+from migrate import exceptions, events
 from migrate.changeset import constraint, SQLA_06
+from migrate.changeset.policy import get_policy
 
 if not SQLA_06:
     from sqlalchemy.sql.compiler import SchemaGenerator, SchemaDropper
@@ -41,9 +42,18 @@ class AlterTableVisitor(SchemaVisitor):
         self.buffer.write(s)
 
     def execute(self):
-        """Execute the contents of the SchemaIterator's buffer."""
+        """Execute the contents of the SchemaIterator's buffer.
+
+        Uses the :class:`~migrate.changeset.policy.DDLPolicy` of the
+        connection, if any."""
+        sql = self.buffer.getvalue()
+        policy = get_policy(self.connection)
         try:
-            return self.connection.execute(self.buffer.getvalue())
+            if policy is None:
+                return events.run('ddl', self.connection.execute, sql,
+                                  sql=sql, table=self.current_table)
+            return events.run('ddl', policy.execute, self.connection, sql,
+                              sql=sql, table=self.current_table)
         finally:
             self.buffer.truncate(0)
 
@@ -52,6 +62,8 @@ class AlterTableVisitor(SchemaVisitor):
         self.buffer = StringIO.StringIO()
         self.preparer = dialect.identifier_preparer
         self.dialect = dialect
+        # name of the table altered by the statement in the buffer
+        self.current_table = None
 
     def traverse_single(self, elem):
         ret = super(AlterTableVisitor, self).traverse_single(elem)
@@ -80,6 +92,7 @@ class AlterTableVisitor(SchemaVisitor):
           or string (table name)
         """
         table = self._to_table(param)
+        self.current_table = getattr(table, 'name', table)
         self.append('\nALTER TABLE %s ' % self.preparer.format_table(table))
         return table
 
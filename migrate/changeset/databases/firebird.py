@@ -2,7 +2,6 @@
    Firebird database specific implementations of changeset classes.
 """
 from sqlalchemy.databases import firebird as sa_base
-from sqlalchemy.schema import PrimaryKeyConstraint
 from migrate import exceptions
 from migrate.changeset import ansisql, SQLA_06
 
@@ -16,46 +15,160 @@ class FBColumnGenerator(FBSchemaGenerator, ansisql.ANSIColumnGenerator):
     """Firebird column generator implementation."""
 
 
+# primary key, unique and foreign key constraints of a table, with their
+# columns
+CONSTRAINTS_QUERY = """
+SELECT rc.rdb$constraint_name AS name, rc.rdb$constraint_type AS type,
+       se.rdb$field_name AS field_name
+FROM rdb$relation_constraints rc
+     JOIN rdb$index_segments se ON rc.rdb$index_name=se.rdb$index_name
+WHERE rc.rdb$relation_name=?
+  AND rc.rdb$constraint_type IN ('PRIMARY KEY', 'UNIQUE', 'FOREIGN KEY')
+ORDER BY rc.rdb$constraint_name, se.rdb$field_position
+"""
+
+# check constraints of a table, with the columns their triggers use
+CHECKS_QUERY = """
+SELECT DISTINCT rc.rdb$constraint_name AS name,
+       rc.rdb$constraint_type AS type, dep.rdb$field_name AS field_name
+FROM rdb$relation_constraints rc
+     JOIN rdb$check_constraints cc
+          ON cc.rdb$constraint_name=rc.rdb$constraint_name
+     JOIN rdb$dependencies dep
+          ON dep.rdb$dependent_name=cc.rdb$trigger_name
+         AND dep.rdb$depended_on_name=rc.rdb$relation_name
+WHERE rc.rdb$relation_name=? AND rc.rdb$constraint_type='CHECK'
+  AND dep.rdb$field_name IS NOT NULL
+ORDER BY rc.rdb$constraint_name
+"""
+
+# foreign keys referencing the primary key or unique constraints of a
+# table: referenced constraint, referencing table and foreign key
+REFERENCES_QUERY = """
+SELECT ref.rdb$const_name_uq AS name, fk.rdb$relation_name AS type,
+       fk.rdb$constraint_name AS field_name
+FROM rdb$ref_constraints ref
+     JOIN rdb$relation_constraints fk
+          ON fk.rdb$constraint_name=ref.rdb$constraint_name
+     JOIN rdb$relation_constraints uq
+          ON uq.rdb$constraint_name=ref.rdb$const_name_uq
+WHERE uq.rdb$relation_name=?
+ORDER BY ref.rdb$const_name_uq, fk.rdb$relation_name,
+         fk.rdb$constraint_name
+"""
+
+# constraints recreated on the remaining columns of a dropped column
+RECREATED = ('PRIMARY KEY', 'UNIQUE')
+
+# indexes of a table not backing a constraint, with their columns
+INDEXES_QUERY = """
+SELECT ix.rdb$index_name AS name, ix.rdb$unique_flag AS unique_flag,
+       se.rdb$field_name AS field_name
+FROM rdb$indices ix
+     JOIN rdb$index_segments se ON ix.rdb$index_name=se.rdb$index_name
+     LEFT OUTER JOIN rdb$relation_constraints rc
+          ON rc.rdb$index_name=ix.rdb$index_name
+WHERE ix.rdb$relation_name=? AND ix.rdb$foreign_key IS NULL
+  AND rc.rdb$constraint_type IS NULL
+ORDER BY ix.rdb$index_name, se.rdb$field_position
+"""
+
+
 class FBColumnDropper(ansisql.ANSIColumnDropper):
     """Firebird column dropper implementation."""
 
     def visit_column(self, column):
         """Firebird supports 'DROP col' instead of 'DROP COLUMN col' syntax
 
-        Drop primary key and unique constraints if dropped column is referencing it."""
-        if column.primary_key:
-            if column.table.primary_key.columns.contains_column(column):
-                column.table.primary_key.drop()
-                # TODO: recreate primary key if it references more than this column
-
-        for index in column.table.indexes:
-            # "column in index.columns" causes problems as all
-            # column objects compare equal and return a SQL expression
-            if column.name in [col.name for col in index.columns]:
-                index.drop()
-                # TODO: recreate index if it references more than this column
-        
-        for cons in column.table.constraints:
-            if isinstance(cons,PrimaryKeyConstraint):
-                # will be deleted only when the column its on
-                # is deleted!
-                continue
-
-            if SQLA_06:
-                should_drop = column.name in cons.columns
-            else:
-                should_drop = cons.contains_column(column) and cons.name
-            if should_drop:
-                self.start_alter_table(column)
-                self.append("DROP CONSTRAINT ")
-                self.append(self.preparer.format_constraint(cons))
-                self.execute()
-            # TODO: recreate unique constraint if it refenrences more than this column
+        Firebird refuses to drop columns of a key, check constraint or
+        index. Those are dropped with the column. Primary keys, unique
+        constraints and indexes spanning other columns as well are
+        recreated on the remaining columns afterwards: the constraints in
+        a single ``ALTER TABLE`` statement, then the indexes.
+
+        :raises: :exc:`~migrate.exceptions.NotSupportedError` if foreign
+          keys of other tables reference a primary key or unique
+          constraint of the column
+        """
+        table = column.table
+        name = self.dialect.denormalize_name(column.name)
+        constraints = [cons for cons in
+                       self._read_keys(table, CONSTRAINTS_QUERY) +
+                       self._read_keys(table, CHECKS_QUERY)
+                       if name in cons[2]]
+        # foreign keys and checks first, they may use the other keys
+        constraints.sort(key=lambda cons: cons[1] in RECREATED)
+        indexes = [index for index in self._read_keys(table, INDEXES_QUERY)
+                   if name in index[2]]
+
+        dropped = [cons[0] for cons in constraints]
+        for cons_name, fk_table, fk_names in self._read_keys(table,
+                                                             REFERENCES_QUERY):
+            fk_names = [fk for fk in fk_names if fk not in dropped]
+            if cons_name in dropped and fk_names:
+                raise exceptions.NotSupportedError("Can't drop column %s "
+                    "of %s: %s %s of %s references its constraint %s" % (
+                    column.name, table.name,
+                    len(fk_names) > 1 and 'foreign keys' or 'foreign key',
+                    ', '.join(fk_names), fk_table, cons_name))
+
+        for index_name, unique, columns in indexes:
+            self.current_table = table.name
+            self.append('DROP INDEX %s' % self._quote(index_name))
+            self.execute()
+        if constraints:
+            self.start_alter_table(column)
+            self.append(', '.join(['DROP CONSTRAINT %s' % self._quote(cons[0])
+                                   for cons in constraints]))
+            self.execute()
 
         self.start_alter_table(column)
         self.append('DROP %s' % self.preparer.format_column(column))
         self.execute()
 
+        specs = []
+        for cons_name, cons_type, columns in constraints:
+            columns = [col for col in columns if col != name]
+            if columns and cons_type in RECREATED:
+                specs.append('ADD CONSTRAINT %s %s (%s)' % (
+                    self._quote(cons_name), cons_type,
+                    ', '.join([self._quote(col) for col in columns])))
+        if specs:
+            self.start_alter_table(column)
+            self.append(', '.join(specs))
+            self.execute()
+
+        for index_name, unique, columns in indexes:
+            columns = [col for col in columns if col != name]
+            if not columns:
+                continue
+            self.current_table = table.name
+            self.append('CREATE %sINDEX %s ON %s (%s)' % (
+                unique and 'UNIQUE ' or '', self._quote(index_name),
+                self.preparer.format_table(table),
+                ', '.join([self._quote(col) for col in columns])))
+            self.execute()
+
+    def _quote(self, name):
+        # names in the system tables are stored as they are compared
+        return self.preparer.quote_identifier(name)
+
+    def _read_keys(self, table, query):
+        """Returns ``(name, type, columns)`` tuples of the constraints or
+        indexes selected by `query`, from consecutive rows of the same
+        name and type"""
+        rows = self.connection.execute(query,
+            [self.dialect.denormalize_name(table.name)])
+        keys = []
+        for key_name, key_type, field_name in rows:
+            key_name = key_name.rstrip()
+            if isinstance(key_type, basestring):
+                key_type = key_type.rstrip()
+            if not keys or keys[-1][:2] != (key_name, key_type):
+                keys.append((key_name, key_type, []))
+            keys[-1][2].append(field_name.rstrip())
+        return keys
+
 
 class FBSchemaChanger(ansisql.ANSISchemaChanger):
     """Firebird schema changer implementation."""
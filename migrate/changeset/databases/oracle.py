@@ -49,7 +49,40 @@ class OracleSchemaChanger(OracleSchemaGenerator, ansisql.ANSISchemaChanger):
                                self._visit_column_change,
                                start_alter=False)
 
+    def visit_column_batch(self, batch):
+        """Renames, then one ``MODIFY``, ``ADD`` and ``DROP`` for all
+        columns of a :class:`~migrate.changeset.schema.ColumnBatch`"""
+        table = batch.table
+        changes = set(('type', 'nullable', 'server_default'))
+        modify = []
+        for delta in batch.deltas:
+            keys = delta.keys()
+            if 'name' in keys:
+                self._run_subvisit(delta,
+                                   self._visit_column_name,
+                                   start_alter=False)
+            if changes.intersection(keys):
+                modify.append(self._column_change_spec(delta.result_column,
+                                                       delta))
+        self._alter_columns(table, 'MODIFY', modify)
+        self._alter_columns(table, 'ADD',
+            [self.get_column_specification(column) for column in batch.add])
+        self._alter_columns(table, 'DROP',
+            [self.preparer.format_column(column) for column in batch.drop])
+
+    def _alter_columns(self, table, clause, specs):
+        if specs:
+            self.start_alter_table(table)
+            self.append("%s (%s)" % (clause, ', '.join(specs)))
+            self.execute()
+
     def _visit_column_change(self, table, column, delta):
+        self.start_alter_table(table)
+        self.append("MODIFY (")
+        self.append(self._column_change_spec(column, delta))
+        self.append(")")
+
+    def _column_change_spec(self, column, delta):
         # Oracle cannot drop a default once created, but it can set it
         # to null.  We'll do that if default=None
         # http://forums.oracle.com/forums/message.jspa?messageID=1273234#1273234
@@ -76,11 +109,7 @@ class OracleSchemaChanger(OracleSchemaGenerator, ansisql.ANSISchemaChanger):
             column.nullable = False
         if dropdefault_hack:
             column.server_default = None
-
-        self.start_alter_table(table)
-        self.append("MODIFY (")
-        self.append(colspec)
-        self.append(")")
+        return colspec
 
 
 class OracleConstraintCommon(object):
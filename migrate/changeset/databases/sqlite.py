@@ -6,9 +6,11 @@
 from UserDict import DictMixin
 from copy import copy
 
+from sqlalchemy import schema, exc
+from sqlalchemy.sql import visitors
 from sqlalchemy.databases import sqlite as sa_base
 
-from migrate import exceptions
+from migrate import events, exceptions
 from migrate.changeset import ansisql, SQLA_06
 
 
@@ -17,36 +19,176 @@ if not SQLA_06:
 else:
     SQLiteSchemaGenerator = sa_base.SQLiteDDLCompiler
 
+# SQLite versions implementing ALTER TABLE ... RENAME COLUMN and
+# ALTER TABLE ... DROP COLUMN, older versions rebuild the table
+RENAME_COLUMN = (3, 25, 0)
+DROP_COLUMN = (3, 35, 0)
+# SQLite version updating references of views, triggers and (3.26) foreign
+# keys to renamed tables, unless PRAGMA legacy_alter_table is set
+LEGACY_ALTER_TABLE = (3, 25, 0)
+
+
+# settings of the fast rebuild profile, see fast_rebuild()
+FAST_REBUILD_PRAGMAS = (
+    ('journal_mode', 'MEMORY'),
+    ('synchronous', 'OFF'),
+    ('cache_size', '-65536'),
+    ('temp_store', 'MEMORY'),
+    ('foreign_keys', 'OFF'),
+)
+
+
+def fast_rebuild(bind):
+    """Whether table rebuilds on `bind` use the fast rebuild profile,
+    enabled by the ``sqlite_fast_rebuild`` execution option::
+
+        engine = create_engine(url,
+            execution_options=dict(sqlite_fast_rebuild=True))
+
+    While a table is rebuilt, the profile trades durability for speed:
+    the journal is kept in memory, syncs are skipped and foreign keys
+    aren't enforced. Indexes are created after the rows are copied and
+    ``PRAGMA foreign_key_check`` validates the result.
+    """
+    options = getattr(bind, '_execution_options', None) or {}
+    return bool(options.get('sqlite_fast_rebuild'))
+
+
+def set_pragmas(connection, pragmas):
+    """Set `pragmas` on `connection`, returns their previous values"""
+    previous = []
+    for name, value in pragmas:
+        previous.append((name, connection.execute('PRAGMA %s' % name).scalar()))
+        connection.execute('PRAGMA %s = %s' % (name, value))
+    return previous
+
+
+def check_foreign_keys(connection, table_name):
+    """Raise :exc:`~migrate.exceptions.InvalidConstraintError` if rows of
+    `table_name` violate its foreign keys"""
+    result = connection.execute('PRAGMA foreign_key_check(%s)' % table_name)
+    # without violations SQLite doesn't even describe the result
+    violations = []
+    if result.returns_rows:
+        violations = result.fetchall()
+    if violations:
+        raise exceptions.InvalidConstraintError("%d rows of %s violate "
+            "foreign key constraints" % (len(violations), table_name))
+
+
+def rename_table(connection, name, new_name):
+    """Rename table `name` without changing the references of other
+    tables, views and triggers to it, which SQLite 3.25 and later would
+    point to `new_name`"""
+    version = getattr(connection.dialect.dbapi, 'sqlite_version_info', None)
+    legacy = version is not None and version >= LEGACY_ALTER_TABLE
+    if legacy:
+        connection.execute('PRAGMA legacy_alter_table = ON')
+    try:
+        connection.execute('ALTER TABLE %s RENAME TO %s' % (name, new_name))
+    finally:
+        if legacy:
+            connection.execute('PRAGMA legacy_alter_table = OFF')
+
+
+def copy_table(connection, table, columns):
+    """Recreate `table` from the table of the same name in the database,
+    copying the rows of `columns` once.
+
+    The old table is renamed to ``migration_tmp``, `table` is created
+    without its indexes, the rows are copied in primary key order, the
+    old table is dropped and the indexes of `table` are created.
+    """
+    from sqlalchemy.schema import CreateTable
+    preparer = connection.dialect.identifier_preparer
+    table_name = preparer.format_table(table)
+    rename_table(connection, table_name, 'migration_tmp')
+    connection.execute(CreateTable(table))
+    names = ', '.join([preparer.quote(name, table.c[name].quote)
+                       for name in columns])
+    order = [preparer.quote(col.name, col.quote)
+             for col in table.primary_key.columns if col.name in columns]
+    insert = 'INSERT INTO %s (%s) SELECT %s FROM migration_tmp' % (
+        table_name, names, names)
+    if order:
+        insert += ' ORDER BY %s' % ', '.join(order)
+    connection.execute(insert)
+    connection.execute('DROP TABLE migration_tmp')
+    for index in table.indexes:
+        index.create(bind=connection)
+
+
 class SQLiteCommon(object):
 
     def _not_supported(self, op):
         raise exceptions.NotSupportedError("SQLite does not support "
             "%s; see http://www.sqlite.org/lang_altertable.html" % op)
 
+    def _sqlite_version(self):
+        """Version of the SQLite library used by the DBAPI module"""
+        return getattr(self.dialect.dbapi, 'sqlite_version_info', (0, 0, 0))
+
 
 class SQLiteHelper(SQLiteCommon):
 
     def recreate_table(self,table,column=None,delta=None):
+        fast = fast_rebuild(self.connection)
+        if fast:
+            previous = set_pragmas(self.connection, FAST_REBUILD_PRAGMAS)
+        try:
+            self._recreate_table(table, column, delta, fast)
+        finally:
+            if fast:
+                set_pragmas(self.connection, previous)
+        if fast:
+            check_foreign_keys(self.connection,
+                               self.preparer.format_table(table))
+
+    def _recreate_table(self, table, column, delta, fast):
         table_name = self.preparer.format_table(table)
+        self.current_table = table.name
 
         # we remove all indexes so as not to have
         # problems during copy and re-create
         for index in table.indexes:
-            index.drop()
+            index.drop(bind=self.connection)
 
-        self.append('ALTER TABLE %s RENAME TO migration_tmp' % table_name)
-        self.execute()
+        events.run('ddl', rename_table, self.connection, table_name,
+                   'migration_tmp', table=table.name,
+                   sql='ALTER TABLE %s RENAME TO migration_tmp' % table_name)
 
         insertion_string = self._modify_table(table, column, delta)
 
-        table.create()
-        self.connection.close()
-        self.connection = table.bind.connect()
+        if fast:
+            # copy in primary key order into a table without indexes
+            from sqlalchemy.schema import CreateTable
+            order = self._copy_order(table, column, delta)
+            if order:
+                insertion_string += ' ORDER BY %s' % ', '.join(order)
+            self.connection.execute(CreateTable(table))
+        else:
+            table.create(bind=self.connection)
         self.append(insertion_string % {'table_name': table_name})
         self.execute()
         self.append('DROP TABLE migration_tmp')
         self.execute()
-        
+        if fast:
+            for index in table.indexes:
+                index.create(bind=self.connection)
+
+    def _copy_order(self, table, column, delta):
+        """Primary key columns of the copied table"""
+        order = []
+        for col in table.primary_key.columns:
+            name = col.name
+            if isinstance(delta, DictMixin) and col is delta.result_column:
+                name = delta.current_name
+            elif col is column:
+                # added column, not in the copied table
+                return []
+            order.append(self.preparer.quote(name, col.quote))
+        return order
+
     def visit_column(self, delta):
         if isinstance(delta, DictMixin):
             column = delta.result_column
@@ -73,11 +215,39 @@ class SQLiteColumnGenerator(SQLiteSchemaGenerator,
                 'SELECT %(cols)s from migration_tmp')%{'cols':columns}
 
     def visit_column(self,column):
-        if column.foreign_keys:
+        if column.foreign_keys and not self._inline_references(column):
             SQLiteHelper.visit_column(self,column)
         else:
             super(SQLiteColumnGenerator,self).visit_column(column)
 
+    def _inline_references(self, column):
+        """Foreign keys of `column` can be declared in ``ADD COLUMN``
+        if they reference a single column and the new column defaults
+        to NULL"""
+        if column.primary_key or column.unique or \
+                column.server_default is not None:
+            return False
+        for fk in column.foreign_keys:
+            if len(fk.constraint.elements) != 1:
+                return False
+        return True
+
+    def get_column_specification(self, column, **kwargs):
+        spec = super(SQLiteColumnGenerator, self).get_column_specification(
+            column, **kwargs)
+        for fk in column.foreign_keys:
+            remote = fk.column
+            spec += ' REFERENCES %s (%s)' % (
+                self.preparer.format_table(remote.table),
+                self.preparer.format_column(remote))
+            spec += self.define_constraint_cascades(fk.constraint)
+            spec += self.define_constraint_deferrability(fk.constraint)
+        return spec
+
+    def add_foreignkey(self, fk):
+        # declared in the column specification
+        pass
+
 class SQLiteColumnDropper(SQLiteHelper, ansisql.ANSIColumnDropper):
     """SQLite ColumnDropper"""
 
@@ -88,11 +258,46 @@ class SQLiteColumnDropper(SQLiteHelper, ansisql.ANSIColumnDropper):
             ' from migration_tmp'
 
     def visit_column(self,column):
+        if self._sqlite_version() >= DROP_COLUMN and \
+                not self._constrained(column):
+            try:
+                ansisql.ANSIColumnDropper.visit_column(self, column)
+                return
+            except exc.OperationalError:
+                # an index, view or trigger of the database uses the
+                # column, unknown to the metadata: rebuild the table
+                pass
         # For SQLite, we *have* to remove the column here so the table
         # is re-created properly.
         column.remove_from_table(column.table,unset_table=False)
         super(SQLiteColumnDropper,self).visit_column(column)
 
+    def _constrained(self, column):
+        """SQLite refuses to drop columns that are part of a key, an
+        index or a constraint. Only those of the metadata are known,
+        ``DROP COLUMN`` fails for the others."""
+        table = column.table
+        if column.primary_key or column.unique or column.foreign_keys:
+            return True
+        for index in table.indexes:
+            if column.name in [col.name for col in index.columns]:
+                return True
+        for cons in table.constraints:
+            if isinstance(cons, schema.CheckConstraint):
+                columns = [elem for elem in visitors.iterate(cons.sqltext, {})
+                           if isinstance(elem, schema.Column)]
+                if not columns:
+                    # textual check, the columns it uses are unknown
+                    return True
+            elif isinstance(cons, (schema.ColumnCollectionConstraint,
+                                   schema.ForeignKeyConstraint)):
+                columns = cons.columns
+            else:
+                continue
+            if column.name in [getattr(col, 'name', col) for col in columns]:
+                return True
+        return False
+
 
 class SQLiteSchemaChanger(SQLiteHelper, ansisql.ANSISchemaChanger):
     """SQLite SchemaChanger"""
@@ -100,6 +305,13 @@ class SQLiteSchemaChanger(SQLiteHelper, ansisql.ANSISchemaChanger):
     def _modify_table(self, table, column, delta):
         return 'INSERT INTO %(table_name)s SELECT * from migration_tmp'
 
+    def visit_column(self, delta):
+        if isinstance(delta, DictMixin) and delta.keys() == ['name'] and \
+                self._sqlite_version() >= RENAME_COLUMN:
+            ansisql.ANSISchemaChanger.visit_column(self, delta)
+        else:
+            SQLiteHelper.visit_column(self, delta)
+
     def visit_index(self, index):
         """Does not support ALTER INDEX"""
         self._not_supported('ALTER INDEX')
@@ -3,26 +3,35 @@
 """
 import sqlalchemy as sa
 
-from migrate.changeset import ansisql
-from migrate.changeset.databases import (sqlite,
-                                         postgres,
-                                         mysql,
-                                         oracle,
-                                         firebird)
 
-
-# Map SA dialects to the corresponding Migrate extensions
+# Map SA dialects to the corresponding Migrate extensions, the modules
+# are imported when a dialect is used for the first time
 DIALECTS = {
-    "default": ansisql.ANSIDialect,
-    "sqlite": sqlite.SQLiteDialect,
-    "postgres": postgres.PGDialect,
-    "postgresql": postgres.PGDialect,
-    "mysql": mysql.MySQLDialect,
-    "oracle": oracle.OracleDialect,
-    "firebird": firebird.FBDialect,
+    "default": "migrate.changeset.ansisql:ANSIDialect",
+    "sqlite": "migrate.changeset.databases.sqlite:SQLiteDialect",
+    "postgres": "migrate.changeset.databases.postgres:PGDialect",
+    "postgresql": "migrate.changeset.databases.postgres:PGDialect",
+    "mysql": "migrate.changeset.databases.mysql:MySQLDialect",
+    "oracle": "migrate.changeset.databases.oracle:OracleDialect",
+    "firebird": "migrate.changeset.databases.firebird:FBDialect",
 }
 
 
+def get_dialect(sa_dialect_name):
+    """
+    Get the Migrate extension class for the given SA dialect name.
+
+    :param sa_dialect_name: name of SQLAlchemy dialect
+    :type sa_dialect_name: string
+    """
+    migrate_dialect_cls = DIALECTS[sa_dialect_name]
+    if isinstance(migrate_dialect_cls, basestring):
+        module, cls = migrate_dialect_cls.split(':')
+        migrate_dialect_cls = getattr(__import__(module, {}, {}, [cls]), cls)
+        DIALECTS[sa_dialect_name] = migrate_dialect_cls
+    return migrate_dialect_cls
+
+
 def get_engine_visitor(engine, name):
     """
     Get the visitor implementation for the given database engine.
@@ -49,7 +58,7 @@ def get_dialect_visitor(sa_dialect, name):
 
     # map sa dialect to migrate dialect and return visitor
     sa_dialect_name = getattr(sa_dialect, 'name', 'default')
-    migrate_dialect_cls = DIALECTS[sa_dialect_name]
+    migrate_dialect_cls = get_dialect(sa_dialect_name)
     visitor = getattr(migrate_dialect_cls, name)
 
     # bind preparer
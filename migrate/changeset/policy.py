@@ -0,0 +1,162 @@
+"""
+   Lock timeouts and retries of DDL statements.
+
+   An ``ALTER TABLE`` waiting for a lock held by a long running query
+   blocks every query on the table queued behind it. A
+   :class:`DDLPolicy` set with the ``ddl_policy`` execution option makes
+   the statements executed by changeset visitors give up waiting after
+   `lock_timeout` seconds and retry a few times later, when they run
+   outside a transaction, instead::
+
+       connection = engine.connect().execution_options(
+           ddl_policy=DDLPolicy(lock_timeout=2, retries=5))
+       table.c.data.alter(type=Text, connection=connection)
+
+   Upgrades use the policy configured by `ddl_lock_timeout` and
+   `ddl_retries` in migrate.cfg, see
+   :attr:`Repository.ddl_policy
+   <migrate.versioning.repository.Repository.ddl_policy>`.
+
+   .. versionadded:: 0.7.2
+"""
+import sys
+import time
+import random
+import logging
+
+from sqlalchemy import exc
+
+
+log = logging.getLogger(__name__)
+
+# statements setting and resetting the lock timeout of a session, the
+# timeout is substituted in milliseconds (ms) or seconds (s)
+LOCK_TIMEOUT = {
+    'postgresql': (["SET lock_timeout = %(ms)d"], ["RESET lock_timeout"]),
+    'mysql': (["SET SESSION lock_wait_timeout = %(s)d",
+               "SET SESSION innodb_lock_wait_timeout = %(s)d"],
+              ["SET SESSION lock_wait_timeout = DEFAULT",
+               "SET SESSION innodb_lock_wait_timeout = DEFAULT"]),
+    'oracle': (["ALTER SESSION SET ddl_lock_timeout = %(s)d"],
+               ["ALTER SESSION SET ddl_lock_timeout = 0"]),
+    'mssql': (["SET LOCK_TIMEOUT %(ms)d"], ["SET LOCK_TIMEOUT -1"]),
+}
+
+# error codes and messages of lock timeouts and deadlocks
+LOCK_ERRORS = {
+    'postgresql': (('55P03', '40P01'), ()),
+    'mysql': (('1205', '1213'), ()),
+    'oracle': ((), ('ORA-00054', 'ORA-04021')),
+    'mssql': ((), ('(1222)', '(1205)')),
+    'sqlite': ((), ('database is locked', 'database table is locked')),
+}
+
+def get_policy(bind):
+    """Returns the :class:`DDLPolicy` set on `bind` with the
+    ``ddl_policy`` execution option, or :keyword:`None`"""
+    options = getattr(bind, '_execution_options', None) or {}
+    return options.get('ddl_policy')
+
+
+def is_lock_timeout(dialect_name, error):
+    """Whether `error` raised by a database of `dialect_name` is a lock
+    timeout or a deadlock, which are worth retrying"""
+    codes, messages = LOCK_ERRORS.get(dialect_name, ((), ()))
+    orig = getattr(error, 'orig', error)
+    code = getattr(orig, 'pgcode', None)
+    if code is None and getattr(orig, 'args', None):
+        code = orig.args[0]
+    if str(code) in codes:
+        return True
+    message = str(orig)
+    for text in messages:
+        if text in message:
+            return True
+    return False
+
+
+class DDLPolicy(object):
+    """How changeset visitors execute DDL statements.
+
+    :param lock_timeout: seconds a statement may wait for locks, set for
+      the session around each statement on PostgreSQL, MySQL, Oracle and
+      SQL Server; :keyword:`None` keeps the database's setting
+    :param retries: times a statement failing with a lock timeout or a
+      deadlock is retried; statements in a transaction are not retried,
+      since the transaction keeps the locks of its earlier statements
+      while waiting and some databases abort it on errors, upgrades run
+      the whole change script again instead
+    :param backoff: seconds to wait before the first retry, doubled for
+      each following one
+    :param max_backoff: longest wait between retries in seconds
+    :param jitter: fraction of each wait randomly taken off, so that
+      concurrent migrations don't retry in step
+    """
+
+    def __init__(self, lock_timeout=None, retries=0, backoff=0.5,
+                 max_backoff=30.0, jitter=0.5):
+        self.lock_timeout = lock_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def __repr__(self):
+        return '<DDLPolicy lock_timeout=%r retries=%r>' % (self.lock_timeout,
+                                                           self.retries)
+
+    def delay(self, attempt):
+        """Returns seconds to wait before retry number `attempt` (from 0)"""
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay * (1 - self.jitter * random.random())
+
+    def execute(self, connection, sql):
+        """Execute `sql` on `connection` with the lock timeout, retrying
+        it on lock timeouts"""
+        self._set_lock_timeout(connection, 0)
+        try:
+            result = self._execute(connection, sql)
+        except:
+            cls, e, tb = sys.exc_info()
+            try:
+                self._set_lock_timeout(connection, 1)
+            except Exception:
+                # the transaction is aborted, rolling it back resets
+                # the timeout
+                pass
+            raise cls, e, tb
+        self._set_lock_timeout(connection, 1)
+        return result
+
+    def _execute(self, connection, sql):
+        name = connection.dialect.name
+        retries = self.retries
+        if connection.in_transaction():
+            # fail fast instead of blocking the queries waiting for the
+            # locks taken so far, the whole transaction has to run again
+            retries = 0
+        attempt = 0
+        while True:
+            try:
+                result = connection.execute(sql)
+            except exc.DBAPIError, e:
+                if attempt >= retries or not is_lock_timeout(name, e):
+                    raise
+                delay = self.delay(attempt)
+                attempt += 1
+                log.warning('Lock timeout, retry %d of %d in %.1fs: %s',
+                            attempt, self.retries, delay, e.orig)
+                time.sleep(delay)
+                continue
+            return result
+
+    def _set_lock_timeout(self, connection, reset):
+        if self.lock_timeout is None:
+            return
+        statements = LOCK_TIMEOUT.get(connection.dialect.name)
+        if statements is None:
+            return
+        values = dict(ms=int(self.lock_timeout * 1000),
+                      s=max(1, int(round(self.lock_timeout))))
+        for statement in statements[reset]:
+            connection.execute(statement % values)
@@ -1,7 +1,12 @@
 """
    Schema module providing common schema operations.
 """
+import sys
+import time
+import Queue
+import logging
 import warnings
+import threading
 
 from UserDict import DictMixin
 
@@ -22,6 +27,7 @@ __all__ = [
     'alter_column',
     'rename_table',
     'rename_index',
+    'build_indexes',
     'ChangesetTable',
     'ChangesetColumn',
     'ChangesetIndex',
@@ -88,6 +94,109 @@ def rename_index(index, name, table=None, engine=None, **kw):
     index.rename(name, **kw)
 
 
+def build_indexes(indexes, parallel=4, engine=None):
+    """Create `indexes`, up to `parallel` at a time, each on its own
+    connection from the engine's pool.
+
+    Once an index fails, no further indexes are started; the indexes
+    being built are finished before the first error is raised.
+    SQLite builds the indexes one after another on a single connection.
+    So do connections in a transaction, connections of their own would
+    wait for the locks of that transaction. The ``migrate_engine`` of a
+    change script runs in a transaction: indexes are only built in
+    parallel by scripts setting ``transactional = False`` and outside
+    change scripts. A message is logged when `parallel` is ignored.
+
+    :param indexes: :class:`~sqlalchemy.schema.Index` instances of
+      tables that exist and are committed
+    :param parallel: maximum number of indexes built at a time
+    :param engine: Engine instance, the bind of the indexes' tables by
+      default; for a connection not in a transaction, its engine is used
+    :returns: list of ``(index name, seconds)`` tuples in the order the
+      indexes were finished
+    :raises: :exc:`ValueError` when no `engine` is given and the first
+      index's table is not bound
+
+    .. versionadded:: 0.7.2
+    """
+    log = logging.getLogger(__name__)
+    indexes = list(indexes)
+    if not indexes:
+        return []
+    if engine is None:
+        engine = indexes[0].table.bind
+        if engine is None:
+            raise ValueError("Table %s of index %s is not bound to an "
+                "engine, pass engine to build_indexes()" % (
+                    indexes[0].table.name, indexes[0].name))
+    parallel = max(1, int(parallel))
+    in_transaction = getattr(engine, 'in_transaction', None)
+    serial = None
+    if engine.dialect.name == 'sqlite':
+        # sqlite serializes writes, and an in-memory database only
+        # exists on its own connection
+        serial = 'on SQLite'
+    elif in_transaction is not None and in_transaction():
+        # the tables may be locked, or not even committed, by the
+        # transaction
+        serial = 'in a transaction'
+    else:
+        engine = engine.engine
+    if serial is not None:
+        if parallel > 1 and len(indexes) > 1:
+            log.info('Building %d indexes one at a time %s', len(indexes),
+                     serial)
+        parallel = 1
+
+    def build(index, results):
+        started = time.time()
+        try:
+            if parallel == 1:
+                index.create(bind=engine)
+            else:
+                connection = engine.connect()
+                try:
+                    index.create(bind=connection)
+                finally:
+                    connection.close()
+        except:
+            results.put((index, None, sys.exc_info()))
+        else:
+            results.put((index, time.time() - started, None))
+
+    pending = list(indexes)
+    pending.reverse()
+    results = Queue.Queue()
+    timings = []
+    running = 0
+    error = None
+    while pending or running:
+        while error is None and pending and running < parallel:
+            index = pending.pop()
+            running += 1
+            if parallel == 1:
+                build(index, results)
+            else:
+                thread = threading.Thread(target=build, args=(index, results))
+                thread.setDaemon(True)
+                thread.start()
+        if not running:
+            break
+        index, duration, exc_info = results.get()
+        running -= 1
+        if exc_info is not None:
+            log.error('Building index %s failed: %s', index.name, exc_info[1])
+            if error is None:
+                error = exc_info
+            continue
+        log.info('Built index %s in %.3fs', index.name, duration)
+        timings.append((index.name, duration))
+
+    if error is not None:
+        raise error[0], error[1], error[2]
+    return timings
+
+
 def alter_column(*p, **k):
     """Alter a column.
 
@@ -412,6 +521,19 @@ class ColumnDelta(DictMixin, sqlalchemy.schema.SchemaItem):
     result_column = property(_get_result_column, _set_result_column)
 
 
+class ColumnBatch(object):
+    """Column changes of a table applied together, see
+    :meth:`ChangesetTable.alter_columns`"""
+
+    __visit_name__ = 'column_batch'
+
+    def __init__(self, table, add, drop, deltas):
+        self.table = table
+        self.add = add
+        self.drop = drop
+        self.deltas = deltas
+
+
 class ChangesetTable(object):
     """Changeset extensions to SQLAlchemy tables."""
 
@@ -450,6 +572,75 @@ class ChangesetTable(object):
                 column = sqlalchemy.Column(str(column), sqlalchemy.Integer())
         column.drop(table=self, *p, **kw)
 
+    def alter_columns(self, add=(), drop=(), alter=(), connection=None):
+        """Add, drop and alter several columns of this table.
+
+        Databases whose ``ALTER TABLE`` takes a list of columns (Oracle)
+        get one statement per kind of change instead of one per column;
+        elsewhere the changes are made one by one. Renames are applied
+        first, then the other alterations, additions and drops.
+
+        Added columns with constraints, indexes or a primary key are
+        created one by one with :meth:`ChangesetColumn.create`.
+
+        :param add: new columns, populated with their defaults
+        :param drop: columns or names of columns to drop
+        :param alter: ``(column, changes)`` pairs, `changes` being the
+          keyword arguments of :func:`alter_column`
+        :param connection: reuse connection istead of creating new one.
+        :type add: list of Column instances
+        :type drop: list of Column instances or strings
+        :type alter: list of (Column instance or string, dict) tuples
+        :type connection: :class:`sqlalchemy.engine.base.Connection` instance
+        :returns: :class:`ColumnDelta` instances of the altered columns
+        """
+        engine = self.bind
+        visitorcallable = get_engine_visitor(engine, 'schemachanger')
+        if not hasattr(visitorcallable, 'visit_column_batch'):
+            deltas = [alter_column(column, table=self, engine=engine,
+                                   **changes)
+                      for column, changes in alter]
+            for column in add:
+                column.create(self, connection=connection)
+            for column in drop:
+                self.drop_column(column, connection=connection)
+            return deltas
+
+        deltas = [ColumnDelta(column, table=self, engine=engine,
+                              alter_metadata=True, **changes)
+                  for column, changes in alter]
+        batched = []
+        separate = []
+        for column in add:
+            if column.primary_key or column.index or column.unique or \
+                    column.constraints or column.foreign_keys:
+                separate.append(column)
+            else:
+                batched.append(column)
+        columns = []
+        for column in drop:
+            if not isinstance(column, sqlalchemy.Column):
+                try:
+                    column = getattr(self.c, str(column))
+                except AttributeError:
+                    column = sqlalchemy.Column(str(column),
+                                               sqlalchemy.Integer())
+            columns.append(column)
+
+        for column in batched:
+            column.add_to_table(self)
+        engine._run_visitor(visitorcallable,
+            ColumnBatch(self, batched, columns, deltas), connection)
+        for column in batched:
+            if column.default is not None:
+                column._populate_default(engine, connection)
+        for column in columns:
+            column.remove_from_table(self, unset_table=False)
+            column.table = None
+        for column in separate:
+            column.create(self, connection=connection)
+        return deltas
+
     def rename(self, name, connection=None, **kwargs):
         """Rename this table.
 
@@ -529,13 +720,29 @@ populated with defaults
         visitorcallable = get_engine_visitor(engine, 'columngenerator')
         engine._run_visitor(visitorcallable, self, connection, **kwargs)
 
-        # TODO: reuse existing connection
         if self.populate_default and self.default is not None:
-            stmt = table.update().values({self: engine._execute_default(self.default)})
-            engine.execute(stmt)
+            self._populate_default(engine, connection)
 
         return self
 
+    def _populate_default(self, engine, connection=None):
+        """Set this column to its default in all rows"""
+        if not hasattr(engine, '_execute_default'):
+            # mock engines of preview_sql() can't evaluate defaults
+            if self.default.is_scalar:
+                value = self.default.arg
+            else:
+                value = sqlalchemy.bindparam(self.name)
+            bind = engine
+        elif connection is None:
+            value = engine._execute_default(self.default)
+            bind = engine
+        else:
+            value = connection._execute_default(self.default, (), {})
+            bind = connection
+        stmt = self.table.update().values({self: value})
+        bind.execute(stmt)
+
     def drop(self, table=None, connection=None, **kwargs):
         """Drop this column from the database, leaving its table intact.
 
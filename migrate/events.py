@@ -0,0 +1,179 @@
+"""
+   Instrumentation hooks for migration steps and DDL statements.
+
+   Listeners are plain callables receiving an :class:`Event`::
+
+       from migrate import events
+
+       def report(event):
+           statsd.timing('migrate.ddl', event.duration)
+
+       events.listen(events.AFTER_DDL, report)
+
+   Available events:
+
+   ``before_step`` / ``after_step``
+     around every change script run by
+     :meth:`ControlledSchema.runchange
+     <migrate.versioning.schema.ControlledSchema.runchange>`
+   ``before_ddl`` / ``after_ddl``
+     around every statement executed by changeset visitors and
+     around SQL change scripts
+   ``on_error``
+     when a step or a statement raises an exception
+
+   .. versionadded:: 0.7.2
+"""
+import sys
+import time
+import logging
+
+
+log = logging.getLogger(__name__)
+
+BEFORE_STEP = 'before_step'
+AFTER_STEP = 'after_step'
+BEFORE_DDL = 'before_ddl'
+AFTER_DDL = 'after_ddl'
+ON_ERROR = 'on_error'
+
+EVENTS = (BEFORE_STEP, AFTER_STEP, BEFORE_DDL, AFTER_DDL, ON_ERROR)
+
+_listeners = dict([(name, []) for name in EVENTS])
+
+
+class Event(object):
+    """Information passed to listeners.
+
+    .. attribute:: kind
+
+      ``'step'`` or ``'ddl'``
+
+    .. attribute:: sql
+
+      SQL text of the statement or SQL script, :keyword:`None` for
+      Python change scripts
+
+    .. attribute:: table
+
+      Name of the altered table, if known
+
+    .. attribute:: started, finished, duration
+
+      Timings in seconds (:func:`time.time`); ``finished`` and
+      ``duration`` are :keyword:`None` in ``before_*`` events
+
+    .. attribute:: error
+
+      Exception raised, only set in ``on_error`` events
+
+    Step events also carry ``script``, ``start_version`` and
+    ``end_version``.
+    """
+
+    def __init__(self, kind, sql=None, table=None, **kw):
+        self.kind = kind
+        self.sql = sql
+        self.table = table
+        self.started = None
+        self.finished = None
+        self.duration = None
+        self.error = None
+        self.__dict__.update(kw)
+
+    def __repr__(self):
+        return '<Event %s table=%r duration=%r>' % (self.kind, self.table,
+                                                    self.duration)
+
+
+def listen(name, fn):
+    """Register `fn` to be called on event `name`"""
+    if name not in _listeners:
+        raise ValueError("Unknown event %r, use one of %s" % (name,
+            ', '.join(EVENTS)))
+    _listeners[name].append(fn)
+
+
+def remove(name, fn):
+    """Unregister `fn` from event `name`"""
+    _listeners[name].remove(fn)
+
+
+def clear():
+    """Unregister all listeners"""
+    for listeners in _listeners.itervalues():
+        del listeners[:]
+
+
+def dispatch(name, event):
+    """Call listeners of `name` with `event`.
+
+    Failing listeners are logged and do not interrupt the migration.
+    """
+    for fn in list(_listeners[name]):
+        try:
+            fn(event)
+        except Exception:
+            log.exception('Listener %r failed on %s', fn, name)
+
+
+def run(kind, fn, *p, **info):
+    """Call `fn` with `p` and dispatch ``before_<kind>``,
+    ``after_<kind>`` and ``on_error`` events around it.
+
+    `info` is used to populate the :class:`Event`.
+    """
+    before = 'before_%s' % kind
+    after = 'after_%s' % kind
+    if not (_listeners[before] or _listeners[after] or _listeners[ON_ERROR]):
+        return fn(*p)
+
+    event = Event(kind, **info)
+    dispatch(before, event)
+    event.started = time.time()
+    try:
+        ret = fn(*p)
+    except:
+        cls, exc, tb = sys.exc_info()
+        event.finished = time.time()
+        event.duration = event.finished - event.started
+        event.error = exc
+        dispatch(ON_ERROR, event)
+        raise cls, exc, tb
+    event.finished = time.time()
+    event.duration = event.finished - event.started
+    dispatch(after, event)
+    return ret
+
+
+class TimingReporter(object):
+    """Collects ``after_ddl`` events and reports the slowest statements.
+
+    Used by ``migrate --profile``.
+    """
+
+    def __init__(self, limit=10):
+        self.limit = limit
+        self.events = []
+
+    def install(self):
+        listen(AFTER_DDL, self.record)
+
+    def uninstall(self):
+        remove(AFTER_DDL, self.record)
+
+    def record(self, event):
+        self.events.append(event)
+
+    def report(self):
+        """:returns: the `limit` slowest statements, one per line"""
+        slowest = sorted(self.events, key=lambda e: e.duration, reverse=True)
+        lines = ['%d statements, %.3fs total; slowest:' % (len(self.events),
+            sum([e.duration for e in self.events]))]
+        for event in slowest[:self.limit]:
+            sql = ' '.join((event.sql or '').split())
+            if len(sql) > 70:
+                sql = sql[:67] + '...'
+            lines.append('%8.3fs  %-20s %s' % (event.duration,
+                                              event.table or '-', sql))
+        return '\n'.join(lines)
@@ -19,6 +19,10 @@ class UsageError(ApiError):
     """A known error condition where help should be displayed."""
 
 
+class ServerError(ApiError):
+    """A command failed in a migrate server."""
+
+
 class ControlledSchemaError(Error):
     """Base class for controlled schema errors."""
 
@@ -35,6 +39,10 @@ class DatabaseAlreadyControlledError(ControlledSchemaError):
     """Database shouldn't be under version control, but it is"""
 
 
+class LockTimeoutError(ControlledSchemaError):
+    """Migration lock not acquired in time."""
+
+
 class WrongRepositoryError(ControlledSchemaError):
     """This database is under version control by another repository."""
 
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+   Benchmarks for the versioning and changeset hot paths.
+
+   Run against SQLite in-memory and file databases::
+
+       $ python -m migrate.tests.benchmark --output=bench.json
+       $ python -m migrate.tests.benchmark --quick --filter=repository
+
+   Results are written as JSON so they can be compared between
+   releases.
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import subprocess
+import tempfile
+import platform
+from datetime import datetime
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    # python < 2.6
+    import simplejson as json
+
+import sqlalchemy
+from sqlalchemy import MetaData, Table, Column, Integer, String, create_engine
+
+import migrate
+from migrate.versioning import bundle, schemadiff, script
+from migrate.versioning.repository import Repository
+from migrate.versioning.schema import ControlledSchema
+
+
+log = logging.getLogger(__name__)
+
+PYTHON_SCRIPT = """from sqlalchemy import *
+from migrate import *
+
+meta = MetaData()
+table = Table('bench_%(num)d', meta,
+    Column('id', Integer, primary_key=True),
+    Column('data', String(40)))
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    table.create()
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    table.drop()
+"""
+
+TIMESTAMP_START = 20110101000000
+
+# modules whose import time is measured in a fresh interpreter
+IMPORTS = ('migrate', 'migrate.versioning.shell', 'migrate.versioning.api',
+           'migrate.versioning.schema', 'migrate.changeset')
+
+# parameters of a full and a --quick run
+SIZES = {
+    'scripts': (10, 100, 1000),
+    'tables': 1000,
+    'rows': 1000000,
+    'statements': 10000,
+    'repeat': 3,
+}
+QUICK_SIZES = {
+    'scripts': (10, 50),
+    'tables': 100,
+    'rows': 10000,
+    'statements': 1000,
+    'repeat': 1,
+}
+
+
+class Benchmark(object):
+    """Runs benchmarks and collects their results"""
+
+    def __init__(self, sizes, workdir, pattern=None):
+        self.sizes = sizes
+        self.workdir = workdir
+        self.pattern = pattern
+        self.results = []
+        self._counter = 0
+
+    def urls(self):
+        """SQLite in-memory and file database urls"""
+        self._counter += 1
+        return [('memory', 'sqlite://'),
+                ('file', 'sqlite:///%s' % os.path.join(self.workdir,
+                    'bench_%d.db' % self._counter))]
+
+    def measure(self, name, fn, repeat=None, setup=None, **params):
+        """Records the best time of `repeat` calls of `fn`.
+
+        `setup` is called before every call of `fn` and is not timed.
+        Failures are recorded in the results instead of aborting the run.
+        """
+        if self.pattern and self.pattern not in name:
+            return
+        if repeat is None:
+            repeat = self.sizes['repeat']
+        result = dict(name=name, params=params, repeat=repeat,
+                      seconds=None, error=None)
+        log.info('%s %r...', name, params)
+        try:
+            timings = []
+            for i in range(repeat):
+                if setup is not None:
+                    setup()
+                start = time.time()
+                fn()
+                timings.append(time.time() - start)
+            result['seconds'] = min(timings)
+        except Exception, e:
+            log.exception('%s failed', name)
+            result['error'] = '%s: %s' % (e.__class__.__name__, e)
+        self.results.append(result)
+        log.info('%s: %s', name, result['seconds'] or result['error'])
+        return result
+
+    def make_repository(self, name, count, timestamps=False):
+        """Create a repository with `count` Python change scripts"""
+        path = os.path.join(self.workdir, name)
+        repos = Repository.create(path, name)
+        versions = os.path.join(path, 'versions')
+        for i in range(1, count + 1):
+            if timestamps:
+                # one script per second, changesets need consecutive
+                # version numbers
+                num = TIMESTAMP_START + i
+            else:
+                num = i
+            fd = open(os.path.join(versions, '%03d_%s.py' % (num, name)), 'w')
+            fd.write(PYTHON_SCRIPT % dict(num=i))
+            fd.close()
+        return path
+
+    def clear(self):
+        """Forget all cached repository and script instances"""
+        Repository.clear()
+        script.PythonScript.clear()
+        script.SqlScript.clear()
+
+    def run(self):
+        self.bench_imports()
+        self.bench_repository_load()
+        self.bench_changeset()
+        self.bench_python_import()
+        self.bench_sql_script()
+        self.bench_recreate_table()
+        self.bench_schemadiff()
+        self.bench_upgrade()
+        return self.results
+
+    def python(self, code):
+        """Run `code` in a fresh interpreter"""
+        if subprocess.call([sys.executable, '-c', code]):
+            raise RuntimeError('%r failed' % code)
+
+    def bench_imports(self):
+        self.measure('python_startup', lambda: self.python('pass'))
+        for module in IMPORTS:
+            self.measure('import', lambda: self.python('import %s' % module),
+                module=module)
+
+        path = self.make_repository('cli', 1)
+        self.measure('cli_version', lambda: self.python(
+            'from migrate.versioning.shell import main; '
+            'main(["version", %r, "--disable_logging"])' % path))
+
+    def bench_repository_load(self):
+        for count in self.sizes['scripts']:
+            path = self.make_repository('load_%d' % count, count)
+            self.measure('repository_load', lambda: Repository(path),
+                setup=self.clear, scripts=count, format='directory')
+            Repository(path)
+            self.measure('repository_lookup', lambda: Repository(path),
+                scripts=count)
+            dest = path + '.bundle'
+            bundle.create(Repository(path), dest)
+            self.measure('repository_load', lambda: Repository(dest),
+                setup=self.clear, scripts=count, format='bundle')
+
+    def bench_changeset(self):
+        count = max(self.sizes['scripts'])
+        for numbering in ('sequential', 'timestamp'):
+            path = self.make_repository('changeset_%s' % numbering, count,
+                timestamps=(numbering == 'timestamp'))
+            repos = Repository(path)
+            # changesets walk every number between two versions, plan
+            # from the first version instead of from version 0
+            start = min(repos.versions.versions.keys())
+            self.measure('changeset_planning',
+                lambda: repos.changeset('sqlite', start),
+                scripts=count, numbering=numbering)
+
+    def bench_python_import(self):
+        count = max(self.sizes['scripts'])
+        path = self.make_repository('import', count)
+
+        def load_modules():
+            repos = Repository(path)
+            for num in range(1, count + 1):
+                repos.version(num).script().module
+        self.measure('python_script_import', load_modules,
+            setup=self.clear, scripts=count)
+
+    def bench_sql_script(self):
+        count = self.sizes['statements']
+        path = os.path.join(self.workdir, 'bench_upgrade.sql')
+        fd = open(path, 'w')
+        fd.write('CREATE TABLE bench_sql (id INTEGER PRIMARY KEY, data VARCHAR(40));\n')
+        for i in range(count):
+            fd.write("INSERT INTO bench_sql (data) VALUES ('row %d');\n" % i)
+        fd.close()
+        sql = script.SqlScript(path)
+
+        for kind, url in self.urls():
+            engine = create_engine(url)
+            drop = lambda: engine.execute('DROP TABLE IF EXISTS bench_sql')
+            self.measure('sql_script_run', lambda: sql.run(engine),
+                setup=drop, statements=count, database=kind)
+            engine.dispose()
+
+    def bench_recreate_table(self):
+        rows = self.sizes['rows']
+        for kind, url in self.urls():
+            for fast in (False, True):
+                engine = create_engine(url,
+                    execution_options=dict(sqlite_fast_rebuild=fast))
+                state = {}
+
+                def setup():
+                    meta = MetaData(engine)
+                    engine.execute('DROP TABLE IF EXISTS bench_rebuild')
+                    table = Table('bench_rebuild', meta,
+                        Column('id', Integer, primary_key=True),
+                        Column('data', String(40), index=True),
+                        Column('value', Integer))
+                    table.create()
+                    engine.execute('INSERT INTO bench_rebuild (data, value) '
+                        'VALUES (?, ?)', [('row %d' % i, i)
+                                          for i in range(rows)])
+                    state['table'] = table
+
+                # changing the type rebuilds the table
+                self.measure('sqlite_recreate_table',
+                    lambda: state['table'].c.value.alter(type=String(20)),
+                    setup=setup, rows=rows, database=kind, fast_rebuild=fast)
+                engine.dispose()
+
+    def bench_schemadiff(self):
+        count = self.sizes['tables']
+        model = MetaData()
+        for i in range(count):
+            Table('bench_diff_%d' % i, model,
+                Column('id', Integer, primary_key=True),
+                Column('name', String(40)),
+                Column('value', Integer))
+        copy = MetaData()
+        for table in model.tables.values():
+            table.tometadata(copy)
+
+        self.measure('schemadiff_models',
+            lambda: schemadiff.SchemaDiff(model, copy),
+            tables=count)
+
+        for kind, url in self.urls():
+            engine = create_engine(url)
+            model.create_all(engine)
+            self.measure('schemadiff_database',
+                lambda: schemadiff.getDiffOfModelAgainstDatabase(model,
+                    engine),
+                tables=count, database=kind)
+            engine.dispose()
+
+    def bench_upgrade(self):
+        count = max(self.sizes['scripts'])
+        path = self.make_repository('upgrade', count)
+        for kind, url in self.urls():
+            engine = create_engine(url)
+            state = {}
+
+            def setup():
+                self.clear()
+                for name in engine.table_names():
+                    engine.execute('DROP TABLE %s' % name)
+                state['schema'] = ControlledSchema.create(engine, path)
+
+            self.measure('upgrade', lambda: state['schema'].upgrade(),
+                setup=setup, versions=count, database=kind)
+            engine.dispose()
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-o', '--output', dest='output',
+        help='write JSON results to this file instead of stdout')
+    parser.add_option('-q', '--quick', dest='quick', action='store_true',
+        default=False, help='use small sizes, for smoke testing')
+    parser.add_option('-f', '--filter', dest='pattern',
+        help='run only benchmarks whose name contains this string')
+    parser.add_option('--rows', dest='rows', type='int',
+        help='number of rows for table rebuild benchmarks')
+    options, args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format='%(message)s')
+    if options.quick:
+        sizes = dict(QUICK_SIZES)
+    else:
+        sizes = dict(SIZES)
+    if options.rows:
+        sizes['rows'] = options.rows
+
+    workdir = tempfile.mkdtemp()
+    try:
+        results = Benchmark(sizes, workdir, options.pattern).run()
+    finally:
+        shutil.rmtree(workdir)
+
+    report = {
+        'migrate_version': migrate.__version__,
+        'sqlalchemy_version': sqlalchemy.__version__,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'date': datetime.utcnow().isoformat(),
+        'sizes': sizes,
+        'results': results,
+    }
+    if options.output:
+        fd = open(options.output, 'w')
+    else:
+        fd = sys.stdout
+    json.dump(report, fd, indent=2, sort_keys=True)
+    fd.write('\n')
+    if options.output:
+        fd.close()
+
+if __name__ == '__main__':
+    main()
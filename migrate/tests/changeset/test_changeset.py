@@ -5,9 +5,10 @@ import warnings
 
 from sqlalchemy import *
 
-from migrate import changeset, exceptions
+from migrate import changeset, events, exceptions
 from migrate.changeset import *
 from migrate.changeset.schema import ColumnDelta
+from migrate.versioning.script import PythonScript
 from migrate.tests import fixture
 from migrate.tests.fixture.warnings import catch_warnings
 
@@ -541,6 +542,106 @@ class TestRename(fixture.DB):
                 self.table.drop()
 
 
+BUILD_INDEXES_SCRIPT = """
+from sqlalchemy import *
+from migrate.changeset.schema import build_indexes
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    table = Table('tmp_build_indexes_script', meta,
+                  Column('id', Integer), Column('data', Integer))
+    table.create()
+    build_indexes([Index('ix_build_script', table.c.data)], parallel=2)
+"""
+
+
+class TestBuildIndexes(fixture.Pathed, fixture.DB):
+    """Tests for building several indexes at once"""
+    level = fixture.DB.CONNECT
+
+    def _setup(self, url):
+        super(TestBuildIndexes, self)._setup(url)
+        self.meta = MetaData(bind=self.engine)
+        self.tables = [Table('tmp_build_indexes_%d' % i, self.meta,
+                             Column('id', Integer), Column('data', Integer))
+                       for i in range(3)]
+        self.meta.drop_all()
+        self.meta.create_all()
+
+    def _teardown(self):
+        self.meta.drop_all()
+        super(TestBuildIndexes, self)._teardown()
+
+    def index_names(self, table):
+        meta = MetaData()
+        table = Table(table.name, meta, autoload=True,
+                      autoload_with=self.engine)
+        names = [index.name for index in table.indexes]
+        names.sort()
+        return names
+
+    @fixture.usedb()
+    def test_build_indexes(self):
+        indexes = [Index('ix_build_%d' % i, table.c.data)
+                   for i, table in enumerate(self.tables)]
+        timings = build_indexes(indexes, parallel=2)
+        names = [name for name, duration in timings]
+        names.sort()
+        self.assertEqual(names, ['ix_build_0', 'ix_build_1', 'ix_build_2'])
+        for i, table in enumerate(self.tables):
+            self.assertEqual(self.index_names(table), ['ix_build_%d' % i])
+
+        self.assertEqual(build_indexes([]), [])
+
+        # unbound tables need an engine
+        table = Table('tmp_build_indexes_unbound', MetaData(),
+                      Column('data', Integer))
+        self.assertRaises(ValueError, build_indexes,
+                          [Index('ix_build_unbound', table.c.data)])
+
+    @fixture.usedb()
+    def test_build_indexes_failure(self):
+        """No further indexes are built once one failed"""
+        Index('ix_build_existing', self.tables[1].c.id).create()
+        indexes = [Index('ix_build_0', self.tables[0].c.data),
+                   Index('ix_build_existing', self.tables[1].c.data),
+                   Index('ix_build_2', self.tables[2].c.data)]
+        self.assertRaises(sqlalchemy.exc.DatabaseError, build_indexes,
+                          indexes, parallel=1)
+        self.assertEqual(self.index_names(self.tables[0]), ['ix_build_0'])
+        self.assertEqual(self.index_names(self.tables[2]), [])
+
+    @fixture.usedb()
+    def test_build_indexes_in_script(self):
+        """A change script builds indexes on its own connection"""
+        path = self.tmp_py()
+        f = open(path, 'w')
+        f.write(BUILD_INDEXES_SCRIPT)
+        f.close()
+        table = Table('tmp_build_indexes_script', MetaData(bind=self.engine))
+        try:
+            PythonScript(path).run(self.engine, 1)
+            self.assertEqual(self.index_names(table), ['ix_build_script'])
+        finally:
+            if table.exists():
+                table.drop()
+
+    @fixture.usedb()
+    def test_build_indexes_in_transaction(self):
+        connection = self.engine.connect()
+        try:
+            trans = connection.begin()
+            indexes = [Index('ix_build_%d' % i, table.c.data)
+                       for i, table in enumerate(self.tables)]
+            timings = build_indexes(indexes, parallel=2, engine=connection)
+            self.assertEqual([name for name, duration in timings],
+                             ['ix_build_0', 'ix_build_1', 'ix_build_2'])
+            trans.commit()
+        finally:
+            connection.close()
+        self.assertEqual(self.index_names(self.tables[0]), ['ix_build_0'])
+
+
 class TestColumnChange(fixture.DB):
     level = fixture.DB.CONNECT
     table_name = 'tmp_colchange'
@@ -762,6 +863,300 @@ class TestColumnChange(fixture.DB):
         self.assertEqual(u'foobar', row['data_new'])
 
 
+class TestAlterColumns(fixture.DB):
+    level = fixture.DB.CONNECT
+    table_name = 'tmp_altercols'
+
+    def _setup(self, url):
+        super(TestAlterColumns, self)._setup(url)
+        self.meta = MetaData(self.engine)
+        self.table = Table(self.table_name, self.meta,
+            Column('id', Integer, primary_key=True),
+            Column('data', String(40)),
+            Column('old', Integer))
+        if self.table.exists():
+            self.table.drop()
+        self.table.create()
+
+    def _teardown(self):
+        if self.table.exists():
+            self.table.drop()
+        super(TestAlterColumns, self)._teardown()
+
+    def oracle_table(self):
+        statements = []
+        def executor(sql, *multiparams, **params):
+            if not isinstance(sql, basestring):
+                sql = str(sql.compile(dialect=engine.dialect))
+            statements.append(sql.strip())
+        engine = create_engine('oracle://', strategy='mock',
+                               executor=executor)
+        table = Table('t', MetaData(engine),
+            Column('id', Integer, primary_key=True),
+            Column('a', String(10)),
+            Column('b', Integer),
+            Column('c', Integer))
+        return table, statements
+
+    def test_oracle(self):
+        """Oracle changes all columns in one statement per clause"""
+        table, statements = self.oracle_table()
+        table.alter_columns(
+            add=[Column('d', Integer), Column('e', String(5))],
+            drop=['b', table.c.c],
+            alter=[('a', dict(name='aa', type=String(20))),
+                   (table.c.id, dict(nullable=False))])
+        self.assertEqual(statements, [
+            'ALTER TABLE t RENAME COLUMN a TO aa',
+            'ALTER TABLE t MODIFY (aa VARCHAR2(20 CHAR), id INTEGER NOT NULL)',
+            'ALTER TABLE t ADD (d INTEGER, e VARCHAR2(5 CHAR))',
+            'ALTER TABLE t DROP (b, c)'])
+        self.assertEqual(table.c.keys(), ['id', 'a', 'd', 'e'])
+
+    def test_oracle_separate(self):
+        """Columns with constraints are added one by one"""
+        table, statements = self.oracle_table()
+        table.alter_columns(add=[Column('d', Integer),
+                                 Column('e', Integer, ForeignKey('t.id'))])
+        self.assertEqual(statements, [
+            'ALTER TABLE t ADD (d INTEGER)',
+            'ALTER TABLE t ADD e INTEGER',
+            'ALTER TABLE t ADD FOREIGN KEY(e) REFERENCES t (id)'])
+
+    @fixture.usedb()
+    def test_alter_columns(self):
+        self.table.insert().execute(id=1, data='first', old=1)
+        deltas = self.table.alter_columns(
+            add=[Column('new', Integer, default=7)],
+            drop=['old'],
+            alter=[('data', dict(name='value'))])
+        self.assertEqual(len(deltas), 1)
+        self.refresh_table()
+        self.assertEqual(sorted(self.table.c.keys()), ['id', 'new', 'value'])
+        rows = self.table.select().execute().fetchall()
+        self.assertEqual(rows, [(1, 'first', 7)])
+
+
+class TestSQLiteAlter(fixture.DB):
+    """SQLite alters columns in place when the library supports it"""
+    level = fixture.DB.CONNECT
+    table_name = 'tmp_sqlite_alter'
+
+    def _setup(self, url):
+        super(TestSQLiteAlter, self)._setup(url)
+        self.meta = MetaData(self.engine)
+        self.reftable = Table('tmp_ref', self.meta,
+            Column('id', Integer, primary_key=True))
+        self.table = Table(self.table_name, self.meta,
+            Column('id', Integer, primary_key=True),
+            Column('data', String(40)),
+            Column('indexed', Integer, index=True))
+        self.drop_tables()
+        self.meta.create_all()
+        self.table.insert().execute(id=1, data='first', indexed=1)
+        self.statements = []
+        events.listen(events.AFTER_DDL, self.record)
+
+    def _teardown(self):
+        events.remove(events.AFTER_DDL, self.record)
+        self.drop_tables()
+        super(TestSQLiteAlter, self)._teardown()
+
+    def drop_tables(self):
+        for name in (self.table_name, 'tmp_ref'):
+            if self.engine.has_table(name):
+                self.engine.execute('DROP TABLE %s' % name)
+
+    def record(self, event):
+        self.statements.append(event.sql.strip())
+
+    def rebuilt(self):
+        return [sql for sql in self.statements if 'migration_tmp' in sql]
+
+    @fixture.usedb(supported='sqlite')
+    def test_native(self):
+        from migrate.changeset.databases import sqlite
+        if self.engine.dialect.dbapi.sqlite_version_info < sqlite.DROP_COLUMN:
+            return
+
+        self.table.c.data.alter(name='value')
+        self.refresh_table()
+        Column('ref_id', Integer, ForeignKey(self.reftable.c.id)).create(
+            self.table)
+        self.table.c.value.drop()
+        self.assertEqual(self.rebuilt(), [])
+        self.assertEqual(self.statements[-1],
+            'ALTER TABLE tmp_sqlite_alter DROP COLUMN value')
+        self.assertTrue('REFERENCES tmp_ref (id)' in self.statements[-2])
+
+        self.refresh_table(self.table_name)
+        self.assertEqual([col.name for col in self.table.c],
+                         ['id', 'indexed', 'ref_id'])
+        fks = [fk.target_fullname for fk in self.table.c.ref_id.foreign_keys]
+        self.assertEqual(fks, ['tmp_ref.id'])
+        rows = self.table.select().execute().fetchall()
+        self.assertEqual(rows, [(1, 1, None)])
+
+        # indexed columns and other changes still rebuild the table
+        self.table.c.indexed.drop()
+        self.assertNotEqual(self.rebuilt(), [])
+
+    @fixture.usedb(supported='sqlite')
+    def test_rebuild_references(self):
+        """References of other tables keep pointing to rebuilt tables"""
+        self.engine.execute('CREATE VIEW tmp_sqlite_alter_view AS '
+                            'SELECT id FROM tmp_sqlite_alter')
+        try:
+            self.table.c.data.alter(type=String(80))
+            self.assertNotEqual(self.rebuilt(), [])
+            sql = self.engine.execute("SELECT sql FROM sqlite_master "
+                "WHERE name = 'tmp_sqlite_alter_view'").scalar()
+            self.assertFalse('migration_tmp' in sql)
+            self.assertEqual(self.engine.execute(
+                'SELECT id FROM tmp_sqlite_alter_view').fetchall(), [(1,)])
+        finally:
+            self.engine.execute('DROP VIEW tmp_sqlite_alter_view')
+
+    @fixture.usedb(supported='sqlite')
+    def test_native_unknown_index(self):
+        """Columns indexed in the database only are dropped by a
+        rebuild"""
+        from migrate.changeset.databases import sqlite
+        if self.engine.dialect.dbapi.sqlite_version_info < sqlite.DROP_COLUMN:
+            return
+
+        self.engine.execute('CREATE INDEX ix_tmp_sqlite_alter_data '
+                            'ON tmp_sqlite_alter (data)')
+        # DROP COLUMN fails
+        self.table.c.data.drop()
+        self.assertNotEqual(self.rebuilt(), [])
+
+        self.refresh_table(self.table_name)
+        self.assertEqual([col.name for col in self.table.c],
+                         ['id', 'indexed'])
+        rows = self.table.select().execute().fetchall()
+        self.assertEqual(rows, [(1, 1)])
+
+    @fixture.usedb(supported='sqlite')
+    def test_old_sqlite(self):
+        from migrate.changeset.databases import sqlite
+        version = sqlite.SQLiteCommon._sqlite_version
+        sqlite.SQLiteCommon._sqlite_version = lambda self: (3, 7, 17)
+        try:
+            self.table.c.data.alter(name='value')
+            self.assertEqual(len(self.rebuilt()), 3)
+            self.refresh_table()
+            self.table.c.value.drop()
+            self.assertEqual(len(self.rebuilt()), 6)
+        finally:
+            sqlite.SQLiteCommon._sqlite_version = version
+        self.refresh_table(self.table_name)
+        self.assertEqual([col.name for col in self.table.c],
+                         ['id', 'indexed'])
+
+
+    @fixture.usedb(supported='sqlite')
+    def test_fast_rebuild(self):
+        engine = create_engine(self.url,
+            execution_options=dict(sqlite_fast_rebuild=True))
+        try:
+            meta = MetaData(engine)
+            table = Table(self.table_name, meta, autoload=True)
+            pragmas = [engine.execute('PRAGMA %s' % name).scalar()
+                       for name in ('synchronous', 'temp_store')]
+            table.c.data.alter(type=String(80))
+            self.assertNotEqual(self.rebuilt(), [])
+            self.assertTrue(self.rebuilt()[1].endswith('ORDER BY id'))
+            self.assertEqual(pragmas,
+                [engine.execute('PRAGMA %s' % name).scalar()
+                 for name in ('synchronous', 'temp_store')])
+
+            self.refresh_table(self.table_name)
+            self.assertEqual(self.table.c.data.type.length, 80)
+            self.assertEqual([index.name for index in self.table.indexes],
+                             ['ix_tmp_sqlite_alter_indexed'])
+            rows = self.table.select().execute().fetchall()
+            self.assertEqual(rows, [(1, 'first', 1)])
+
+            # rows violating foreign keys are reported
+            meta = MetaData(engine)
+            Table('tmp_ref', meta, autoload=True)
+            table = Table(self.table_name, meta, autoload=True)
+            Column('ref_id', Integer, ForeignKey('tmp_ref.id')).create(table)
+            engine.execute('UPDATE %s SET ref_id = 2' % self.table_name)
+            self.assertRaises(exceptions.InvalidConstraintError,
+                table.c.data.alter, type=String(40))
+        finally:
+            engine.dispose()
+
+
+class TestFirebirdDropColumn(fixture.Base):
+
+    def setUp(self):
+        from migrate.changeset.databases import firebird
+        self.rows = {
+            firebird.CONSTRAINTS_QUERY: [
+                ('FK_T_DATA  ', 'FOREIGN KEY ', 'DATA  '),
+                ('PK_T       ', 'PRIMARY KEY ', 'ID    '),
+                ('PK_T       ', 'PRIMARY KEY ', 'DATA  '),
+                ('UQ_T       ', 'UNIQUE      ', 'DATA  '),
+                ('UQ_OTHER   ', 'UNIQUE      ', 'OTHER ')],
+            firebird.CHECKS_QUERY: [
+                ('CK_T_DATA  ', 'CHECK       ', 'DATA  '),
+                ('CK_T_DATA  ', 'CHECK       ', 'OTHER '),
+                ('CK_T_OTHER ', 'CHECK       ', 'OTHER ')],
+            firebird.INDEXES_QUERY: [
+                ('IX_DATA    ', 0, 'DATA  '),
+                ('IX_T       ', 1, 'OTHER '),
+                ('IX_T       ', 1, 'DATA  ')],
+            firebird.REFERENCES_QUERY: [
+                ('UQ_OTHER   ', 'CHILD   ', 'FK_CHILD_OTHER ')],
+        }
+        self.statements = []
+
+    def drop(self):
+        from sqlalchemy.dialects.firebird import base
+        from migrate.changeset.databases.visitor import get_dialect_visitor
+        rows, statements = self.rows, self.statements
+        class Connection(object):
+            def execute(self, sql, params=None):
+                if sql in rows:
+                    assert params == ['T']
+                    return rows[sql]
+                statements.append(sql.strip())
+
+        table = Table('t', MetaData(),
+            Column('id', Integer, primary_key=True),
+            Column('data', Integer, primary_key=True),
+            Column('other', Integer))
+        dialect = base.FBDialect()
+        dropper = get_dialect_visitor(dialect, 'columndropper')(dialect,
+                                                                Connection())
+        dropper.visit_column(table.c.data)
+
+    def test_recreate(self):
+        """Keys and indexes spanning other columns survive the drop,
+        foreign keys and checks using the column are dropped"""
+        self.drop()
+        self.assertEqual(self.statements, [
+            'DROP INDEX "IX_DATA"',
+            'DROP INDEX "IX_T"',
+            'ALTER TABLE t DROP CONSTRAINT "FK_T_DATA", '
+            'DROP CONSTRAINT "CK_T_DATA", DROP CONSTRAINT "PK_T", '
+            'DROP CONSTRAINT "UQ_T"',
+            'ALTER TABLE t DROP data',
+            'ALTER TABLE t ADD CONSTRAINT "PK_T" PRIMARY KEY ("ID")',
+            'CREATE UNIQUE INDEX "IX_T" ON t ("OTHER")'])
+
+    def test_referenced(self):
+        """Keys referenced by other tables aren't dropped"""
+        from migrate.changeset.databases import firebird
+        self.rows[firebird.REFERENCES_QUERY].append(
+            ('PK_T       ', 'CHILD   ', 'FK_CHILD_T     '))
+        self.assertRaises(exceptions.NotSupportedError, self.drop)
+        self.assertEqual(self.statements, [])
+
+
 class TestColumnDelta(fixture.DB):
     """Tests ColumnDelta class"""
 
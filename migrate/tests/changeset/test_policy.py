@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+
+from sqlalchemy import *
+from sqlalchemy import exc
+
+from migrate.changeset import *
+from migrate.changeset import policy
+from migrate.changeset.policy import DDLPolicy, get_policy, is_lock_timeout
+from migrate.versioning import api
+from migrate.versioning.repository import Repository
+from migrate.versioning.schema import ControlledSchema
+
+from migrate.tests import fixture
+
+
+class LockError(Exception):
+    pass
+
+
+class FakeConnection(object):
+    """Fails the first `failures` statements not setting a timeout with
+    `error`"""
+
+    def __init__(self, name, failures=0, error=None, transaction=False):
+        if error is None:
+            error = LockError('database is locked')
+        self.dialect = type('Dialect', (object, ), dict(name=name))()
+        self.failures = failures
+        self.error = error
+        self.transaction = transaction
+        self.statements = []
+
+    def in_transaction(self):
+        return self.transaction
+
+    def execute(self, sql):
+        self.statements.append(sql)
+        if 'timeout' not in sql.lower() and self.failures:
+            self.failures -= 1
+            raise exc.OperationalError(sql, {}, self.error)
+        return sql
+
+
+class TestDDLPolicy(fixture.Base):
+
+    def setUp(self):
+        super(TestDDLPolicy, self).setUp()
+        self.sleep = policy.time.sleep
+        self.delays = []
+        policy.time.sleep = self.delays.append
+
+    def tearDown(self):
+        policy.time.sleep = self.sleep
+        super(TestDDLPolicy, self).tearDown()
+
+    def test_delay(self):
+        ddl = DDLPolicy(backoff=1, max_backoff=5, jitter=0.5)
+        for attempt, longest in enumerate([1, 2, 4, 5, 5]):
+            delay = ddl.delay(attempt)
+            self.assertTrue(longest / 2.0 <= delay <= longest, delay)
+        self.assertEqual(DDLPolicy(backoff=1, jitter=0).delay(2), 4)
+
+    def test_is_lock_timeout(self):
+        self.assertTrue(is_lock_timeout('sqlite',
+            LockError('database is locked')))
+        self.assertTrue(is_lock_timeout('mysql',
+            LockError(1205, 'Lock wait timeout exceeded')))
+        self.assertTrue(is_lock_timeout('oracle', LockError('ORA-00054: '
+            'resource busy and acquire with NOWAIT specified')))
+        error = LockError('canceling statement due to lock timeout')
+        error.pgcode = '55P03'
+        self.assertTrue(is_lock_timeout('postgresql', error))
+        self.assertFalse(is_lock_timeout('mysql',
+            LockError(1054, 'Unknown column')))
+        self.assertFalse(is_lock_timeout('firebird',
+            LockError('database is locked')))
+
+    def test_retry(self):
+        error = LockError('canceling statement due to lock timeout')
+        error.pgcode = '55P03'
+        connection = FakeConnection('postgresql', failures=2, error=error)
+        ddl = DDLPolicy(lock_timeout=1.5, retries=2, jitter=0)
+        self.assertEqual(ddl.execute(connection, 'ALTER TABLE t'),
+                         'ALTER TABLE t')
+        self.assertEqual(self.delays, [0.5, 1.0])
+        self.assertEqual(connection.statements, [
+            'SET lock_timeout = 1500', 'ALTER TABLE t', 'ALTER TABLE t',
+            'ALTER TABLE t', 'RESET lock_timeout'])
+
+        # gives up after the last retry and resets the timeout
+        connection = FakeConnection('mysql', failures=3,
+            error=LockError(1205, 'Lock wait timeout exceeded'))
+        ddl = DDLPolicy(lock_timeout=0.2, retries=2)
+        self.assertRaises(exc.OperationalError, ddl.execute, connection,
+                          'ALTER TABLE t')
+        self.assertEqual(connection.statements[:2], [
+            'SET SESSION lock_wait_timeout = 1',
+            'SET SESSION innodb_lock_wait_timeout = 1'])
+        self.assertEqual(connection.statements[-1],
+            'SET SESSION innodb_lock_wait_timeout = DEFAULT')
+        self.assertEqual(connection.statements.count('ALTER TABLE t'), 3)
+
+    def test_transaction(self):
+        """Statements in a transaction fail fast"""
+        connection = FakeConnection('postgresql', failures=1,
+            error=LockError('deadlock detected'), transaction=True)
+        connection.error.pgcode = '40P01'
+        ddl = DDLPolicy(lock_timeout=1, retries=5)
+        self.assertRaises(exc.OperationalError, ddl.execute, connection,
+                          'ALTER TABLE t')
+        self.assertEqual(connection.statements, [
+            'SET lock_timeout = 1000', 'ALTER TABLE t', 'RESET lock_timeout'])
+        self.assertEqual(self.delays, [])
+
+    def test_no_retry(self):
+        """Other errors aren't retried"""
+        connection = FakeConnection('sqlite', failures=1,
+            error=LockError('near "ALTER": syntax error'))
+        ddl = DDLPolicy(retries=5)
+        self.assertRaises(exc.OperationalError, ddl.execute, connection,
+                          'ALTER TABLE t')
+        self.assertEqual(connection.statements, ['ALTER TABLE t'])
+        self.assertEqual(self.delays, [])
+
+
+class TestDDLPolicyExecution(fixture.Pathed):
+
+    def test_locked_table(self):
+        """A statement blocked by another connection is retried"""
+        url = 'sqlite:///%s' % self.tmp()
+        engine = create_engine(url, connect_args=dict(timeout=0))
+        table = Table('tmp_policy', MetaData(bind=engine),
+                      Column('id', Integer, primary_key=True))
+        table.create()
+
+        holder = create_engine(url,
+            connect_args=dict(check_same_thread=False)).connect()
+        holder.execute('BEGIN EXCLUSIVE')
+        release = threading.Timer(0.2, holder.connection.commit)
+        release.start()
+        try:
+            self.assertRaises(exc.OperationalError,
+                Column('a', Integer).create, table)
+            connection = engine.connect().execution_options(
+                ddl_policy=DDLPolicy(retries=8, backoff=0.05, jitter=0))
+            self.assertTrue(get_policy(connection) is not None)
+            Column('b', Integer).create(table, connection=connection)
+        finally:
+            release.join()
+            holder.close()
+        table = Table('tmp_policy', MetaData(), autoload=True,
+                      autoload_with=engine)
+        self.assertEqual(table.c.keys(), ['id', 'b'])
+
+    def test_config(self):
+        path = self.tmp_repos()
+        api.create(path, 'repository_name')
+        repository = Repository(path)
+        self.assertEqual(repository.ddl_policy, None)
+
+        repository.config.set('db_settings', 'ddl_lock_timeout', '2.5')
+        repository.config.set('db_settings', 'ddl_retries', '4')
+        ddl = repository.ddl_policy
+        self.assertEqual((ddl.lock_timeout, ddl.retries), (2.5, 4))
+
+        url = 'sqlite:///%s' % self.tmp()
+        api.version_control(url, path)
+        schema = ControlledSchema(create_engine(url), repository)
+        connection = schema.engine.connect()
+        self.assertEqual(get_policy(schema.with_ddl_policy(connection)),
+                         schema.ddl_policy)
+        connection.close()
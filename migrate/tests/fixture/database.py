@@ -11,7 +11,7 @@ from sqlalchemy.pool import StaticPool
 
 from migrate.changeset import SQLA_06
 from migrate.changeset.schema import ColumnDelta
-from migrate.versioning.util import Memoize
+from migrate.versioning.util import Memoize, engines
 
 from migrate.tests.fixture.base import Base
 from migrate.tests.fixture.pathed import Pathed
@@ -158,6 +158,8 @@ class DB(Base):
         #if hasattr(self,'conn'):
         #    self.conn.close()
         self.engine.dispose()
+        # engines kept by migrate.versioning.api calls
+        engines.close_all()
 
     def _supported(self, url):
         db = url.split(':',1)[0]
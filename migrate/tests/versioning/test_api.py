@@ -1,6 +1,9 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import sys
+import subprocess
+
 from migrate.exceptions import *
 from migrate.versioning import api
 
@@ -22,6 +25,14 @@ class TestAPI(Pathed):
             content = api.help(cmd)
             self.assertTrue(content)
 
+    def test_lazy_import(self):
+        """Importing the API doesn't import what only commands need"""
+        code = ('import sys; import migrate.versioning.api; '
+                'sys.exit(len([name for name in '
+                '("migrate.versioning.schema", "tempita", "pkg_resources") '
+                'if name in sys.modules]))')
+        self.assertEqual(subprocess.call([sys.executable, '-c', code]), 0)
+
     def test_create(self):
         tmprepo = self.tmp_repos()
         api.create(tmprepo, 'temp')
@@ -44,6 +55,18 @@ class TestAPI(Pathed):
         api.create(repo, 'temp')
         api.version(repo)
 
+    def test_bundle(self):
+        repo = self.tmp_repos()
+        dest = self.tmp()
+        api.create(repo, 'temp')
+        api.script('first version', repo)
+        digest = api.bundle(repo, dest)
+        self.assertEqual(api.version(dest), 1)
+        self.assertTrue(api.source(1, repository=dest))
+
+        # bundle already exists
+        self.assertRaises(KnownError, api.bundle, repo, dest)
+
     def test_source(self):
         repo = self.tmp_repos()
         api.create(repo, 'temp')
@@ -103,6 +126,46 @@ class TestSchemaAPI(fixture.DB, Pathed):
         self.assertEqual(api.db_version(self.url, self.repo), 1)
         self.assertRaises(KnownError, api.upgrade, self.url, self.repo, 0)
 
+    @fixture.usedb()
+    def test_engine_reuse(self):
+        """Sequential commands use the same engine"""
+        from migrate.versioning.util import engines
+        api.db_version(self.url, self.repo)
+        used = [entry[0] for entry in engines.engines.values()]
+        api.db_version(self.url, self.repo)
+        self.assertEqual(len(used), 1)
+        self.assertEqual([entry[0] for entry in engines.engines.values()],
+                         used)
+
+    @fixture.usedb()
+    def test_history(self):
+        # history_table is not configured for this repository
+        self.assertRaises(KnownError, api.history, self.url, self.repo)
+
+        repo = self.tmp_repos()
+        api.create(repo, 'history', history_table='migrate_version_history')
+        api.version_control(self.url, repo)
+        api.script('First Version', repo)
+        api.upgrade(self.url, repo)
+        out = api.history(self.url, repo)
+        self.assertTrue(out.startswith('0 -> 1: '))
+
+    @fixture.usedb()
+    def test_checkpoints(self):
+        self.assertEqual(api.checkpoints(self.url, self.repo), '')
+        api.script('First Version', self.repo)
+        path = api.Repository(self.repo).version(1).script().path
+        fd = open(path, 'w')
+        fd.write("def upgrade(migrate_engine):\n"
+                 "    migrate_engine.checkpoint('batch', [10, 'a'])\n"
+                 "    raise ValueError('interrupted')\n")
+        fd.close()
+        self.assertRaises(ValueError, api.upgrade, self.url, self.repo)
+        out = api.checkpoints(self.url, self.repo)
+        self.assertTrue(out.startswith('0 -> 1: batch = [10, "a"]'), out)
+        api.clear_checkpoints(self.url, self.repo, 1)
+        self.assertEqual(api.checkpoints(self.url, self.repo), '')
+
     @fixture.usedb()
     def test_compare_model_to_db(self):
         diff = api.compare_model_to_db(self.url, self.repo, models.meta)
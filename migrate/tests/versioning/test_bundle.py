@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import zipfile
+
+from sqlalchemy import *
+
+from migrate import exceptions
+from migrate.versioning import api, bundle
+from migrate.versioning.repository import Repository
+from migrate.versioning.schema import ControlledSchema
+
+from migrate.tests import fixture
+
+
+class TestBundle(fixture.Pathed, fixture.DB):
+    level = fixture.DB.CONNECT
+
+    def setUp(self):
+        super(TestBundle, self).setUp()
+        Repository.clear()
+        self.path_repos = self.tmp_repos()
+        repos = Repository.create(self.path_repos, 'repository_name')
+        repos.create_script('first')
+        f = open(repos.version(1).script().path, 'w')
+        f.write("from bundle_helper import TABLE\n"
+                "def upgrade(migrate_engine):\n"
+                "    migrate_engine.execute('CREATE TABLE %s (id INTEGER)' % TABLE)\n"
+                "def downgrade(migrate_engine):\n"
+                "    migrate_engine.execute('DROP TABLE %s' % TABLE)\n")
+        f.close()
+        f = open(os.path.join(self.path_repos, 'versions', 'bundle_helper.py'), 'w')
+        f.write("TABLE = 'bundle_t'\n")
+        f.close()
+        repos.create_script_sql('default', 'second')
+        self.path_bundle = self.tmp(suffix='.bundle')
+
+    def test_create(self):
+        """Bundles load like the repository they were created from"""
+        digest = bundle.create(Repository(self.path_repos), self.path_bundle)
+        self.assertEqual(len(digest), 40)
+        self.assertRaises(exceptions.PathFoundError, bundle.create,
+            Repository(self.path_repos), self.path_bundle)
+
+        repos = Repository(self.path_bundle)
+        self.assertTrue(repos.bundle is not None)
+        self.assertEqual(repos.bundle.digest, digest)
+        self.assertEqual(repos.latest, 2)
+        self.assertEqual(repos.id, 'repository_name')
+        self.assertEqual(repos.version_table, 'migrate_version')
+        self.assertTrue(callable(repos.version(1).script().module.upgrade))
+        self.assertEqual(repos.version(2).script('sqlite', 'upgrade').source(),
+            Repository(self.path_repos).version(2).script('sqlite',
+                                                          'upgrade').source())
+        self.assertRaises(exceptions.KnownError, repos.create_script, 'third')
+        self.assertRaises(exceptions.KnownError, bundle.create, repos,
+            self.tmp())
+
+    def test_tampered(self):
+        """Modified members are detected when read"""
+        bundle.create(Repository(self.path_repos), self.path_bundle)
+        zf = zipfile.ZipFile(self.path_bundle, 'a')
+        zf.writestr('versions/002_second_default_upgrade.sql', 'DROP TABLE x;')
+        zf.close()
+
+        repos = Repository(self.path_bundle)
+        script = repos.version(2).script('sqlite', 'upgrade')
+        self.assertRaises(exceptions.InvalidRepositoryError, script.source)
+
+    def test_tampered_helper(self):
+        """Helper modules are verified when imported"""
+        bundle.create(Repository(self.path_repos), self.path_bundle)
+        zf = zipfile.ZipFile(self.path_bundle, 'a')
+        zf.writestr('versions/bundle_helper.py', "TABLE = 'other_t'\n")
+        zf.close()
+
+        sys.modules.pop('bundle_helper', None)
+        repos = Repository(self.path_bundle)
+        try:
+            self.assertRaises(exceptions.InvalidRepositoryError,
+                              getattr, repos.version(1).script(), 'module')
+        finally:
+            sys.modules.pop('bundle_helper', None)
+        self.assertRaises(exceptions.InvalidRepositoryError,
+                          repos.bundle.verify)
+
+    def test_unlisted(self):
+        """Members missing from the manifest are refused"""
+        bundle.create(Repository(self.path_repos), self.path_bundle)
+        zf = zipfile.ZipFile(self.path_bundle, 'a')
+        zf.writestr('versions/os.py', 'raise SystemExit\n')
+        zf.close()
+        self.assertRaises(exceptions.InvalidRepositoryError, Repository,
+            self.path_bundle)
+
+    def test_verify(self):
+        """The digest of the manifest can be pinned"""
+        digest = bundle.create(Repository(self.path_repos), self.path_bundle)
+        self.assertEqual(api.verify_bundle(self.path_bundle, digest), digest)
+        self.assertRaises(exceptions.InvalidRepositoryError,
+            api.verify_bundle, self.path_bundle, '0' * 40)
+        self.assertRaises(exceptions.KnownError, api.verify_bundle,
+            self.path_repos)
+
+    def test_invalid(self):
+        """Zip files without manifest are not bundles"""
+        zf = zipfile.ZipFile(self.path_bundle, 'w')
+        zf.writestr('migrate.cfg', '')
+        zf.close()
+        self.assertRaises(exceptions.InvalidRepositoryError, Repository,
+            self.path_bundle)
+
+    @fixture.usedb(supported='sqlite')
+    def test_upgrade(self):
+        """Databases are upgraded from a bundle"""
+        bundle.create(Repository(self.path_repos), self.path_bundle)
+        dbschema = ControlledSchema.create(self.engine, self.path_bundle)
+        dbschema.upgrade(1)
+        Table('bundle_t', MetaData(self.engine), autoload=True)
+        dbschema.upgrade(0)
+        self.assertRaises(exceptions.InvalidRepositoryError, api.upgrade,
+            self.url, self.path_bundle, bundle_digest='0' * 40)
+        self.assertEqual(api.db_version(self.url, self.path_bundle), 0)
+        dbschema.drop()
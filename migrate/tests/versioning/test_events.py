@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import *
+
+from migrate import events
+from migrate.versioning.repository import Repository
+from migrate.versioning.schema import ControlledSchema
+
+from migrate.tests import fixture
+
+
+class TestEvents(fixture.Pathed, fixture.DB):
+    level = fixture.DB.CONNECT
+
+    def setUp(self):
+        super(TestEvents, self).setUp()
+        self.received = []
+
+    def tearDown(self):
+        events.clear()
+        super(TestEvents, self).tearDown()
+
+    def record(self, event):
+        self.received.append(event)
+
+    def test_listen(self):
+        self.assertRaises(ValueError, events.listen, 'foobar', self.record)
+        events.listen(events.AFTER_STEP, self.record)
+        events.remove(events.AFTER_STEP, self.record)
+        self.assertRaises(ValueError, events.remove, events.AFTER_STEP,
+            self.record)
+
+    def test_run(self):
+        for name in events.EVENTS:
+            events.listen(name, self.record)
+        events.listen(events.AFTER_DDL, lambda e: 1 / 0)
+
+        self.assertEqual(events.run('ddl', max, 1, 2, sql='x', table='t'), 2)
+        self.assertEqual(len(self.received), 2)
+        before, after = self.received
+        self.assertTrue(before is after)
+        self.assertEqual(after.sql, 'x')
+        self.assertEqual(after.table, 't')
+        self.assertTrue(after.duration >= 0)
+
+        self.received = []
+        self.assertRaises(ZeroDivisionError, events.run, 'step',
+            lambda: 1 / 0)
+        self.assertEqual(len(self.received), 2)
+        self.assertTrue(isinstance(self.received[-1].error,
+                                   ZeroDivisionError))
+
+    def test_timing_reporter(self):
+        reporter = events.TimingReporter(limit=1)
+        reporter.install()
+        events.run('ddl', max, 1, 2, sql='ALTER TABLE a', table='a')
+        events.run('ddl', max, 1, 2, sql='ALTER TABLE b', table='b')
+        reporter.uninstall()
+        report = reporter.report()
+        self.assertTrue(report.startswith('2 statements'))
+        self.assertEqual(len(report.splitlines()), 2)
+
+    @fixture.usedb()
+    def test_upgrade(self):
+        repos = Repository.create(self.temp_usable_dir + '/repo/', 'repo')
+        repos.create_script_sql('default', 'desc')
+        script = repos.version(1).script('default', 'upgrade')
+        f = open(script.path, 'w')
+        f.write('CREATE TABLE events_t (id INTEGER);')
+        f.close()
+        script = repos.version(1).script('default', 'downgrade')
+        f = open(script.path, 'w')
+        f.write('DROP TABLE events_t;')
+        f.close()
+
+        dbschema = ControlledSchema.create(self.engine, repos)
+        events.listen(events.AFTER_STEP, self.record)
+        events.listen(events.AFTER_DDL, self.record)
+        dbschema.upgrade(1)
+
+        ddl, step = self.received
+        self.assertEqual(ddl.kind, 'ddl')
+        self.assertEqual(ddl.sql, 'CREATE TABLE events_t (id INTEGER);')
+        self.assertEqual(step.kind, 'step')
+        self.assertEqual(step.start_version, 0)
+        self.assertEqual(step.end_version, 1)
+        self.assertTrue(step.duration >= ddl.duration)
+
+        self.received = []
+        table = Table('events_t', MetaData(self.engine), autoload=True)
+        Column('data', String(10)).create(table)
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(self.received[0].table, 'events_t')
+
+        dbschema.upgrade(0)
+        dbschema.drop()
@@ -37,6 +37,41 @@ class TestSchemaDiff(fixture.DB):
         diff = schemadiff.getDiffOfModelAgainstDatabase(self.meta, self.engine, excludeTables=['migrate_version'])
         genmodel.ModelGenerator(diff,self.engine).runB2A()
 
+    @fixture.usedb(supported='sqlite')
+    def test_rebuild(self):
+        """Tables SQLite can't alter are copied once, keeping the
+        references of other tables"""
+        child = Table('tmp_schemadiff_child', self.meta,
+            Column('id', Integer, primary_key=True),
+            Column('parent_id', Integer, ForeignKey('%s.id' % self.table_name)))
+        self.meta.create_all()
+        self.engine.execute(self.table.insert(), id=1, name=u'first',
+                            data=u'dropped')
+        self.engine.execute(child.insert(), id=1, parent_id=1)
+
+        self.meta.remove(self.table)
+        self.table = Table(self.table_name, self.meta,
+            Column('id', Integer(), primary_key=True),
+            Column('name', UnicodeText()))
+        engine = sqlalchemy.create_engine(self.url)
+        statements = []
+        sqlalchemy.event.listen(engine, 'before_cursor_execute',
+            lambda conn, cursor, sql, *args: statements.append(sql))
+        try:
+            diff = schemadiff.getDiffOfModelAgainstDatabase(self.meta, engine,
+                excludeTables=['migrate_version'])
+            genmodel.ModelGenerator(diff, engine).runB2A()
+        finally:
+            engine.dispose()
+
+        copies = [sql for sql in statements if sql.startswith('INSERT')]
+        eq_(len(copies), 1)
+        rows = self.engine.execute('SELECT * FROM %s' % self.table_name)
+        eq_(rows.fetchall(), [(1, u'first')])
+        sql = self.engine.execute("SELECT sql FROM sqlite_master "
+            "WHERE name = 'tmp_schemadiff_child'").scalar()
+        self.assertTrue('migration_tmp' not in sql)
+
     @fixture.usedb()
     def test_functional(self):
 
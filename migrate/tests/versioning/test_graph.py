@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+from sqlalchemy import *
+
+from migrate import exceptions
+from migrate.versioning import api
+from migrate.versioning.graph import MigrationGraph, Scheduler
+from migrate.versioning.repository import Repository
+from migrate.versioning.schema import ControlledSchema
+from migrate.versioning.version import VerNum
+
+from migrate.tests import fixture
+
+
+# set by the script of version 3, awaited by the script of version 2
+started = threading.Event()
+# versions run by the scripts of test_resume, which fail while fail is set
+runs = []
+fail = threading.Event()
+
+
+def ints(versions):
+    versions = [int(ver) for ver in versions]
+    versions.sort()
+    return versions
+
+
+SCRIPT = """
+%s
+
+def upgrade(migrate_engine):
+%s
+
+def downgrade(migrate_engine):
+    pass
+"""
+
+
+class TestGraph(fixture.Pathed, fixture.DB):
+    level = fixture.DB.CONNECT
+
+    def setUp(self):
+        super(TestGraph, self).setUp()
+        self.repos = Repository.create(self.temp_usable_dir + '/repo/',
+            'repo_name')
+        started.clear()
+        fail.clear()
+        del runs[:]
+
+    def _setup(self, url):
+        self.setUp()
+        super(TestGraph, self)._setup(url)
+
+    def _teardown(self):
+        super(TestGraph, self)._teardown()
+        self.tearDown()
+
+    def write_scripts(self, *scripts):
+        for depends_on, body in scripts:
+            self.repos.create_script('')
+            if depends_on is None:
+                header = ''
+            else:
+                header = 'depends_on = %r' % (depends_on,)
+            fd = open(self.repos.version().script().path, 'w')
+            fd.write(SCRIPT % (header, body or '    pass'))
+            fd.close()
+
+    def test_graph(self):
+        """Scripts depend on the previous version unless they declare
+        their dependencies"""
+        self.write_scripts((None, None), ([1], None), ([1], None),
+                           ([2, 3], None), (None, None))
+        graph = MigrationGraph(self.repos, 'sqlite')
+        dependencies = dict([(int(ver), ints(deps))
+                             for ver, deps in graph.dependencies.items()])
+        self.assertEqual(dependencies, {1: [], 2: [1], 3: [1],
+                                        4: [2, 3], 5: [4]})
+        self.assertEqual(ints(graph.required(3)), [1, 3])
+        self.assertEqual(ints(graph.required()), [1, 2, 3, 4, 5])
+        v = VerNum
+        self.assertEqual(graph.ready(set([v(2), v(3), v(4)]), set([v(1)])),
+                         [2, 3])
+        self.assertEqual(graph.contiguous(set([v(1), v(3)])), 1)
+        self.assertEqual(graph.contiguous(set([v(1), v(2), v(3)])), 3)
+
+        # dependencies have to precede the script
+        self.write_scripts(([7], None))
+        self.assertRaises(exceptions.ScriptError, MigrationGraph,
+            self.repos, 'sqlite')
+
+    @fixture.usedb()
+    def test_scheduler(self):
+        """Independent scripts run at the same time"""
+        self.write_scripts(
+            (None, None),
+            ([1], '    from migrate.tests.versioning.test_graph import '
+                  'started\n    started.wait(10)\n'
+                  '    assert started.isSet()'),
+            ([1], '    from migrate.tests.versioning.test_graph import '
+                  'started\n    started.set()'),
+            ([2, 3], None))
+        schema = ControlledSchema.create(self.engine, self.repos)
+        scheduler = Scheduler(schema, workers=2)
+        try:
+            # version 3 is applied ahead of version 2
+            scheduler.upgrade(3)
+            self.assertEqual(schema.version, 1)
+            self.assertEqual(ints(scheduler.applied()), [1, 3])
+
+            scheduler.upgrade()
+            self.assertEqual(schema.version, 4)
+            self.assertEqual(ints(scheduler.applied()), [1, 2, 3, 4])
+            rows = self.engine.execute(scheduler.table.select()).fetchall()
+            self.assertEqual(rows, [])
+        finally:
+            schema.drop()
+            scheduler.table.drop(bind=self.engine)
+
+    def test_memory(self):
+        """In-memory SQLite databases are upgraded by one worker"""
+        self.write_scripts((None, None))
+        schema = ControlledSchema.create(create_engine('sqlite://'),
+                                         self.repos)
+        self.assertEqual(Scheduler(schema, workers=2).workers, 1)
+
+    @fixture.usedb()
+    def test_failure(self):
+        """Applied scripts are recorded when another one fails"""
+        self.write_scripts((None, None), ([1], '    raise ValueError()'),
+                           ([1], None), ([2], None))
+        schema = ControlledSchema.create(self.engine, self.repos)
+        scheduler = Scheduler(schema)
+        try:
+            self.assertRaises(ValueError, api.upgrade, self.url,
+                self.repos.path, workers='2')
+            schema.load()
+            self.assertEqual(schema.version, 1)
+            self.assertEqual(ints(scheduler.applied()), [1, 3])
+        finally:
+            schema.drop()
+            scheduler.table.drop(bind=self.engine)
+
+    @fixture.usedb()
+    def test_resume(self):
+        """A failed parallel upgrade is resumed by the scheduler only"""
+        body = ('    from migrate.tests.versioning.test_graph import runs, '
+                'fail\n    runs.append(%d)\n')
+        self.write_scripts((None, body % 1),
+                           ([1], body % 2 + '    assert not fail.isSet()'),
+                           ([1], body % 3), ([2], body % 4))
+        schema = ControlledSchema.create(self.engine, self.repos)
+        scheduler = Scheduler(schema)
+        fail.set()
+        try:
+            self.assertRaises(AssertionError, api.upgrade, self.url,
+                self.repos.path, workers='2')
+            self.assertEqual(schema.applied_ahead(), [3])
+
+            # running versions one after another would run 3 again
+            self.assertRaises(exceptions.KnownError, api.upgrade, self.url,
+                self.repos.path)
+            self.assertRaises(exceptions.KnownError, api.downgrade, self.url,
+                self.repos.path, 0)
+            self.assertRaises(exceptions.KnownError, schema.upgrade)
+
+            fail.clear()
+            api.upgrade(self.url, self.repos.path, workers='1')
+            schema.load()
+            self.assertEqual(schema.version, 4)
+            self.assertEqual(schema.applied_ahead(), [])
+            self.assertEqual(sorted(runs), [1, 2, 2, 3, 4])
+        finally:
+            schema.drop()
+            scheduler.table.drop(bind=self.engine)
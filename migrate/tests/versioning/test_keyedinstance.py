@@ -43,3 +43,48 @@ class TestKeydInstance(fixture.Base):
         self.assert_(a10 is not a12)
 
         self.assertRaises(NotImplementedError, KeyedInstance._key)
+
+    def test_bounded(self):
+        """Least recently used instances are forgotten first"""
+        class Uniq(KeyedInstance):
+            max_instances = 2
+            @classmethod
+            def _key(cls, key):
+                return str(key)
+            def __init__(self, key):
+                self.key = key
+
+        a = Uniq('a')
+        b = Uniq('b')
+        self.assert_(Uniq('a') is a)
+        Uniq('c')
+        self.assert_(Uniq('a') is a)
+        self.assert_(Uniq('b') is not b)
+
+    def test_stamp(self):
+        """Instances are created again when their stamp changes"""
+        stamps = {'a': 1}
+        class Uniq(KeyedInstance):
+            inits = 0
+            @classmethod
+            def _key(cls, key):
+                return str(key)
+            @classmethod
+            def _stamp(cls, key):
+                return stamps[key]
+            def __init__(self, key):
+                Uniq.inits += 1
+
+        a = Uniq('a')
+        # __init__ isn't called again for existing instances
+        self.assert_(Uniq('a') is a)
+        self.assertEquals(Uniq.inits, 1)
+
+        stamps['a'] = 2
+        a2 = Uniq('a')
+        self.assert_(a2 is not a)
+        self.assert_(Uniq('a') is a2)
+
+        stamps['a'] = 3
+        a2._restamp('a')
+        self.assert_(Uniq('a') is a2)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+from sqlalchemy import *
+
+from migrate import exceptions
+from migrate.versioning import api
+from migrate.versioning.plan import (classify, plan, report, METADATA, SCAN,
+    INDEX, REWRITE)
+from migrate.versioning.schema import ControlledSchema
+
+from migrate.tests import fixture
+
+
+SCRIPTS = [
+"""
+from sqlalchemy import *
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    Table('tmp_plan', meta, Column('id', Integer, primary_key=True),
+          Column('data', String(40))).create()
+
+def downgrade(migrate_engine):
+    pass
+""",
+"""
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    table = Table('tmp_plan', meta, Column('id', Integer, primary_key=True),
+                  Column('data', String(40)))
+    table.c.data.alter(type=String(80))
+    Index('ix_tmp_plan_data', table.c.data).create()
+
+def downgrade(migrate_engine):
+    pass
+""",
+"""
+from sqlalchemy import *
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    Table('tmp_plan_new', meta, Column('id', Integer)).create()
+
+def downgrade(migrate_engine):
+    pass
+""",
+"""
+from sqlalchemy import *
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    Table('tmp_plan', meta, autoload=True)
+
+def downgrade(migrate_engine):
+    pass
+""",
+]
+
+
+class TestPlan(fixture.Pathed):
+
+    def setUp(self):
+        super(TestPlan, self).setUp()
+        self.repos = self.tmp_repos()
+        api.create(self.repos, 'repository_name')
+        for source in SCRIPTS:
+            api.script('', self.repos)
+            versions = os.path.join(self.repos, 'versions')
+            path = sorted([name for name in os.listdir(versions)
+                           if name.endswith('.py') and name[0].isdigit()])[-1]
+            fd = open(os.path.join(versions, path), 'w')
+            fd.write(source)
+            fd.close()
+
+    def test_classify(self):
+        op = classify('ALTER TABLE "Users" ALTER COLUMN name TYPE TEXT',
+                      'postgresql')
+        self.assertEqual((op.kind, op.table), (REWRITE, 'users'))
+        op = classify('ALTER TABLE users ALTER COLUMN name TYPE TEXT',
+                      'sqlite')
+        self.assertEqual(op.kind, METADATA)
+        op = classify('ALTER TABLE `users` MODIFY name TEXT', 'mysql')
+        self.assertEqual((op.kind, op.table), (REWRITE, 'users'))
+        op = classify('ALTER TABLE users ADD CONSTRAINT fk FOREIGN KEY(a) '
+                      'REFERENCES b (id)', 'mysql')
+        self.assertEqual(op.kind, SCAN)
+        op = classify('CREATE UNIQUE INDEX ix ON s.users (name)', 'oracle')
+        self.assertEqual((op.kind, op.table), (INDEX, 'users'))
+        op = classify('\nCREATE TABLE users (\n\tid INTEGER\n)', 'sqlite')
+        self.assertEqual((op.kind, op.table), (METADATA, 'users'))
+
+    def test_plan(self):
+        url = 'sqlite:///%s' % self.tmp()
+        api.version_control(url, self.repos)
+        api.upgrade(url, self.repos, 1)
+        engine = create_engine(url)
+        engine.execute('INSERT INTO tmp_plan (id, data) VALUES (1, "a")')
+        engine.execute('INSERT INTO tmp_plan (id, data) VALUES (2, "b")')
+
+        schema = ControlledSchema(engine, self.repos)
+        # SQLite tables are only counted on request
+        alter = plan(schema, throughput='rewrite=1,index=2')[0]
+        sized = [(op.rows, op.duration) for op in alter.operations
+                 if op.kind != METADATA]
+        self.assertEqual(sized, [(None, None)] * 2)
+        self.assertTrue(alter.duration < 1)
+        self.assertTrue('2 operations on tables of unknown size' in
+            api.plan(url, self.repos))
+
+        steps = plan(schema, throughput='rewrite=1,index=2', count=True)
+        self.assertEqual(len(steps), 3)
+        alter, create, reflect = steps
+
+        self.assertEqual(alter.kind, REWRITE)
+        rewrite = [op for op in alter.operations if op.kind == REWRITE]
+        self.assertEqual(len(rewrite), 1)
+        self.assertEqual((rewrite[0].table, rewrite[0].rows), ('tmp_plan', 2))
+        index = alter.operations[-1]
+        self.assertEqual((index.kind, index.table), (INDEX, 'tmp_plan'))
+        self.assertAlmostEqual(alter.duration, 3, 1)
+
+        self.assertEqual(create.kind, METADATA)
+        self.assertTrue(create.duration < 1)
+        self.assertEqual(reflect.kind, None)
+        self.assertTrue(reflect.error)
+
+        # nothing was changed
+        self.assertEqual(api.db_version(url, self.repos), 1)
+
+        saved = self.tmp()
+        text = api.plan(url, self.repos, throughput='rewrite=1,index=2',
+                        count=True, save=saved)
+        lines = text.splitlines()
+        ranked = lines[lines.index('Riskiest steps:') + 1:]
+        self.assertEqual(len(ranked), 3)
+        self.assertTrue(ranked[0].startswith('  3 -> 4: unknown'))
+        self.assertTrue(ranked[1].startswith('  1 -> 2: rewrite, 3.0'))
+
+        # the saved plan runs once the database is at its start version
+        self.assertRaises(exceptions.KnownError, api.upgrade, url,
+                          self.repos, 3, plan=saved)
+        api.upgrade(url, self.repos, 2)
+        self.assertRaises(exceptions.KnownError, api.upgrade, url,
+                          self.repos, plan=saved)
+        api.downgrade(url, self.repos, 1)
+        self.assertRaises(exceptions.KnownError, api.downgrade, url,
+                          self.repos, 0, plan=saved)
+        api.upgrade(url, self.repos, plan=saved)
+        self.assertEqual(api.db_version(url, self.repos), 4)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+try:
+    import json
+except ImportError:
+    # python < 2.6
+    import simplejson as json
+
+from sqlalchemy import *
+from sqlalchemy import exc
+
+from migrate import exceptions
+from migrate.versioning import api
+from migrate.versioning.replay import fingerprint, Recording, ReplayScript
+from migrate.versioning.repository import Repository
+from migrate.versioning.schema import ControlledSchema
+
+from migrate.tests import fixture
+
+
+SCRIPTS = [
+"""
+from sqlalchemy import *
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    Table('tmp_replay', meta, Column('id', Integer, primary_key=True)).create()
+
+def downgrade(migrate_engine):
+    pass
+""",
+"""
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    table = Table('tmp_replay', meta, autoload=True)
+    Column('data', String(40)).create(table)
+    table.insert().execute(id=1, data='first')
+
+def downgrade(migrate_engine):
+    pass
+""",
+]
+
+
+# makes CHECKPOINT_SCRIPT fail after its checkpoint while it is not empty
+fail = []
+
+CHECKPOINT_SCRIPT = """
+from migrate.tests.versioning.test_replay import fail
+
+def upgrade(migrate_engine):
+    if not migrate_engine.last_checkpoint('batch', 0):
+        migrate_engine.execute("INSERT INTO tmp_replay VALUES (2, 'second')")
+        migrate_engine.checkpoint('batch', 1)
+    if fail:
+        raise ValueError()
+    migrate_engine.execute("INSERT INTO tmp_replay VALUES (3, 'third')")
+
+def downgrade(migrate_engine):
+    pass
+"""
+
+
+class TestReplay(fixture.Pathed):
+
+    def setUp(self):
+        super(TestReplay, self).setUp()
+        self.repos = self.tmp_repos()
+        api.create(self.repos, 'repository_name')
+        for source in SCRIPTS:
+            api.script('', self.repos)
+            self.write_latest(source)
+        self.recording = self.tmp()
+        del fail[:]
+
+    def write_latest(self, source):
+        versions = os.path.join(self.repos, 'versions')
+        path = os.path.join(versions, '%03d.py' % len(
+            [name for name in os.listdir(versions)
+             if name.endswith('.py') and name[0].isdigit()]))
+        fd = open(path, 'w')
+        fd.write(source)
+        fd.close()
+
+    def database(self):
+        url = 'sqlite:///%s' % self.tmp()
+        api.version_control(url, self.repos)
+        return url
+
+    def test_fingerprint(self):
+        engine = create_engine('sqlite://')
+        empty = fingerprint(engine)
+        meta = MetaData(bind=engine)
+        table = Table('tmp_replay', meta, Column('id', Integer))
+        table.create()
+        self.assertNotEqual(fingerprint(engine), empty)
+        self.assertEqual(fingerprint(engine, exclude=['tmp_replay']), empty)
+
+    def test_replay(self):
+        reference = self.database()
+        api.upgrade(reference, self.repos, record=self.recording)
+        fd = open(self.recording)
+        data = json.load(fd)
+        fd.close()
+        self.assertEqual(sorted(data['steps'].keys()), ['0:1', '1:2'])
+        statements = [sql for sql, parameters in data['steps']['1:2']
+                      ['statements']]
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(statements[0].strip().startswith('ALTER TABLE'))
+
+        # matching databases execute the recorded statements
+        tenant = self.database()
+        recording = Recording(self.recording,
+            ControlledSchema(create_engine(tenant), self.repos))
+        change = Repository(self.repos).version(1).script()
+        self.assertTrue(isinstance(recording.replayer(0, change, 1),
+                                   ReplayScript))
+
+        api.upgrade(tenant, self.repos, replay=self.recording)
+        self.assertEqual(api.db_version(tenant, self.repos), 2)
+        engine = create_engine(tenant)
+        rows = engine.execute('SELECT id, data FROM tmp_replay').fetchall()
+        self.assertEqual(rows, [(1, 'first')])
+        self.assertEqual(fingerprint(engine, ['migrate_version']),
+            fingerprint(create_engine(reference), ['migrate_version']))
+
+        # other databases run the scripts
+        other = self.database()
+        engine = create_engine(other)
+        engine.execute('CREATE TABLE tmp_other (id INTEGER)')
+        recording = Recording(self.recording,
+            ControlledSchema(engine, self.repos))
+        self.assertTrue(recording.replayer(0, change, 1) is change)
+        api.upgrade(other, self.repos, replay=self.recording)
+        rows = engine.execute('SELECT id, data FROM tmp_replay').fetchall()
+        self.assertEqual(rows, [(1, 'first')])
+
+    def test_other_repository(self):
+        fd = open(self.recording, 'w')
+        json.dump(dict(format=1, repository='other', steps={}), fd)
+        fd.close()
+        self.assertRaises(exceptions.KnownError, api.upgrade,
+            self.database(), self.repos, replay=self.recording)
+
+    def steps(self):
+        fd = open(self.recording)
+        data = json.load(fd)
+        fd.close()
+        return data['steps']
+
+    def test_checkpoints(self):
+        """Statements on the checkpoint table are not recorded"""
+        api.script('', self.repos)
+        self.write_latest(CHECKPOINT_SCRIPT)
+        url = self.database()
+        api.upgrade(url, self.repos, record=self.recording)
+        statements = [sql for sql, parameters in
+                      self.steps()['2:3']['statements']]
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(statements[0].startswith('INSERT INTO tmp_replay'))
+        self.assertTrue(statements[1].startswith('INSERT INTO tmp_replay'))
+
+    def test_resumed(self):
+        """Steps resuming from checkpoints are not recorded"""
+        api.script('', self.repos)
+        self.write_latest(CHECKPOINT_SCRIPT)
+        url = self.database()
+        fail.append(True)
+        self.assertRaises(ValueError, api.upgrade, url, self.repos,
+                          record=self.recording)
+        del fail[:]
+        api.upgrade(url, self.repos, record=self.recording)
+        self.assertEqual(api.db_version(url, self.repos), 3)
+        self.assertEqual(sorted(self.steps().keys()), ['0:1', '1:2'])
+        rows = create_engine(url).execute(
+            'SELECT id FROM tmp_replay ORDER BY id').fetchall()
+        self.assertEqual(rows, [(1,), (2,), (3,)])
+
+    def test_failure(self):
+        """Failing replays are rolled back"""
+        url = self.database()
+        engine = create_engine(url)
+        engine.execute('CREATE TABLE tmp_replay (id INTEGER)')
+        recording = Recording(self.recording,
+                              ControlledSchema(engine, self.repos))
+        recording.trusted = True
+        change = Repository(self.repos).version(1).script()
+        replay = ReplayScript(change, recording,
+            [('INSERT INTO tmp_replay VALUES (1)', None),
+             ('INSERT INTO tmp_missing VALUES (1)', None)])
+        self.assertRaises(exc.OperationalError, replay.run, engine, 1)
+        self.assertFalse(recording.trusted)
+        self.assertEqual(
+            engine.execute('SELECT id FROM tmp_replay').fetchall(), [])
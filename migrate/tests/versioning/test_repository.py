@@ -47,6 +47,32 @@ class TestRepository(fixture.Pathed):
         # version_table's default isn't none
         self.assertNotEquals(repos.config.get('db_settings', 'version_table'), 'None')
     
+    def test_load_modified(self):
+        """Repositories are loaded again when their files change"""
+        path = self.test_create()
+        repos = Repository(path)
+        self.assert_(Repository(path) is repos)
+
+        # a script deployed by another process
+        f = open(os.path.join(path, 'versions', '001_deployed.py'), 'w')
+        f.write('def upgrade(migrate_engine):\n    pass\n')
+        f.close()
+        repos2 = Repository(path)
+        self.assert_(repos2 is not repos)
+        self.assertEquals(repos2.latest, 1)
+
+    def test_script_modified(self):
+        """Scripts edited in place are imported again"""
+        path = self.test_create()
+        script = os.path.join(path, 'versions', '001_edited.py')
+        for value in (1, 2):
+            f = open(script, 'w')
+            f.write('value = %d\ndef upgrade(migrate_engine):\n    pass\n'
+                    % value)
+            f.close()
+            module = Repository(path).version(1).script().module
+            self.assertEquals(module.value, value)
+
     def test_load_notfound(self):
         """Nonexistant repositories shouldn't be loaded"""
         path = self.tmp_repos()
@@ -203,6 +229,36 @@ class TestVersionedRepository(fixture.Pathed):
         check_changeset((10, 5), 5)
         check_changeset((5, 0), 5)
         
+    def test_plan(self):
+        """Plans are saved and refused when their scripts changed"""
+        repos = Repository(self.path_repos)
+        for i in range(3):
+            repos.create_script('')
+
+        plan = repos.plan('postgres', 0)
+        self.assertEqual([int(ver) for ver, change in plan], [0, 1, 2])
+        self.assertEqual((plan.start, plan.end, plan.step), (0, 3, 1))
+        self.assertEqual(len(plan.checksums), 3)
+        self.assertEqual(list(plan), repos.changeset('postgres', 0).items())
+
+        path = self.tmp()
+        repos.plan('postgres', 3, 1).save(path)
+        loaded = MigrationPlan.load(path, repos)
+        self.assertEqual([int(ver) for ver, change in loaded], [3, 2])
+        self.assertEqual([change.path for ver, change in loaded],
+                         [repos.version(3).script().path,
+                          repos.version(2).script().path])
+        self.assertEqual((loaded.end, loaded.step), (1, -1))
+
+        self.assertRaises(exceptions.KnownError, MigrationPlan.load, path,
+                          Repository.create(self.tmp_repos(), 'other'))
+
+        fd = open(repos.version(2).script().path, 'a')
+        fd.write('# changed\n')
+        fd.close()
+        self.assertRaises(exceptions.KnownError, MigrationPlan.load, path,
+                          repos)
+
     def test_many_versions(self):
         """Test what happens when lots of versions are created"""
         repos = Repository(self.path_repos)
@@ -2,13 +2,17 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import shutil
+import socket
+import subprocess
 
 from migrate import exceptions
 from migrate.versioning.schema import *
 from migrate.versioning import script, schemadiff
 
 from sqlalchemy import *
+from sqlalchemy import exc
 
 from migrate.tests import fixture
 
@@ -77,6 +81,32 @@ class TestControlledSchema(fixture.Pathed, fixture.DB):
         self.assertRaises(exceptions.DatabaseNotControlledError,
             ControlledSchema, self.engine, self.repos)
 
+    @fixture.usedb()
+    def test_load_verify(self):
+        """The version table is only reflected in verify mode"""
+        dbcontrol = ControlledSchema.create(self.engine, self.repos)
+
+        # another application extended the version table
+        self.engine.execute('ALTER TABLE %s ADD COLUMN extra INTEGER'
+                            % self.repos.version_table)
+        dbcontrol = ControlledSchema(self.engine, self.repos)
+        self.assertFalse('extra' in dbcontrol.table.c)
+        dbcontrol = ControlledSchema(self.engine, self.repos, verify=True)
+        self.assertTrue('extra' in dbcontrol.table.c)
+        self.assertEqual(dbcontrol.version, 0)
+        dbcontrol.drop()
+
+        # a table of the same name that isn't a version table
+        table = Table(self.repos.version_table, MetaData(self.engine),
+            Column('repository_id', String(250)))
+        table.create()
+        try:
+            for verify in (False, True):
+                self.assertRaises(exceptions.DatabaseNotControlledError,
+                    ControlledSchema, self.engine, self.repos, verify)
+        finally:
+            table.drop()
+
     @fixture.usedb()
     def test_version_control_specified(self):
         """Establish version control with a specified version"""
@@ -159,6 +189,250 @@ class TestControlledSchema(fixture.Pathed, fixture.DB):
         # cleanup
         dbschema.drop()
 
+    @fixture.usedb()
+    def test_history(self):
+        """Applied change scripts are recorded in history_table"""
+        # history is disabled by default
+        dbschema = ControlledSchema.create(self.engine, self.repos)
+        self.assertRaises(exceptions.KnownError, dbschema.history)
+        dbschema.drop()
+
+        repos = Repository.create(self.temp_usable_dir + '/history_repo/',
+            'history_repo', history_table='migrate_version_history')
+        self.assertEquals(repos.history_table, 'migrate_version_history')
+        dbschema = ControlledSchema.create(self.engine, repos)
+        self.assertEquals(len(dbschema.history()), 0)
+
+        for i in range(3):
+            repos.create_script('')
+        fd = open(repos.version(1).script().path, 'w')
+        fd.write(UPDATE_SCRIPT)
+        fd.close()
+        dbschema.upgrade(3)
+        dbschema.upgrade(1)
+
+        rows = dbschema.history()
+        self.assertEquals(len(rows), 5)
+        durations = [row['duration'] for row in rows]
+        self.assertEquals(durations, sorted(durations, reverse=True))
+        directions = [row['direction'] for row in rows]
+        self.assertEquals(directions.count('upgrade'), 3)
+        self.assertEquals(directions.count('downgrade'), 2)
+        rowcounts = [(row['start_version'], row['rows_affected'])
+                     for row in rows if row['direction'] == 'upgrade']
+        rowcounts.sort()
+        self.assertEquals(rowcounts, [(0, 1), (1, 0), (2, 0)])
+        for row in rows:
+            self.assertEquals(row['script_hash'],
+                repos.version(max(row['start_version'],
+                    row['end_version'])).script().checksum())
+            self.assertTrue(row['finished'] >= row['started'])
+
+        self.assertEquals(len(dbschema.history(limit=2)), 2)
+
+        # cleanup
+        dbschema.drop()
+
+    @fixture.usedb()
+    def test_checkpoints(self):
+        """Failed change scripts resume from their last checkpoint"""
+        dbschema = ControlledSchema.create(self.engine, self.repos)
+        self.assertEquals(dbschema.checkpoints(), [])
+        table = Table('tmp_checkpoint', MetaData(self.engine),
+                      Column('id', Integer, primary_key=True))
+        table.create()
+        self.repos.create_script('')
+        fd = open(self.repos.version(1).script().path, 'w')
+        fd.write(CHECKPOINT_SCRIPT)
+        fd.close()
+
+        try:
+            self.assertRaises(ValueError, dbschema.upgrade, 1)
+            self.assertEquals(dbschema.version, 0)
+            ids = [row[0] for row in self.engine.execute(table.select())]
+            self.assertEquals(sorted(ids), [0, 1, 2])
+            rows = dbschema.checkpoints()
+            self.assertEquals([(row['start_version'], row['end_version'],
+                                row['name'], row['state']) for row in rows],
+                              [(0, 1, 'rows', '3')])
+
+            self.assertEquals(dbschema.clear_checkpoints(2), 0)
+            dbschema.upgrade(1)
+            self.assertEquals(dbschema.version, 1)
+            ids = [row[0] for row in self.engine.execute(table.select())]
+            self.assertEquals(sorted(ids), range(6))
+            self.assertEquals(dbschema.checkpoints(), [])
+        finally:
+            table.drop()
+            Table(self.repos.checkpoint_table, MetaData(self.engine)).drop()
+        dbschema.drop()
+
+    @fixture.usedb(supported='sqlite')
+    def test_retry(self):
+        """Change scripts failing with a lock timeout run again"""
+        from migrate.changeset.policy import DDLPolicy
+        dbschema = ControlledSchema.create(self.engine, self.repos)
+        table = Table('tmp_retry', MetaData(self.engine),
+                      Column('id', Integer, primary_key=True))
+        table.create()
+        self.repos.create_script('')
+        fd = open(self.repos.version(1).script().path, 'w')
+        fd.write(RETRY_SCRIPT)
+        fd.close()
+        module = self.repos.version(1).script().module
+
+        try:
+            self.assertRaises(exc.OperationalError, dbschema.upgrade, 1)
+            self.assertEquals(dbschema.version, 0)
+            self.assertEquals(self.engine.execute(table.select()).fetchall(),
+                              [])
+
+            del module.attempts[:]
+            dbschema.ddl_policy = DDLPolicy(retries=1, backoff=0)
+            dbschema.upgrade(1)
+            self.assertEquals(dbschema.version, 1)
+            self.assertEquals(module.attempts, [0, 1])
+            # the insert of the first run was rolled back
+            self.assertEquals(
+                [row[0] for row in self.engine.execute(table.select())], [1])
+        finally:
+            table.drop()
+        dbschema.drop()
+
+    @fixture.usedb()
+    def test_lock(self):
+        """Concurrent upgrades wait for the migration lock"""
+        dbschema = ControlledSchema.create(self.engine, self.repos)
+        self.repos.create_script('')
+
+        lock = dbschema.lock()
+        lock.acquire()
+        try:
+            self.assertRaises(exceptions.LockTimeoutError,
+                dbschema.lock(timeout=0).acquire)
+            self.assertRaises(exceptions.LockTimeoutError, dbschema.upgrade,
+                lock_timeout=0)
+            self.assertEquals(dbschema.version, 0)
+
+            # another process upgrades while we are waiting
+            other = ControlledSchema(self.engine, self.repos)
+            other.runchange(0, self.repos.version(1).script(), 1)
+        finally:
+            lock.release()
+
+        self.assertEquals(dbschema.version, 0)
+        dbschema.upgrade(lock_timeout=0)
+        self.assertEquals(dbschema.version, 1)
+
+        # the lock can be acquired again once released
+        lock = dbschema.lock(timeout=0)
+        lock.acquire()
+        lock.release()
+
+        # cleanup
+        dbschema.drop()
+
+    @fixture.usedb()
+    def test_stale_lock(self):
+        """Locks of killed processes are removed"""
+        from migrate.versioning import api, locking
+        dbschema = ControlledSchema.create(self.engine, self.repos)
+        lock = dbschema.lock(timeout=0)
+        if not isinstance(lock, locking.RowLock):
+            return
+        lock.acquire()
+        lock.release()
+        table = lock.table
+
+        # a process of this host that no longer runs
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        owner = '%s:%d' % (socket.gethostname(), process.pid)
+        self.engine.execute(table.insert(), name=lock.name, owner=owner)
+        lock.acquire()
+        self.assertEquals(lock._holder(), '%s since %s' % (lock.owner,
+            lock._read(lock.connection)['acquired']))
+        lock.release()
+
+        # processes of other hosts may still run
+        self.engine.execute(table.insert(), name=lock.name,
+                            owner='otherhost:1')
+        self.assertRaises(exceptions.LockTimeoutError, lock.acquire)
+        self.assertRaises(exceptions.KnownError, api.release_lock,
+                          self.url, self.repos.path)
+        self.assertTrue(api.release_lock(self.url, self.repos.path,
+            force=True).startswith('otherhost:1 since'))
+        self.assertEquals(api.release_lock(self.url, self.repos.path), None)
+        lock.acquire()
+        lock.release()
+
+        # errors other than a held lock are raised
+        lock.connection = self.engine.connect()
+        try:
+            table.drop(bind=self.engine)
+            self.assertRaises(exc.OperationalError, lock._try_acquire)
+        finally:
+            lock.connection.close()
+            lock.connection = None
+        dbschema.drop()
+
+    @fixture.usedb()
+    def test_group(self):
+        """Repositories sharing a database are upgraded together"""
+        core = Repository.create(self.temp_usable_dir + '/core/', 'core')
+        billing = Repository.create(self.temp_usable_dir + '/billing/',
+            'billing', depends_on='core')
+        self.assertEquals(billing.depends_on, ['core'])
+        script = """
+def upgrade(migrate_engine):
+    migrate_engine.execute("INSERT INTO temp_applied VALUES ('%s')")
+
+def downgrade(migrate_engine):
+    migrate_engine.execute("INSERT INTO temp_applied VALUES ('-%s')")
+"""
+        for repo in (core, billing):
+            for i in range(2):
+                repo.create_script('')
+                fd = open(repo.version(i + 1).script().path, 'w')
+                name = '%s %d' % (repo.id, i + 1)
+                fd.write(script % (name, name))
+                fd.close()
+
+        applied = Table('temp_applied', MetaData(self.engine),
+            Column('name', String(20)))
+        applied.create()
+        try:
+            self.assertRaises(exceptions.DatabaseNotControlledError,
+                ControlledSchemaGroup, self.engine, [billing, core])
+            ControlledSchema.create(self.engine, billing)
+            ControlledSchema.create(self.engine, core, 1)
+
+            group = ControlledSchemaGroup(self.engine,
+                [billing.path, core.path])
+            self.assertEquals(group.repositories, [core, billing])
+            self.assertEquals(group.versions, dict(core=1, billing=0))
+
+            group.upgrade(dict(billing=1))
+            self.assertEquals(group.versions, dict(core=2, billing=1))
+            names = [row[0] for row in applied.select().execute()]
+            self.assertEquals(names, ['core 2', 'billing 1'])
+            self.assertEquals(ControlledSchema(self.engine, billing).version,
+                1)
+
+            # billing depends on core, it is downgraded first
+            applied.delete().execute()
+            group.upgrade(dict(core=1, billing=0))
+            self.assertEquals(group.versions, dict(core=1, billing=0))
+            names = [row[0] for row in applied.select().execute()]
+            self.assertEquals(names, ['-billing 1', '-core 2'])
+
+            # dependencies have to be part of the group
+            self.assertRaises(exceptions.KnownError, ControlledSchemaGroup,
+                self.engine, [billing])
+        finally:
+            applied.drop()
+            ControlledSchema(self.engine, core).drop()
+
     @fixture.usedb()
     def test_create_model(self):
         """Test workflow to generate create_model"""
@@ -201,3 +475,51 @@ class TestControlledSchema(fixture.Pathed, fixture.DB):
         return meta
 
     # TODO: test how are tables populated in db
+
+
+UPDATE_SCRIPT = """
+def upgrade(migrate_engine):
+    migrate_engine.execute("UPDATE migrate_version "
+        "SET repository_path = repository_path "
+        "WHERE repository_id = 'history_repo'")
+
+def downgrade(migrate_engine):
+    pass
+"""
+
+CHECKPOINT_SCRIPT = """
+from sqlalchemy import *
+
+def upgrade(migrate_engine):
+    table = Table('tmp_checkpoint', MetaData(),
+                  Column('id', Integer, primary_key=True))
+    start = migrate_engine.last_checkpoint('rows', 0)
+    for i in range(start, 6):
+        migrate_engine.execute(table.insert(), id=i)
+        if i == 2:
+            migrate_engine.checkpoint('rows', i + 1)
+        if i == 4 and start == 0:
+            raise ValueError('interrupted')
+
+def downgrade(migrate_engine):
+    pass
+"""
+
+RETRY_SCRIPT = """
+from sqlalchemy import *
+from sqlalchemy import exc
+
+attempts = []
+
+def upgrade(migrate_engine):
+    table = Table('tmp_retry', MetaData(),
+                  Column('id', Integer, primary_key=True))
+    migrate_engine.execute(table.insert(), id=1)
+    attempts.append(len(attempts))
+    if len(attempts) == 1:
+        raise exc.OperationalError('INSERT INTO tmp_retry', {},
+                                   Exception('database is locked'))
+
+def downgrade(migrate_engine):
+    pass
+"""
@@ -5,6 +5,9 @@ import os
 import sys
 import shutil
 
+from sqlalchemy import create_engine
+from sqlalchemy.interfaces import PoolListener
+
 from migrate import exceptions
 from migrate.versioning import version, repository
 from migrate.versioning.script import *
@@ -134,6 +137,83 @@ def upgrade(migrate_engine):
         """, SQL)
         # TODO: test: No SQL should be executed!
 
+    @fixture.usedb()
+    def test_run_context(self):
+        """Scripts run on one connection, in one transaction"""
+        path = self.tmp_py()
+        f = open(path, 'w')
+        f.write("""
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    table = Table('tmp_context', meta, Column('id', Integer))
+    table.create()
+    table.insert().execute(id=1)
+    Column('data', String(20), default='first').create(table)
+    table = Table('tmp_context', MetaData(bind=migrate_engine),
+                  autoload=True)
+    table.c.data.alter(name='value')
+    Index('ix_tmp_context_id', table.c.id).create()
+    assert migrate_engine.has_table('tmp_context')
+
+def downgrade(migrate_engine):
+    migrate_engine.execute("INSERT INTO tmp_context VALUES (2, 'second')")
+    raise ValueError()
+""")
+        f.close()
+
+        checkouts = []
+        class Listener(PoolListener):
+            def checkout(self, *args):
+                checkouts.append(args)
+
+        engine = create_engine(self.url)
+        engine.pool.add_listener(Listener())
+        pyscript = self.cls(path)
+        try:
+            pyscript.run(engine, 1)
+            self.assertEqual(len(checkouts), 1)
+            rows = engine.execute('SELECT id, value FROM tmp_context')
+            self.assertEqual(rows.fetchall(), [(1, 'first')])
+
+            # failed scripts are rolled back
+            self.assertRaises(ValueError, pyscript.run, engine, -1)
+            rows = engine.execute('SELECT id FROM tmp_context')
+            self.assertEqual(rows.fetchall(), [(1,)])
+        finally:
+            engine.execute('DROP TABLE tmp_context')
+            engine.dispose()
+
+    @fixture.usedb()
+    def test_run_transactional(self):
+        """Scripts may opt out of their transaction"""
+        path = self.tmp_py()
+        f = open(path, 'w')
+        f.write("""
+transactional = False
+engines = []
+
+def upgrade(migrate_engine):
+    engines.append(migrate_engine)
+
+def downgrade(migrate_engine):
+    pass
+""")
+        f.close()
+
+        pyscript = self.cls(path)
+        connection = self.engine.connect()
+        try:
+            pyscript.run(connection, 1)
+            pyscript.run(self.engine, 1)
+            self.assertEqual(pyscript.module.engines,
+                             [connection, self.engine])
+            self.assertFalse(connection.in_transaction())
+        finally:
+            connection.close()
+
     def test_verify_success(self):
         """Correctly verify a python migration script: success"""
         path = self.tmp_py()
@@ -266,3 +346,26 @@ class TestSqlScript(fixture.Pathed, fixture.DB):
         sqls = SqlScript(src)
         sqls.run(self.engine, executemany=False)
         tmp_sql_table.metadata.drop_all(self.engine, checkfirst=True)
+
+    def test_connection(self):
+        """Scripts run on the connection they are given"""
+        engine = create_engine('sqlite:///%s' % self.tmp(),
+                               connect_args=dict(timeout=0))
+        engine.execute('CREATE TABLE tmp_sql_connection (id INTEGER)')
+        src = self.tmp()
+        f = open(src, 'w')
+        f.write('INSERT INTO tmp_sql_connection VALUES (2);\n'
+                'INSERT INTO tmp_sql_connection VALUES (3);\n')
+        f.close()
+
+        connection = engine.connect()
+        try:
+            # another connection would wait for the lock of this one
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('INSERT INTO tmp_sql_connection VALUES (1)')
+            self.assertEqual(SqlScript(src).run(connection), 2)
+        finally:
+            connection.close()
+        self.assertEqual(engine.execute('SELECT count(*) FROM '
+                                        'tmp_sql_connection').scalar(), 3)
+        engine.dispose()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+from migrate import exceptions
+from migrate.versioning import api
+from migrate.versioning.server import Server, call
+from migrate.versioning.util import engines
+
+from migrate.tests import fixture
+
+
+class TestServer(fixture.Pathed):
+
+    def setUp(self):
+        super(TestServer, self).setUp()
+        self.repos = self.tmp_repos()
+        api.create(self.repos, 'repository_name')
+        api.script('first', self.repos)
+        self.url = 'sqlite:///%s' % self.tmp()
+        self.socket = self.tmp()
+        engines.close_all()
+        self.server = Server(self.socket, repository=self.repos)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        super(TestServer, self).tearDown()
+
+    def test_commands(self):
+        """Commands are run with the server's default options"""
+        self.assertEqual(call(self.socket, 'version'), 1)
+        call(self.socket, 'version_control', self.url)
+        self.assertEqual(call(self.socket, 'db_version', self.url), 0)
+        call(self.socket, 'upgrade', self.url)
+        self.assertEqual(call(self.socket, 'db_version', url=self.url), 1)
+
+        # the engine is kept between commands
+        self.assertEqual(len(engines.engines), 1)
+
+    def test_errors(self):
+        """Failing commands don't stop the server"""
+        self.assertRaises(exceptions.ServerError, call, self.socket, 'foobar')
+        self.assertRaises(exceptions.ServerError, call, self.socket, 'serve',
+            self.socket)
+        self.assertRaises(exceptions.ServerError, call, self.socket,
+            'db_version', self.url)
+        self.assertRaises(exceptions.ServerError, call, self.socket,
+            'version', self.repos, 'too many')
+        self.assertEqual(call(self.socket, 'version'), 1)
+
+    def test_stale_socket(self):
+        """Only one server listens on a socket"""
+        self.assertRaises(exceptions.KnownError, Server, self.socket)
+        self.assertEqual(os.stat(self.socket).st_mode & 0777, 0700)
@@ -83,6 +83,8 @@ class TestShellCommands(Shell):
         shell.main(['create', 'repo_name', '--preview_sql'], repository=repos)
         shell.main(['version', '--', '--repository=%s' % repos])
         shell.main(['version', '-d', '--repository=%s' % repos, '--version=2'])
+        shell.main(['version', '--profile', '--profile_limit=5',
+                    '--repository=%s' % repos])
 
         self._check_error(['foobar'],2,'error: Invalid command foobar')
         self._check_error(['create', 'f', 'o', 'o'],2,'error: Too many arguments for command create: o')
@@ -63,6 +63,75 @@ class TestUtil(fixture.Pathed):
         # unsupported argument
         self.assertRaises(ValueError, construct_engine, 1)
 
+    def test_engine_registry(self):
+        """Engines are shared between API calls"""
+        registry = EngineRegistry(keep=0)
+        url = 'sqlite:///%s' % self.tmp()
+
+        engine = registry.acquire(url, engine_arg_echo='False')
+        self.assertTrue(registry.acquire(url, engine_dict={'echo': False})
+            is engine)
+        self.assertFalse(registry.acquire(url) is engine)
+        self.assertFalse(registry.acquire(url, engine_arg_echo='True')
+            is engine)
+
+        # engines in use aren't closed
+        self.assertEqual(registry.close_all(), 3)
+        registry.release(engine)
+        self.assertEqual(len(registry.engines), 3)
+        # the last release disposes the engine
+        registry.release(engine)
+        self.assertEqual(len(registry.engines), 2)
+        self.assertFalse(registry.acquire(url, engine_arg_echo='False')
+            is engine)
+
+        # engines passed in are used as they are
+        engine = create_engine(url)
+        self.assertTrue(registry.acquire(engine) is engine)
+        registry.release(engine)
+        self.assertFalse(registry.acquire(url) is engine)
+
+        # engines not in use are kept by default
+        registry = EngineRegistry()
+        engine = registry.acquire(url)
+        registry.release(engine)
+        self.assertTrue(registry.acquire(url) is engine)
+        registry.release(engine)
+        self.assertEqual(registry.close_all(), 0)
+        self.assertFalse(registry.acquire(url) is engine)
+
+        # unless they are shared
+        engine = create_engine(url)
+        registry = EngineRegistry()
+        registry.share(engine)
+        self.assertTrue(registry.acquire(url) is engine)
+        self.assertFalse(registry.acquire(url, engine_arg_echo='True')
+            is engine)
+        registry.release(engine)
+        self.assertTrue(registry.acquire(url) is engine)
+        registry.release(engine)
+        registry.close_all()
+        self.assertFalse(registry.acquire(url) is engine)
+        engine.dispose()
+
+    def test_engine_registry_keep(self):
+        """The most recently used engines can be kept"""
+        registry = EngineRegistry(keep=2)
+        urls = ['sqlite:///%s' % self.tmp() for i in range(3)]
+        engines = []
+        for url in urls:
+            engines.append(registry.acquire(url))
+            registry.release(engines[-1])
+        self.assertEqual(len(registry.engines), 2)
+        self.assertFalse(registry.acquire(urls[0]) is engines[0])
+        self.assertTrue(registry.acquire(urls[2]) is engines[2])
+        self.assertEqual(registry.close_all(), 2)
+
+        # engines of another process are forgotten
+        registry._pid = -1
+        self.assertFalse(registry.acquire(urls[2]) is engines[2])
+        self.assertEqual(len(registry.engines), 1)
+
     def test_asbool(self):
         """test asbool parsing"""
         result = asbool(True)
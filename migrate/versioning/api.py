@@ -30,9 +30,10 @@ import inspect
 import logging
 
 from migrate import exceptions
-from migrate.versioning import (repository, schema, version,
-    script as script_) # command name conflict
-from migrate.versioning.util import catch_known_errors, with_engine
+from migrate.versioning import (repository, version,
+    script as script_, bundle as bundle_, census,
+    plan as plan_) # command name conflict
+from migrate.versioning.util import catch_known_errors, with_engine, asbool
 
 
 log = logging.getLogger(__name__)
@@ -42,13 +43,22 @@ command_desc = {
     'script': 'create an empty change Python script',
     'script_sql': 'create empty change SQL scripts for given database',
     'version': 'display the latest version available in a repository',
+    'bundle': 'write a repository into a single precompiled bundle file',
+    'verify_bundle': 'check every file of a bundle and the digest of its manifest',
     'db_version': 'show the current version of the repository under version control',
+    'db_versions': 'show the current versions of many databases, querying them concurrently',
+    'history': 'show the slowest change scripts applied to a database',
+    'checkpoints': 'show the checkpoints saved by change scripts that failed',
+    'clear_checkpoints': 'delete the checkpoints of change scripts so that they start over',
+    'release_lock': 'remove the migration lock left behind by a killed process',
+    'plan': 'estimate which steps of an upgrade rewrite or lock large tables and how long they take',
     'source': 'display the Python code for a particular version in this repository',
     'version_control': 'mark a database as under this repository\'s version control',
     'upgrade': 'upgrade a database to a later version',
     'downgrade': 'downgrade a database to an earlier version',
     'drop_version_control': 'removes version control from a database',
     'manage': 'creates a Python script that runs Migrate with a set of default values',
+    'serve': 'run commands received on a Unix domain socket, keeping repositories and connections open',
     'test': 'performs the upgrade and downgrade command on the given database',
     'compare_model_to_db': 'compare MetaData against the current database state',
     'create_model': 'dump the current database as a Python model to stdout',
@@ -58,7 +68,7 @@ command_desc = {
 __all__ = command_desc.keys()
 
 Repository = repository.Repository
-ControlledSchema = schema.ControlledSchema
+MigrationPlan = repository.MigrationPlan
 VerNum = version.VerNum
 PythonScript = script_.PythonScript
 SqlScript = script_.SqlScript
@@ -134,6 +144,39 @@ def version(repository, **opts):
     return repo.latest
 
 
+@catch_known_errors
+def bundle(repository, dest, **opts):
+    """%prog bundle REPOSITORY_PATH DESTINATION
+
+    Write the repository into a single bundle file at DESTINATION,
+    holding the change scripts, their compiled code, the parsed
+    migrate.cfg and a version index.
+
+    The bundle can be used instead of REPOSITORY_PATH in every other
+    command.  Prints the SHA1 digest of the bundle manifest, which
+    changes whenever any bundled file does.
+    """
+    repo = Repository(repository)
+    return bundle_.create(repo, dest)
+
+
+@catch_known_errors
+def verify_bundle(repository, digest=None, **opts):
+    """%prog verify_bundle BUNDLE [DIGEST]
+
+    Check every file of a bundle against its manifest and, if DIGEST is
+    given, the SHA1 digest of the manifest printed by the bundle
+    command. Prints the digest of the manifest.
+
+    upgrade and downgrade check the digest of a bundle given with
+    --bundle_digest=DIGEST before running any change script.
+    """
+    repo = Repository(repository)
+    if repo.bundle is None:
+        raise exceptions.KnownError("%s is not a bundle" % repository)
+    return repo.bundle.verify(digest)
+
+
 @with_engine
 def db_version(url, repository, **opts):
     """%prog db_version URL REPOSITORY_PATH
@@ -143,12 +186,162 @@ def db_version(url, repository, **opts):
     repository.
 
     The url should be any valid SQLAlchemy connection string.
+
+    With --verify, the version table is reflected from the database
+    and its columns are checked.
     """
+    from migrate.versioning.schema import ControlledSchema
     engine = opts.pop('engine')
-    schema = ControlledSchema(engine, repository)
+    verify = asbool(opts.get('verify', False))
+    schema = ControlledSchema(engine, repository, verify=verify)
     return schema.version
 
 
+def db_versions(urls, repository, concurrency=10, format='csv', **opts):
+    """%prog db_versions URLS REPOSITORY_PATH [--concurrency=10] [--format=csv]
+
+    Show the current versions of the repository in many databases.
+    URLS is a file listing one connection string per line, or - to
+    read them from standard input.
+
+    The databases are queried CONCURRENCY at a time. A line is printed
+    for every database as soon as its version is known, either as CSV
+    (url,version,error) or, with --format=json, as one JSON object per
+    line. Passwords are masked.
+    """
+    if isinstance(urls, basestring):
+        if urls == '-':
+            fd = sys.stdin
+        else:
+            fd = open(urls)
+        urls = [line.strip() for line in fd
+                if line.strip() and not line.strip().startswith('#')]
+        if fd is not sys.stdin:
+            fd.close()
+    repo = Repository(repository)
+    results = census.census(urls, repo, concurrency, **opts)
+    failed = census.write(results, format)
+    if failed:
+        log.warning('%d databases could not be queried', failed)
+
+
+@with_engine
+def history(url, repository, limit=10, **opts):
+    """%prog history URL REPOSITORY_PATH [LIMIT]
+
+    Show the slowest change scripts applied to the database with the
+    given connection string, as recorded in the repository's
+    history_table.
+
+    At most LIMIT steps are shown (10 by default).
+    """
+    from migrate.versioning.schema import ControlledSchema
+    engine = opts.pop('engine')
+    schema = ControlledSchema(engine, repository)
+    rows = schema.history(limit=int(limit))
+    ret = []
+    for row in rows:
+        rowcount = row['rows_affected']
+        if rowcount is None:
+            rowcount = 'unknown'
+        ret.append('%s -> %s: %.3fs, %s rows affected, %s (%s on %s)' % (
+            row['start_version'], row['end_version'], row['duration'],
+            rowcount, row['script_path'], row['started'], row['hostname']))
+    return '\n'.join(ret)
+
+
+@with_engine
+def checkpoints(url, repository, **opts):
+    """%prog checkpoints URL REPOSITORY_PATH
+
+    Show the checkpoints saved by change scripts of the repository that
+    didn't finish on the database with the given connection string. The
+    scripts resume from them when they run again.
+    """
+    from migrate.versioning.schema import ControlledSchema
+    engine = opts.pop('engine')
+    schema = ControlledSchema(engine, repository)
+    ret = []
+    for row in schema.checkpoints():
+        ret.append('%s -> %s: %s = %s (saved %s)' % (row['start_version'],
+            row['end_version'], row['name'], row['state'], row['updated']))
+    return '\n'.join(ret)
+
+
+@with_engine
+def clear_checkpoints(url, repository, version=None, **opts):
+    """%prog clear_checkpoints URL REPOSITORY_PATH [VERSION]
+
+    Delete the checkpoints saved by change scripts of the repository, so
+    that they start over when they run again. Only the checkpoints of
+    the steps starting or ending at VERSION are deleted if it is given.
+    """
+    from migrate.versioning.schema import ControlledSchema
+    engine = opts.pop('engine')
+    schema = ControlledSchema(engine, repository)
+    count = schema.clear_checkpoints(version)
+    log.info('Deleted %s checkpoints', count)
+
+
+@with_engine
+def release_lock(url, repository, force=False, **opts):
+    """%prog release_lock URL REPOSITORY_PATH [--force]
+
+    Remove the migration lock left behind by a process killed while
+    upgrading or downgrading the database.
+
+    Without --force, only the lock of a process of this host that no
+    longer runs is removed. PostgreSQL and MySQL locks end with the
+    session holding them and are never left behind.
+    """
+    from migrate.versioning.schema import ControlledSchema
+    engine = opts.pop('engine')
+    schema = ControlledSchema(engine, repository)
+    holder = schema.lock().break_lock(asbool(force))
+    if holder is None:
+        log.info('No migration lock to remove')
+    else:
+        log.info('Removed the migration lock of %s', holder)
+    return holder
+
+
+@with_engine
+def plan(url, repository, version=None, **opts):
+    """%prog plan URL REPOSITORY_PATH [VERSION] [--throughput=CLASS=ROWS,...] [--count] [--limit=N] [--save=FILE]
+
+    Estimate the cost of upgrading (or downgrading) a database to
+    VERSION, the latest version by default, without changing it.
+
+    The statements of each change script are captured as with
+    --preview_sql and classified as metadata only changes, table
+    scans, index builds or full table rewrites. Durations are estimated
+    from the sizes of the tables and the rows per second each class of
+    operation processes, which can be set with --throughput, e.g.
+    --throughput=rewrite=20000,index=80000.
+
+    Table sizes are read from the catalog statistics of the database.
+    SQLite and SQL Server have none: their tables are only counted with
+    --count, which runs SELECT count(*) on each table, a full scan that
+    takes long on large tables. Otherwise operations on them are not
+    estimated.
+
+    Every step is listed with its operations, followed by the LIMIT (5
+    by default) riskiest steps.
+
+    With --save, the steps and the checksums of their scripts are
+    written to FILE, which 'upgrade --plan=FILE' runs exactly.
+    """
+    from migrate.versioning.schema import ControlledSchema
+    engine = opts.pop('engine')
+    schema = ControlledSchema(engine, repository)
+    migration = schema.plan(version)
+    if opts.get('save'):
+        migration.save(opts['save'])
+    steps = plan_.plan(schema, throughput=opts.get('throughput'),
+                       migration=migration, count=asbool(opts.get('count', False)))
+    return plan_.report(steps, int(opts.get('limit', 5)))
+
+
 def source(version, dest=None, repository=None, **opts):
     """%prog source VERSION [DESTINATION] --repository=REPOSITORY_PATH
 
@@ -169,7 +362,7 @@ def source(version, dest=None, repository=None, **opts):
 
 
 def upgrade(url, repository, version=None, **opts):
-    """%prog upgrade URL REPOSITORY_PATH [VERSION] [--preview_py|--preview_sql]
+    """%prog upgrade URL REPOSITORY_PATH [VERSION] [--preview_py|--preview_sql] [--lock_timeout=SECONDS] [--ddl_lock_timeout=SECONDS] [--ddl_retries=N] [--workers=N] [--record=FILE|--replay=FILE] [--plan=FILE] [--bundle_digest=SHA1]
 
     Upgrade a database to a later version.
 
@@ -180,6 +373,33 @@ def upgrade(url, repository, version=None, **opts):
 
     You may preview the Python or SQL code to be executed, rather than
     actually executing it, using the appropriate 'preview' option.
+
+    Concurrent upgrades of the same database wait for each other, for
+    at most --lock_timeout seconds (the repository's lock_timeout by
+    default).
+
+    DDL statements of the change scripts wait at most --ddl_lock_timeout
+    seconds for the locks of their table. Change scripts failing with a
+    lock timeout are rolled back and run again --ddl_retries times,
+    overriding ddl_lock_timeout and ddl_retries of the repository.
+
+    With --workers, change scripts run in the order of the versions
+    they depend on, up to WORKERS scripts at a time on separate
+    connections. After such an upgrade stopped part-way, with versions
+    applied ahead of the version of the database, the upgrade has to be
+    finished this way.
+
+    With --record, the SQL executed by the Python change scripts is
+    saved in FILE with a fingerprint of the schema it ran on. With
+    --replay, that SQL is executed directly on databases whose schema
+    matches the fingerprint; other databases run the scripts.
+
+    With --plan, the steps of a plan saved by 'plan --save=FILE' are
+    run, after checking that the database is at the version the plan
+    starts from and that none of its scripts changed since.
+
+    With --bundle_digest, REPOSITORY_PATH must be a bundle whose
+    manifest has that SHA1 digest (see 'verify_bundle').
     """
     err = "Cannot upgrade a database of version %s to version %s. "\
         "Try 'downgrade' instead."
@@ -187,7 +407,7 @@ def upgrade(url, repository, version=None, **opts):
 
 
 def downgrade(url, repository, version, **opts):
-    """%prog downgrade URL REPOSITORY_PATH VERSION [--preview_py|--preview_sql]
+    """%prog downgrade URL REPOSITORY_PATH VERSION [--preview_py|--preview_sql] [--lock_timeout=SECONDS] [--ddl_lock_timeout=SECONDS] [--ddl_retries=N] [--plan=FILE] [--bundle_digest=SHA1]
 
     Downgrade a database to an earlier version.
 
@@ -245,6 +465,7 @@ def version_control(url, repository, version=None, **opts):
     identical to what it would be if the database were created from
     scratch.
     """
+    from migrate.versioning.schema import ControlledSchema
     engine = opts.pop('engine')
     ControlledSchema.create(engine, repository, version)
 
@@ -255,6 +476,7 @@ def drop_version_control(url, repository, **opts):
 
     Removes version control from a database.
     """
+    from migrate.versioning.schema import ControlledSchema
     engine = opts.pop('engine')
     schema = ControlledSchema(engine, repository)
     schema.drop()
@@ -279,6 +501,33 @@ def manage(file, **opts):
     Repository.create_manage_file(file, **opts)
 
 
+def serve(socket, **opts):
+    """%prog serve SOCKET_PATH [--keep_engines=N]
+
+    Run commands received on the Unix domain socket SOCKET_PATH until
+    interrupted, keeping repositories, compiled change scripts and
+    the connections of the N most recently used databases (8 by
+    default) open between commands.
+
+    Each request is one line with a JSON object like
+    {"command": "db_version", "args": [URL, REPOSITORY_PATH], "kwargs": {}}
+    answered by one line {"result": ..., "output": [...]} or
+    {"error": ..., "type": ..., "output": [...]}.
+
+    Options given to serve (like the url and repository in manage.py)
+    are defaults for every command.
+    """
+    from migrate.versioning import server
+    srv = server.Server(socket, **opts)
+    try:
+        try:
+            srv.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    finally:
+        srv.server_close()
+
+
 @with_engine
 def compare_model_to_db(url, repository, model, **opts):
     """%prog compare_model_to_db URL REPOSITORY_PATH MODEL
@@ -288,6 +537,7 @@ def compare_model_to_db(url, repository, model, **opts):
 
     NOTE: This is EXPERIMENTAL.
     """  # TODO: get rid of EXPERIMENTAL label
+    from migrate.versioning.schema import ControlledSchema
     engine = opts.pop('engine')
     return ControlledSchema.compare_model_to_db(engine, model, repository)
 
@@ -300,6 +550,7 @@ def create_model(url, repository, **opts):
 
     NOTE: This is EXPERIMENTAL.
     """  # TODO: get rid of EXPERIMENTAL label
+    from migrate.versioning.schema import ControlledSchema
     engine = opts.pop('engine')
     declarative = opts.get('declarative', False)
     return ControlledSchema.create_model(engine, repository, declarative)
@@ -330,40 +581,125 @@ def update_db_from_model(url, repository, model, **opts):
 
     NOTE: This is EXPERIMENTAL.
     """  # TODO: get rid of EXPERIMENTAL label
+    from migrate.versioning.schema import ControlledSchema
     engine = opts.pop('engine')
     schema = ControlledSchema(engine, repository)
     schema.update_db_from_model(model)
 
 @with_engine
 def _migrate(url, repository, version, upgrade, err, **opts):
+    from migrate.versioning.graph import Scheduler
+    from migrate.versioning.replay import Recording
+    from migrate.versioning.schema import ControlledSchema
     engine = opts.pop('engine')
     url = str(engine.url)
     schema = ControlledSchema(engine, repository)
-    version = _migrate_version(schema, version, upgrade, err)
-
-    changeset = schema.changeset(version)
-    for ver, change in changeset:
-        nextver = ver + changeset.step
-        log.info('%s -> %s... ', ver, nextver)
-
-        if opts.get('preview_sql'):
-            if isinstance(change, PythonScript):
-                log.info(change.preview_sql(url, changeset.step, **opts))
-            elif isinstance(change, SqlScript):
-                log.info(change.source())
-
-        elif opts.get('preview_py'):
-            if not isinstance(change, PythonScript):
-                raise exceptions.UsageError("Python source can be only displayed"
-                    " for python migration files")
-            source_ver = max(ver, nextver)
-            module = schema.repository.version(source_ver).script().module
-            funcname = upgrade and "upgrade" or "downgrade"
-            func = getattr(module, funcname)
-            log.info(inspect.getsource(func))
+    _set_ddl_policy(schema, opts)
+    if opts.get('bundle_digest'):
+        if schema.repository.bundle is None:
+            raise exceptions.UsageError("--bundle_digest requires a bundle")
+        schema.repository.bundle.verify(opts['bundle_digest'])
+
+    plan = None
+    if opts.get('plan'):
+        # scripts changed since the plan was made fail before anything runs
+        plan = _load_plan(opts['plan'], schema, upgrade, opts)
+
+    lock = None
+    if not (opts.get('preview_sql') or opts.get('preview_py')):
+        timeout = opts.get('lock_timeout')
+        if timeout is not None:
+            timeout = float(timeout)
+        lock = schema.lock(timeout)
+        lock.acquire()
+        # another process may have migrated while we were waiting
+        schema.load()
+
+    try:
+        version = _migrate_version(schema, version, upgrade, err)
+        if plan is not None:
+            if version is not None and version != plan.end:
+                raise exceptions.KnownError("%s migrates to version %s, not "
+                    "%s" % (opts['plan'], plan.end, version))
+            if schema.version != plan.start:
+                raise exceptions.KnownError("The database is at version %s, "
+                    "%s starts at version %s" % (schema.version, opts['plan'],
+                                                 plan.start))
+
+        if upgrade and lock is not None and opts.get('workers'):
+            Scheduler(schema, opts['workers']).run(version)
+            return
+
+        recording = None
+        if lock is not None and (opts.get('record') or opts.get('replay')):
+            recording = Recording(opts.get('record') or opts.get('replay'),
+                                  schema)
+
+        if plan is not None:
+            changeset = plan
         else:
-            schema.runchange(ver, change, changeset.step)
-            log.info('done')
+            changeset = schema.changeset(version)
+        for ver, change in changeset:
+            nextver = ver + changeset.step
+            log.info('%s -> %s... ', ver, nextver)
+
+            if opts.get('preview_sql'):
+                if isinstance(change, PythonScript):
+                    log.info(change.preview_sql(url, changeset.step, **opts))
+                elif isinstance(change, SqlScript):
+                    log.info(change.source())
+
+            elif opts.get('preview_py'):
+                if not isinstance(change, PythonScript):
+                    raise exceptions.UsageError("Python source can be only "
+                        "displayed for python migration files")
+                source_ver = max(ver, nextver)
+                module = schema.repository.version(source_ver).script().module
+                funcname = upgrade and "upgrade" or "downgrade"
+                func = getattr(module, funcname)
+                log.info(inspect.getsource(func))
+            else:
+                if opts.get('record'):
+                    change = recording.recorder(ver, change, changeset.step)
+                elif opts.get('replay'):
+                    change = recording.replayer(ver, change, changeset.step)
+                schema.runchange(ver, change, changeset.step)
+                log.info('done')
+    finally:
+        if lock is not None:
+            lock.release()
+        if opts.get('record') and recording is not None:
+            recording.save()
+
+
+def _set_ddl_policy(schema, opts):
+    """Override the DDL policy of `schema` with --ddl_lock_timeout and
+    --ddl_retries"""
+    timeout = opts.get('ddl_lock_timeout')
+    retries = opts.get('ddl_retries')
+    if timeout is None and retries is None:
+        return
+    from migrate.changeset.policy import DDLPolicy
+    policy = schema.ddl_policy or DDLPolicy()
+    if timeout is not None:
+        policy.lock_timeout = float(timeout)
+    if retries is not None:
+        policy.retries = int(retries)
+    schema.ddl_policy = policy
+
+
+def _load_plan(path, schema, upgrade, opts):
+    """Load the MigrationPlan to run from `path`"""
+    if opts.get('workers'):
+        raise exceptions.UsageError("--plan can't be used with --workers")
+    plan = MigrationPlan.load(path, schema.repository)
+    if (plan.step > 0) != bool(upgrade):
+        raise exceptions.KnownError("%s is not a plan to %s" % (path,
+            upgrade and 'upgrade' or 'downgrade'))
+    if plan.database != schema.engine.dialect.name:
+        raise exceptions.KnownError("%s was made for %s, not %s" % (path,
+            plan.database, schema.engine.dialect.name))
+    return plan
 
 
 def _migrate_version(schema, version, upgrade, err):
@@ -0,0 +1,382 @@
+"""
+   Precompiled repository bundles.
+
+   A bundle is a single zip file holding the change scripts of a
+   repository, the compiled code objects of its Python scripts, the
+   parsed ``migrate.cfg`` and an index of versions.  It is created with
+   :func:`migrate.versioning.api.bundle` and can be passed anywhere a
+   repository path is expected::
+
+       $ migrate bundle my_repository my_repository.bundle
+       $ migrate upgrade sqlite:///project.db my_repository.bundle
+
+   The bundle is read through :mod:`mmap` without being extracted.
+   Every member, helper modules imported by the change scripts
+   included, is verified against the SHA1 digest recorded in the
+   manifest when it is read; bundles with members missing from the
+   manifest are refused. Deployments can pin the digest of the manifest
+   returned by :func:`create`, see :meth:`Bundle.verify`.
+
+   .. versionadded:: 0.7.2
+"""
+import os
+import sys
+import imp
+import mmap
+import marshal
+import logging
+import zipfile
+
+try:
+    from hashlib import sha1
+except ImportError:
+    # python 2.4
+    from sha import new as sha1
+
+try:
+    import json
+except ImportError:
+    # python < 2.6
+    import simplejson as json
+
+from migrate import exceptions
+from migrate.versioning import pathed, version, cfgparse
+from migrate.versioning.script import PythonScript, SqlScript
+
+
+log = logging.getLogger(__name__)
+
+FORMAT = 1
+MANIFEST = 'MANIFEST.json'
+VERSIONS = 'versions'
+CODE = 'code'
+EXTENSIONS = ('.py', '.sql')
+
+
+def is_bundle(path):
+    """:returns: :keyword:`True` if `path` is a bundle file"""
+    return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+
+def create(repository, dest):
+    """Write `repository` into a bundle at `dest`.
+
+    Helper modules living next to the change scripts are bundled too.
+
+    :param repository: repository to bundle
+    :param dest: path of the bundle file, must not exist
+    :type repository: :class:`Repository <migrate.versioning.repository.Repository>`
+    :type dest: string
+    :returns: SHA1 hex digest of the bundle manifest
+    """
+    pathed.Pathed.require_notfound(dest)
+    if repository.bundle is not None:
+        raise exceptions.KnownError("%s is already a bundle" % repository)
+    versions_dir = os.path.join(repository.path, repository._versions)
+
+    files = {}
+    index = {}
+    config = {}
+    for section in repository.config.sections():
+        config[section] = dict(repository.config.items(section, raw=True))
+
+    zf = zipfile.ZipFile(dest, 'w', zipfile.ZIP_STORED)
+    try:
+        try:
+            def write(member, data):
+                zf.writestr(member, data)
+                files[member] = sha1(data).hexdigest()
+
+            filenames = os.listdir(versions_dir)
+            filenames.sort()
+            for filename in filenames:
+                path = os.path.join(versions_dir, filename)
+                if not os.path.isfile(path) or \
+                        os.path.splitext(filename)[1] not in EXTENSIONS:
+                    continue
+                fd = open(path, 'rb')
+                source = fd.read()
+                fd.close()
+
+                member = '%s/%s' % (VERSIONS, filename)
+                write(member, source)
+                if filename.endswith('.py'):
+                    code = compile(source, member, 'exec')
+                    write('%s/%s' % (CODE, filename), marshal.dumps(code))
+
+                match = version.Collection.FILENAME_WITH_VERSION.match(filename)
+                if match:
+                    index.setdefault(str(int(match.group(1))), []).append(
+                        filename)
+
+            manifest = json.dumps(dict(format=FORMAT,
+                magic=imp.get_magic().encode('hex'),
+                repository_id=repository.id, config=config,
+                versions=index, files=files), indent=2, sort_keys=True)
+            zf.writestr(MANIFEST, manifest)
+        finally:
+            zf.close()
+    except:
+        os.remove(dest)
+        raise
+    log.debug('Bundled %d files of %s into %s', len(files), repository, dest)
+    return sha1(manifest).hexdigest()
+
+
+class MappedFile(object):
+    """File-like access to a read-only :class:`mmap.mmap`, as needed by
+    :class:`zipfile.ZipFile`"""
+
+    def __init__(self, map):
+        self.map = map
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.map) - self.map.tell()
+        return self.map.read(size)
+
+    def seek(self, offset, whence=0):
+        self.map.seek(offset, whence)
+
+    def tell(self):
+        return self.map.tell()
+
+    def close(self):
+        self.map.close()
+
+
+class Bundle(pathed.Pathed):
+    """A bundle file opened for reading.
+
+    Instances are shared per path, the file is mapped only once
+    unless it is replaced.
+
+    .. attribute:: digest
+
+      SHA1 hex digest of the manifest, as returned by :func:`create`
+
+    .. attribute:: config
+
+      :class:`~migrate.versioning.cfgparse.Parser` with the bundled
+      ``migrate.cfg``
+
+    .. attribute:: versions
+
+      :class:`BundledCollection` of the bundled change scripts
+    """
+
+    def __init__(self, path):
+        super(Bundle, self).__init__(path)
+        fd = open(path, 'rb')
+        try:
+            self._file = MappedFile(mmap.mmap(fd.fileno(), 0,
+                                              access=mmap.ACCESS_READ))
+        finally:
+            fd.close()
+        try:
+            self._zip = zipfile.ZipFile(self._file)
+            data = self._zip.read(MANIFEST)
+            manifest = json.loads(data)
+        except (zipfile.BadZipfile, KeyError, ValueError), e:
+            raise exceptions.InvalidRepositoryError("%s: %s" % (path, e))
+        if manifest.get('format') != FORMAT:
+            raise exceptions.InvalidRepositoryError(
+                "%s: unsupported bundle format %r" % (path,
+                                                      manifest.get('format')))
+        self.digest = sha1(data).hexdigest()
+        unlisted = set(self._zip.namelist()) - set(manifest['files']) - \
+            set([MANIFEST])
+        if unlisted:
+            raise exceptions.InvalidRepositoryError(
+                "%s: %s not listed in the manifest" % (path,
+                    ', '.join(sorted(unlisted))))
+
+        self.config = cfgparse.Parser()
+        for section, options in manifest['config'].items():
+            self.config.add_section(section)
+            for key, value in options.items():
+                self.config.set(section, key, value)
+
+        self.manifest = manifest
+        self.versions = BundledCollection(os.path.join(path, VERSIONS), self)
+
+    def read(self, member):
+        """Read `member` and verify it against the manifest.
+
+        :raises: :exc:`InvalidRepositoryError <migrate.exceptions.InvalidRepositoryError>`
+          if the member is missing or was modified
+        """
+        expected = self.manifest['files'].get(member)
+        if expected is None:
+            raise exceptions.InvalidRepositoryError(
+                "%s: %s is not listed in the manifest" % (self.path, member))
+        try:
+            data = self._zip.read(member)
+        except KeyError:
+            raise exceptions.InvalidRepositoryError(
+                "%s: %s is missing" % (self.path, member))
+        if sha1(data).hexdigest() != expected:
+            raise exceptions.InvalidRepositoryError(
+                "%s: checksum mismatch for %s" % (self.path, member))
+        return data
+
+    def verify(self, digest=None):
+        """Read and verify every member of the bundle.
+
+        :param digest: expected SHA1 hex digest of the manifest, as
+          returned by :func:`create`
+        :raises: :exc:`InvalidRepositoryError <migrate.exceptions.InvalidRepositoryError>`
+          if the digest differs or a member was modified
+        :returns: the digest of the manifest
+        """
+        if digest is not None and digest != self.digest:
+            raise exceptions.InvalidRepositoryError(
+                "%s: manifest digest is %s, expected %s" % (self.path,
+                                                            self.digest,
+                                                            digest))
+        for member in self.manifest['files']:
+            self.read(member)
+        return self.digest
+
+    def source(self, filename):
+        """:returns: source of the bundled script `filename`"""
+        return self.read('%s/%s' % (VERSIONS, filename))
+
+    def code(self, filename):
+        """:returns: code object of the bundled Python script `filename`
+
+        Scripts are compiled again from source if the bundle was created
+        by a different Python version.
+        """
+        if self.manifest['magic'] == imp.get_magic().encode('hex'):
+            return marshal.loads(self.read('%s/%s' % (CODE, filename)))
+        return compile(self.source(filename), '%s/%s' % (VERSIONS, filename),
+                       'exec')
+
+    def load_module(self, filename):
+        """Execute the bundled Python script `filename` in a new module"""
+        name = os.path.splitext(filename)[0]
+        module = imp.new_module(name)
+        module.__file__ = os.path.join(self.path, VERSIONS, filename)
+        code = self.code(filename)
+        # like import_path, let scripts import bundled helper modules,
+        # through the manifest rather than zipimport
+        importer = BundleImporter(self)
+        sys.meta_path.append(importer)
+        try:
+            exec code in module.__dict__
+        finally:
+            sys.meta_path.remove(importer)
+        return module
+
+
+class BundleImporter(object):
+    """Imports the helper modules of a bundle, verified against its
+    manifest (see :pep:`302`)"""
+
+    def __init__(self, bundle):
+        self.bundle = bundle
+
+    def _member(self, fullname):
+        return '%s/%s.py' % (VERSIONS, fullname)
+
+    def find_module(self, fullname, path=None):
+        if '.' not in fullname and \
+                self._member(fullname) in self.bundle.manifest['files']:
+            return self
+        return None
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+        member = self._member(fullname)
+        code = compile(self.bundle.read(member), member, 'exec')
+        module = imp.new_module(fullname)
+        module.__file__ = os.path.join(self.bundle.path, member)
+        module.__loader__ = self
+        sys.modules[fullname] = module
+        try:
+            exec code in module.__dict__
+        except:
+            del sys.modules[fullname]
+            raise
+        return module
+
+
+class BundledCollection(version.Collection):
+    """Read-only :class:`~migrate.versioning.version.Collection`
+    built from the version index of a bundle"""
+
+    @classmethod
+    def _key(cls, path, bundle=None):
+        return str(path)
+
+    @classmethod
+    def _stamp(cls, path, bundle=None):
+        return bundle.digest
+
+    def __init__(self, path, bundle):
+        pathed.Pathed.__init__(self, path)
+        self.bundle = bundle
+        files = dict()
+        for num, filelist in bundle.manifest['versions'].items():
+            files[int(num)] = filelist
+        self._load_versions(files)
+
+    def _make_version(self, num, filelist):
+        return BundledVersion(num, self.path, filelist, self.bundle)
+
+    def create_new_python_version(self, description, **k):
+        raise exceptions.KnownError("%s is read-only" % self.bundle)
+
+    def create_new_sql_version(self, database, description, **k):
+        raise exceptions.KnownError("%s is read-only" % self.bundle)
+
+
+class BundledVersion(version.Version):
+    """A :class:`~migrate.versioning.version.Version` of a bundle"""
+
+    def __init__(self, vernum, path, filelist, bundle):
+        self.bundle = bundle
+        super(BundledVersion, self).__init__(vernum, path, filelist)
+
+    def _make_script(self, cls, path):
+        if issubclass(cls, PythonScript):
+            return BundledPythonScript(path, self.bundle)
+        return BundledSqlScript(path, self.bundle)
+
+
+class BundledScriptMixin(object):
+    """Reads the script source from the bundle"""
+
+    @classmethod
+    def _key(cls, path, bundle=None):
+        return str(path)
+
+    @classmethod
+    def _stamp(cls, path, bundle=None):
+        return bundle.digest
+
+    def __init__(self, path, bundle):
+        pathed.Pathed.__init__(self, path)
+        self.bundle = bundle
+        self.filename = os.path.basename(path)
+
+    def source(self):
+        return self.bundle.source(self.filename)
+
+
+class BundledPythonScript(BundledScriptMixin, PythonScript):
+    """:class:`~migrate.versioning.script.py.PythonScript` loaded from
+    precompiled code"""
+
+    @property
+    def module(self):
+        if not hasattr(self, '_module'):
+            self._module = self.verify_module(self.path,
+                self.bundle.load_module(self.filename))
+        return self._module
+
+
+class BundledSqlScript(BundledScriptMixin, SqlScript):
+    """:class:`~migrate.versioning.script.sql.SqlScript` of a bundle"""
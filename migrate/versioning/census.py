@@ -0,0 +1,155 @@
+"""
+   Versions of many databases, see :func:`migrate.versioning.api.db_versions`.
+
+   Each database is queried with a single SELECT on the version table,
+   without reflecting it. Queries run in a pool of threads, since the
+   DBAPI drivers block; results are yielded as soon as they arrive, so
+   a census takes about as long as the slowest databases.
+
+   .. versionadded:: 0.7.2
+"""
+import sys
+import Queue
+import logging
+import threading
+
+try:
+    import json
+except ImportError:
+    # python < 2.6
+    import simplejson as json
+
+from migrate import exceptions
+from migrate.versioning.util import construct_engine
+
+
+log = logging.getLogger(__name__)
+
+
+def safe_url(url):
+    """Returns `url` with its password masked"""
+    from sqlalchemy.engine.url import make_url
+
+    try:
+        url = make_url(url)
+    except Exception:
+        return str(url)
+    if not url.password:
+        return str(url)
+    url.password = 'PASSWORD'
+    # URL quotes the password, which would mangle a mask like ***
+    return str(url).replace(':PASSWORD@', ':***@', 1)
+
+
+def query_version(url, repository, **opts):
+    """Returns the version of `repository` in the database at `url`.
+
+    :param repository: :class:`~migrate.versioning.repository.Repository`
+    :param opts: engine options, see
+      :func:`~migrate.versioning.util.construct_engine`
+    :raises: :exc:`DatabaseNotControlledError
+      <migrate.exceptions.DatabaseNotControlledError>` if the version
+      table or the row of `repository` is missing; connection and other
+      database errors are raised as they are
+    """
+    from sqlalchemy import MetaData, select
+    from migrate.versioning.schema import version_table
+
+    table = version_table(repository.version_table, MetaData())
+    engine = construct_engine(url, **opts)
+    try:
+        connection = engine.connect()
+        try:
+            try:
+                row = connection.execute(select([table.c.version],
+                    table.c.repository_id == str(repository.id))).fetchone()
+            except Exception:
+                cls, e, tb = sys.exc_info()
+                if engine.dialect.has_table(connection, table.name):
+                    raise cls, e, tb
+                raise exceptions.DatabaseNotControlledError(
+                    "%s has no table %s" % (safe_url(url), table.name))
+        finally:
+            connection.close()
+    finally:
+        if engine is not url:
+            engine.dispose()
+    if row is None:
+        raise exceptions.DatabaseNotControlledError(
+            "%s is not under version control of %s" % (safe_url(url),
+                                                       repository.id))
+    return row[0]
+
+
+def census(urls, repository, concurrency=10, **opts):
+    """Query the versions of `repository` in the databases at `urls`
+    using `concurrency` threads.
+
+    :returns: iterator over ``(url, version, error)`` tuples in the order
+      the queries finish; `version` is :keyword:`None` and `error` is a
+      message when a query failed
+    """
+    concurrency = max(1, int(concurrency))
+    pending = Queue.Queue()
+    results = Queue.Queue()
+    total = 0
+    for url in urls:
+        pending.put(url)
+        total += 1
+
+    def work():
+        while True:
+            try:
+                url = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results.put((url, query_version(url, repository, **opts),
+                             None))
+            except Exception, e:
+                log.debug('Querying %s failed', safe_url(url), exc_info=True)
+                results.put((url, None, '%s: %s' % (e.__class__.__name__,
+                                                    e)))
+
+    for i in range(min(concurrency, total)):
+        thread = threading.Thread(target=work)
+        thread.setDaemon(True)
+        thread.start()
+
+    for i in range(total):
+        yield results.get()
+
+
+def write(results, format='csv', stream=None):
+    """Write `results` of :func:`census` to `stream` (standard output by
+    default) as they arrive, one line per database.
+
+    :param format: ``csv`` or ``json`` (one JSON object per line)
+    :returns: number of databases whose version couldn't be queried
+    """
+    import csv
+
+    if stream is None:
+        stream = sys.stdout
+    if format == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(['url', 'version', 'error'])
+    elif format != 'json':
+        raise exceptions.UsageError("Unknown format %s, use csv or json"
+                                    % format)
+
+    failed = 0
+    for url, version, error in results:
+        if error is not None:
+            failed += 1
+        if version is not None:
+            version = int(version)
+        if format == 'csv':
+            if version is None:
+                version = ''
+            writer.writerow([safe_url(url), version, error or ''])
+        else:
+            stream.write(json.dumps(dict(url=safe_url(url), version=version,
+                                         error=error)) + '\n')
+        stream.flush()
+    return failed
@@ -0,0 +1,157 @@
+"""
+   Checkpoints of long running change scripts.
+
+   A change script runs in one transaction, and the version of the
+   database only changes once it returns: a data migration failing after
+   hours starts over. Scripts can save their progress instead::
+
+       def upgrade(migrate_engine):
+           last_id = migrate_engine.last_checkpoint('backfill', 0)
+           while True:
+               ids = [row[0] for row in migrate_engine.execute(
+                   select([t.c.id], t.c.id > last_id,
+                          order_by=t.c.id, limit=1000))]
+               if not ids:
+                   break
+               migrate_engine.execute(t.update(t.c.id.in_(ids)), ...)
+               last_id = ids[-1]
+               migrate_engine.checkpoint('backfill', last_id)
+
+   :meth:`MigrationContext.checkpoint
+   <migrate.versioning.context.MigrationContext.checkpoint>` saves the
+   state in the checkpoint table of the repository and commits it with
+   the work done so far. When the script is run again after a failure,
+   :meth:`~migrate.versioning.context.MigrationContext.last_checkpoint`
+   returns the last state saved. The checkpoints of a step are deleted
+   when its script succeeds, in its last transaction.
+
+   States are stored as JSON. Checkpoints saved by another version of
+   the script (see :meth:`~migrate.versioning.script.base.BaseScript.checksum`)
+   are ignored.
+
+   .. versionadded:: 0.7.2
+"""
+import logging
+from datetime import datetime
+
+try:
+    import json
+except ImportError:
+    # python < 2.6
+    import simplejson as json
+
+from sqlalchemy import Table, Column, MetaData, String, Text, Integer, DateTime
+from sqlalchemy.sql import and_
+
+
+log = logging.getLogger(__name__)
+
+
+def checkpoint_table(name, meta):
+    """Returns the definition of the checkpoint table `name` in `meta`"""
+    return Table(
+        name, meta,
+        Column('repository_id', String(250), primary_key=True),
+        Column('start_version', Integer, primary_key=True,
+               autoincrement=False),
+        Column('end_version', Integer, primary_key=True,
+               autoincrement=False),
+        Column('name', String(250), primary_key=True),
+        Column('state', Text),
+        Column('script_hash', String(40)),
+        Column('updated', DateTime), )
+
+
+def get_checkpoints(bind):
+    """Returns the :class:`Checkpoints` set on `bind` with the
+    ``migrate_checkpoints`` execution option, or :keyword:`None`"""
+    options = getattr(bind, '_execution_options', None) or {}
+    return options.get('migrate_checkpoints')
+
+
+class Checkpoints(object):
+    """Checkpoints of the step from `start_version` to `end_version` of
+    `repository`, run by `script`.
+
+    Checkpoints are read and written on the connection of the script, so
+    that they are committed with its work.
+    """
+
+    def __init__(self, repository, start_version, end_version, script):
+        self.table = checkpoint_table(repository.checkpoint_table,
+                                      MetaData())
+        self.repository_id = str(repository.id)
+        self.start_version = int(start_version)
+        self.end_version = int(end_version)
+        self.script = script
+        self._exists = None
+        self._states = None
+        self._script_hash = None
+
+    def __repr__(self):
+        return '<Checkpoints %s -> %s of %s>' % (self.start_version,
+            self.end_version, self.repository_id)
+
+    @property
+    def script_hash(self):
+        """Checksum of the script, read once"""
+        if self._script_hash is None:
+            self._script_hash = self.script.checksum()
+        return self._script_hash
+
+    def load(self, connection):
+        """Returns a dict of the states saved by earlier runs of the
+        step, by key"""
+        if self._states is not None:
+            return self._states
+        self._states = {}
+        if not self._has_table(connection):
+            return self._states
+        for row in connection.execute(self.table.select(self._where())):
+            if row['script_hash'] != self.script_hash:
+                log.warning('Ignoring checkpoint %r of %s saved by another '
+                            'version of the script', row['name'],
+                            self.script.path)
+                continue
+            self._states[row['name']] = json.loads(row['state'])
+        if self._states:
+            log.info('Resuming %s from checkpoints %s', self.script.path,
+                     ', '.join(sorted(self._states)))
+        return self._states
+
+    def save(self, connection, key, state):
+        """Save `state` as the checkpoint `key` of the step"""
+        states = self.load(connection)
+        values = dict(state=json.dumps(state),
+                      script_hash=self.script_hash,
+                      updated=datetime.utcnow())
+        if not self._has_table(connection):
+            self.table.create(bind=connection)
+            self._exists = True
+        result = connection.execute(self.table.update(self._where(key)),
+                                    **values)
+        if not result.rowcount:
+            values.update(repository_id=self.repository_id,
+                          start_version=self.start_version,
+                          end_version=self.end_version, name=key)
+            connection.execute(self.table.insert(), **values)
+        states[key] = state
+
+    def clear(self, connection):
+        """Delete the checkpoints of the step"""
+        if self._has_table(connection):
+            connection.execute(self.table.delete(self._where()))
+        self._states = {}
+
+    def _has_table(self, connection):
+        if self._exists is None:
+            self._exists = self.table.exists(bind=connection)
+        return self._exists
+
+    def _where(self, key=None):
+        clause = and_(self.table.c.repository_id == self.repository_id,
+                      self.table.c.start_version == self.start_version,
+                      self.table.c.end_version == self.end_version)
+        if key is not None:
+            clause = and_(clause, self.table.c.name == key)
+        return clause
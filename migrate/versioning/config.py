@@ -1,7 +1,11 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from sqlalchemy.util import OrderedDict
+try:
+    from collections import OrderedDict
+except ImportError:
+    # python < 2.7
+    from sqlalchemy.util import OrderedDict
 
 
 __all__ = ['databases', 'operations']
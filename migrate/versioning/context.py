@@ -0,0 +1,127 @@
+"""
+   Engine proxy bound to the connection of a change script.
+
+   :meth:`PythonScript.run <migrate.versioning.script.py.PythonScript.run>`
+   checks out one connection, begins a transaction on it and passes a
+   :class:`MigrationContext` to ``upgrade(migrate_engine)`` and
+   ``downgrade(migrate_engine)``. Everything the script executes through
+   it -- statements, reflection, table creation and changeset operations
+   -- shares that connection and transaction, which is committed when
+   the script returns and rolled back when it raises.
+
+   Long running scripts can commit their progress with
+   :meth:`MigrationContext.checkpoint` and resume from it when they run
+   again, see :mod:`migrate.versioning.checkpoint`.
+
+   .. versionadded:: 0.7.2
+"""
+
+
+class MigrationContext(object):
+    """Stands in for the :class:`~sqlalchemy.engine.base.Engine` of
+    `connection` wherever an engine is expected.
+
+    Statements run on `connection`; attributes not related to execution,
+    like :attr:`name` or :attr:`url`, are those of its engine. Connections
+    requested from the context are the context itself, closing them does
+    nothing.
+
+    :param connection: :class:`~sqlalchemy.engine.base.Connection` to use
+    :param transaction: transaction of the script on `connection`,
+      committed and begun again by :meth:`checkpoint`
+    :param checkpoints: :class:`~migrate.versioning.checkpoint.Checkpoints`
+      of the step, checkpoints aren't saved without them
+
+    .. attribute:: rowcount
+
+      number of rows affected by the statements executed through the
+      context, as far as the database driver tells
+    """
+
+    def __init__(self, connection, transaction=None, checkpoints=None):
+        self.connection = connection
+        self.engine = connection.engine
+        self.dialect = connection.dialect
+        self.transaction = transaction
+        self.checkpoints = checkpoints
+        self.rowcount = 0
+
+    def __repr__(self):
+        return '<MigrationContext(%r)>' % self.engine
+
+    def __getattr__(self, name):
+        # execute(), scalar(), begin(), run_callable() ... of the
+        # connection, anything else of the engine
+        try:
+            return getattr(self.connection, name)
+        except AttributeError:
+            return getattr(self.engine, name)
+
+    def execute(self, object, *multiparams, **params):
+        return self._count(self.connection.execute(object, *multiparams,
+                                                    **params))
+
+    def _execute_clauseelement(self, elem, multiparams=None, params=None):
+        # statement.execute() of tables bound to the context
+        return self._count(self.connection._execute_clauseelement(elem,
+            multiparams, params))
+
+    def _count(self, result):
+        # DDL statements report -1
+        if not result.returns_rows and result.rowcount > 0:
+            self.rowcount += result.rowcount
+        return result
+
+    def checkpoint(self, key, state):
+        """Save `state` as checkpoint `key` and commit the work done so
+        far with it.
+
+        :param state: JSON serializable progress of the script, returned
+          by :meth:`last_checkpoint` when the script runs again after
+          failing
+        """
+        if self.checkpoints is not None:
+            self.checkpoints.save(self.connection, key, state)
+        if self.transaction is not None:
+            self.transaction.commit()
+            self.transaction = self.connection.begin()
+
+    def last_checkpoint(self, key, default=None):
+        """Returns the state of checkpoint `key` saved by an earlier run
+        of the script, `default` if there is none"""
+        if self.checkpoints is None:
+            return default
+        return self.checkpoints.load(self.connection).get(key, default)
+
+    def connect(self, **kwargs):
+        return self
+
+    def contextual_connect(self, **kwargs):
+        return self
+
+    def close(self):
+        """The connection is closed by the script runner"""
+
+    def dispose(self):
+        """The engine outlives the script, it isn't disposed"""
+
+    def _run_visitor(self, visitorcallable, element, connection=None,
+                     **kwargs):
+        if connection is None:
+            connection = self.connection
+        connection._run_visitor(visitorcallable, element, **kwargs)
+
+    def _execute_default(self, default, multiparams=(), params=None):
+        return self.connection._execute_default(default, multiparams,
+                                                params or {})
+
+    def reflecttable(self, table, connection=None, include_columns=None):
+        if connection is None:
+            connection = self.connection
+        return connection.reflecttable(table, include_columns=include_columns)
+
+    def has_table(self, table_name, schema=None):
+        return self.dialect.has_table(self.connection, table_name, schema)
+
+    def table_names(self, schema=None, connection=None):
+        return self.engine.table_names(schema, connection or self.connection)
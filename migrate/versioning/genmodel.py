@@ -232,6 +232,7 @@ class ModelGenerator(object):
         for table in self._get_tables(missingB=True):
             table = table.tometadata(meta)
             table.create()
+        rebuild = []
         for modelTable in self._get_tables(modified=True):
             tableName = modelTable.name
             modelTable = modelTable.tometadata(meta)
@@ -248,38 +249,45 @@ class ModelGenerator(object):
                 # XXX handle column changes here.
             else:
                 # Sqlite doesn't support drop column, so you have to
-                # do more: create temp table, copy data to it, drop
-                # old table, create new table, copy data back.
-                #
-                # I wonder if this is guaranteed to be unique?
-                tempName = '_temp_%s' % modelTable.name
-
-                def getCopyStatement():
-                    preparer = self.engine.dialect.preparer
-                    commonCols = []
-                    for modelCol in modelTable.columns:
-                        if modelCol.name in dbTable.columns:
-                            commonCols.append(modelCol.name)
-                    commonColsStr = ', '.join(commonCols)
-                    return 'INSERT INTO %s (%s) SELECT %s FROM %s' % \
-                        (tableName, commonColsStr, commonColsStr, tempName)
-
-                # Move the data in one transaction, so that we don't
-                # leave the database in a nasty state.
-                connection = self.engine.connect()
+                # do more: rename the table, create the new table and
+                # copy the data into it.
+                rebuild.append((modelTable, dbTable))
+        if rebuild:
+            self._rebuild_tables(rebuild)
+
+    def _rebuild_tables(self, tables):
+        """Recreate the model tables of `tables`, pairs of model and
+        database tables, copying the rows of each once.
+
+        Tables are moved in one transaction, so that we don't leave the
+        database in a nasty state.
+        """
+        from migrate.changeset.databases import sqlite
+        connection = self.engine.connect()
+        try:
+            previous = None
+            if sqlite.fast_rebuild(connection):
+                previous = sqlite.set_pragmas(connection,
+                    sqlite.FAST_REBUILD_PRAGMAS)
+            try:
                 trans = connection.begin()
                 try:
-                    connection.execute(
-                        'CREATE TEMPORARY TABLE %s as SELECT * from %s' % \
-                            (tempName, modelTable.name))
-                    # make sure the drop takes place inside our
-                    # transaction with the bind parameter
-                    modelTable.drop(bind=connection)
-                    modelTable.create(bind=connection)
-                    connection.execute(getCopyStatement())
-                    connection.execute('DROP TABLE %s' % tempName)
+                    for modelTable, dbTable in tables:
+                        columns = [col.name for col in modelTable.columns
+                                   if col.name in dbTable.columns]
+                        sqlite.copy_table(connection, modelTable, columns)
                     trans.commit()
                 except:
                     trans.rollback()
                     raise
+            finally:
+                if previous is not None:
+                    sqlite.set_pragmas(connection, previous)
+            if previous is not None:
+                preparer = connection.dialect.identifier_preparer
+                for modelTable, dbTable in tables:
+                    sqlite.check_foreign_keys(connection,
+                        preparer.format_table(modelTable))
+        finally:
+            connection.close()
 
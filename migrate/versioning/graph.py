@@ -0,0 +1,248 @@
+"""
+   Migration graph: change scripts that declare their dependencies.
+
+   By default every change script depends on the previous version, so
+   the versions of a repository form a chain. A Python change script
+   may instead list the versions it depends on in a module level
+   ``depends_on`` list::
+
+       depends_on = [3]
+
+       def upgrade(migrate_engine):
+           ...
+
+   Scripts whose dependencies are satisfied can then be applied at the
+   same time by :class:`Scheduler`, each on its own connection. The
+   version table still holds the highest version up to which all
+   versions are applied; versions applied ahead of it are recorded in
+   the ``<version_table>_applied`` table. While it holds versions of a
+   repository, e.g. after a failed parallel upgrade, change scripts can
+   only be run by the scheduler, which resumes from them.
+
+   Several workers are of little use on SQLite, which locks the whole
+   database for writing: they wait for each other and fail with
+   "database is locked" once the busy timeout of the driver is over. An
+   in-memory SQLite database only exists on its own connection, the
+   scheduler runs one script at a time there.
+
+   .. versionadded:: 0.7.2
+"""
+import sys
+import time
+import Queue
+import logging
+import threading
+from datetime import datetime
+
+from sqlalchemy import Table, Column, MetaData, String, Integer
+from sqlalchemy.sql import and_
+
+from migrate import exceptions
+from migrate.versioning.script import PythonScript
+from migrate.versioning.version import VerNum
+
+
+log = logging.getLogger(__name__)
+
+
+def applied_table(name, meta):
+    """Returns the definition of the table `name` in `meta` recording
+    versions applied ahead of the version table"""
+    return Table(
+        name, meta,
+        Column('repository_id', String(250), primary_key=True),
+        Column('version', Integer, primary_key=True))
+
+
+class MigrationGraph(object):
+    """Versions of `repository` and the versions each one depends on,
+    with the scripts used for `database`.
+
+    :raises: :exc:`ScriptError <migrate.exceptions.ScriptError>` if a
+      script depends on a version that doesn't precede it
+    """
+
+    def __init__(self, repository, database):
+        self.repository = repository
+        self.database = database
+        self.versions = repository.versions.versions.keys()
+        self.versions.sort()
+        self.dependencies = dict()
+        previous = []
+        for ver in self.versions:
+            script = self.script(ver)
+            depends_on = None
+            if isinstance(script, PythonScript):
+                depends_on = getattr(script.module, 'depends_on', None)
+            if depends_on is None:
+                depends_on = previous
+            depends_on = [VerNum(dep) for dep in depends_on]
+            for dep in depends_on:
+                if dep not in repository.versions.versions or dep >= ver:
+                    raise exceptions.ScriptError("Version %s can't depend "
+                        "on version %s, only on existing earlier versions"
+                        % (ver, dep))
+            self.dependencies[ver] = depends_on
+            previous = [ver]
+
+    def script(self, ver):
+        """Returns the upgrade script of version `ver`"""
+        return self.repository.version(ver).script(self.database, 'upgrade')
+
+    def required(self, target=None):
+        """Returns the versions needed to reach `target`, the latest
+        version by default"""
+        if target is None:
+            return set(self.versions)
+        target = VerNum(target)
+        if target not in self.dependencies:
+            raise exceptions.InvalidVersionError(target)
+        required = set()
+        pending = [target]
+        while pending:
+            ver = pending.pop()
+            if ver not in required:
+                required.add(ver)
+                pending.extend(self.dependencies[ver])
+        return required
+
+    def ready(self, pending, applied):
+        """Returns the versions in `pending` whose dependencies are all
+        `applied`, lowest first"""
+        ready = [ver for ver in pending
+                 if not [dep for dep in self.dependencies[ver]
+                         if dep not in applied]]
+        ready.sort()
+        return ready
+
+    def contiguous(self, applied):
+        """Returns the highest version up to which all versions are
+        `applied`"""
+        version = VerNum(0)
+        for ver in self.versions:
+            if ver not in applied:
+                break
+            version = ver
+        return version
+
+
+class Scheduler(object):
+    """Applies the versions of a :class:`ControlledSchema
+    <migrate.versioning.schema.ControlledSchema>` in dependency order,
+    running up to `workers` change scripts at a time on separate
+    connections.
+    """
+
+    def __init__(self, schema, workers=1):
+        self.schema = schema
+        self.workers = max(1, int(workers))
+        self.graph = MigrationGraph(schema.repository,
+                                    schema.engine.dialect.name)
+        self.table = applied_table(schema.repository.applied_table,
+                                   MetaData())
+        if self.workers > 1 and schema.engine.dialect.name == 'sqlite':
+            if schema.engine.engine.url.database in (None, '', ':memory:'):
+                # the connections of other threads have databases of
+                # their own
+                log.warning("An in-memory SQLite database can't be "
+                            "shared by workers, running one at a time")
+                self.workers = 1
+            else:
+                log.warning("SQLite allows one writer at a time: workers "
+                            "wait for each other's transactions and fail "
+                            "with 'database is locked' after the busy "
+                            "timeout")
+
+    def applied(self):
+        """Returns the set of applied versions"""
+        applied = set([ver for ver in self.graph.versions
+                       if ver <= self.schema.version])
+        if self.table.exists(bind=self.schema.engine):
+            rows = self.schema.engine.execute(self.table.select(
+                self.table.c.repository_id == str(self.schema.repository.id)))
+            applied.update([VerNum(row['version']) for row in rows])
+        return applied
+
+    def upgrade(self, version=None, lock_timeout=None):
+        """Upgrade to `version`, the latest version by default.
+
+        Versions already scheduled keep running when a script fails; no
+        further versions are started and the first error is raised.
+        """
+        lock = self.schema.lock(lock_timeout)
+        lock.acquire()
+        try:
+            # another process may have migrated while we were waiting
+            self.schema.load()
+            self.run(version)
+        finally:
+            lock.release()
+
+    def run(self, version=None):
+        """Like :meth:`upgrade`, for callers holding the migration lock"""
+        self.table.create(bind=self.schema.engine, checkfirst=True)
+        applied = self.applied()
+        pending = self.graph.required(version) - applied
+        running = set()
+        results = Queue.Queue()
+        error = None
+
+        while pending or running:
+            if error is None:
+                for ver in self.graph.ready(pending, applied):
+                    if len(running) >= self.workers:
+                        break
+                    pending.remove(ver)
+                    running.add(ver)
+                    thread = threading.Thread(target=self._apply,
+                        args=(ver, results))
+                    thread.setDaemon(True)
+                    thread.start()
+            if not running:
+                break
+            ver, exc_info, started, finished, duration, rowcount = \
+                results.get()
+            running.remove(ver)
+            if exc_info is not None:
+                if error is None:
+                    error = exc_info
+                continue
+            applied.add(ver)
+            self._record(ver, applied, started, finished, duration, rowcount)
+            log.info('%s done (%.3fs)', ver, duration)
+
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+    def _apply(self, ver, results):
+        """Run the script of version `ver` on its own connection"""
+        change = self.graph.script(ver)
+        started = datetime.utcnow()
+        timer = time.time()
+        rowcount = None
+        exc_info = None
+        try:
+            rowcount = self.schema.run_step(change, ver - 1, 1)
+        except:
+            exc_info = sys.exc_info()
+            log.error('%s failed: %s', ver, exc_info[1])
+        results.put((ver, exc_info, started, datetime.utcnow(),
+                     time.time() - timer, rowcount))
+
+    def _record(self, ver, applied, started, finished, duration, rowcount):
+        """Record version `ver` as applied"""
+        schema = self.schema
+        repository_id = str(schema.repository.id)
+        version = self.graph.contiguous(applied)
+        if version != schema.version:
+            schema.update_repository_table(schema.version, version)
+            schema.engine.execute(self.table.delete(and_(
+                self.table.c.repository_id == repository_id,
+                self.table.c.version <= int(version))))
+            schema.load()
+        if ver > schema.version:
+            schema.engine.execute(self.table.insert().values(
+                repository_id=repository_id, version=int(ver)))
+        if schema.repository.history_table:
+            schema.update_history_table(ver - 1, ver, self.graph.script(ver),
+                started, finished, duration, rowcount)
@@ -0,0 +1,292 @@
+"""
+   Locks serializing concurrent migrations of the same database.
+
+   When several application instances upgrade a database at once, only
+   one of them may run the change scripts; the others wait for the lock
+   and then find the database already upgraded.
+
+   - PostgreSQL uses session level advisory locks
+     (``pg_advisory_lock``),
+   - MySQL uses named locks (``GET_LOCK``),
+   - every other database, SQLite included, claims a row in a lock
+     table named after the repository's `version_table`. The row names
+     the host and process holding the lock and when it was acquired;
+     rows of processes of the same host that no longer run are
+     removed when the lock is acquired, others by
+     :meth:`MigrationLock.break_lock` (``migrate release_lock``).
+
+   .. versionadded:: 0.7.2
+"""
+import os
+import time
+import errno
+import socket
+import logging
+from datetime import datetime
+
+try:
+    from hashlib import sha1
+except ImportError:
+    # python 2.4
+    from sha import new as sha1
+
+from sqlalchemy import Table, Column, MetaData, String, DateTime
+from sqlalchemy import exceptions as sa_exceptions
+from sqlalchemy.sql import and_, text
+
+from migrate import exceptions
+from migrate.changeset.policy import is_lock_timeout
+
+
+log = logging.getLogger(__name__)
+
+
+class MigrationLock(object):
+    """Base class of migration locks.
+
+    :param engine: SQLAlchemy engine of the migrated database
+    :param name: lock name, shared by all processes migrating the same
+      repository
+    :param timeout: seconds to wait for the lock, :keyword:`None` waits
+      forever
+    """
+
+    poll_interval = 0.5
+
+    def __init__(self, engine, name, timeout=None):
+        self.engine = engine
+        self.name = name
+        self.timeout = timeout
+        self.connection = None
+
+    def acquire(self):
+        """Wait for the lock.
+
+        :raises: :exc:`LockTimeoutError <migrate.exceptions.LockTimeoutError>`
+          if the lock wasn't acquired within `timeout` seconds
+        """
+        self.connection = self.engine.connect()
+        try:
+            self._wait()
+        except:
+            self.connection.close()
+            self.connection = None
+            raise
+        log.debug('Acquired migration lock %s', self.name)
+
+    def release(self):
+        """Release the lock acquired by :meth:`acquire`"""
+        if self.connection is None:
+            return
+        try:
+            self._release()
+        finally:
+            self.connection.close()
+            self.connection = None
+        log.debug('Released migration lock %s', self.name)
+
+    def _wait(self):
+        started = time.time()
+        waiting = False
+        while not self._try_acquire():
+            if not waiting:
+                log.info('Waiting for migration lock %s held by %s',
+                         self.name, self._holder())
+                waiting = True
+            if self.timeout is not None and \
+                    time.time() - started >= self.timeout:
+                raise exceptions.LockTimeoutError("Migration lock %s not "
+                    "acquired within %ss, held by %s" % (self.name,
+                    self.timeout, self._holder()))
+            time.sleep(self.poll_interval)
+
+    def break_lock(self, force=False):
+        """Remove the lock left behind by a process that was killed while
+        holding it.
+
+        Advisory locks end with the session holding them, there is
+        nothing to remove.
+
+        :param force: remove the lock even if its holder may still run
+        :returns: description of the holder whose lock was removed, or
+          :keyword:`None`
+        """
+        return None
+
+    def _try_acquire(self):
+        """:returns: :keyword:`True` if the lock was acquired"""
+        raise NotImplementedError()
+
+    def _release(self):
+        raise NotImplementedError()
+
+    def _holder(self):
+        """:returns: description of the current lock holder"""
+        return 'another connection'
+
+
+class PostgreSQLLock(MigrationLock):
+    """Session level advisory lock"""
+
+    def __init__(self, *p, **k):
+        super(PostgreSQLLock, self).__init__(*p, **k)
+        # advisory locks are identified by a bigint
+        self.key = int(sha1(self.name).hexdigest()[:15], 16)
+
+    def _wait(self):
+        if self.timeout is None:
+            self.connection.execute(text('SELECT pg_advisory_lock(:key)'),
+                key=self.key)
+        else:
+            super(PostgreSQLLock, self)._wait()
+
+    def _try_acquire(self):
+        return bool(self.connection.execute(
+            text('SELECT pg_try_advisory_lock(:key)'), key=self.key).scalar())
+
+    def _release(self):
+        self.connection.execute(text('SELECT pg_advisory_unlock(:key)'),
+            key=self.key)
+
+
+class MySQLLock(MigrationLock):
+    """Named lock, waiting on the server"""
+
+    # GET_LOCK doesn't accept infinite timeouts on older servers
+    wait_interval = 60
+
+    def _wait(self):
+        started = time.time()
+        while True:
+            if self.timeout is None:
+                wait = self.wait_interval
+            else:
+                wait = max(0, int(self.timeout - (time.time() - started)))
+            if self.connection.execute(text('SELECT GET_LOCK(:name, :wait)'),
+                    name=self.name, wait=wait).scalar() == 1:
+                return
+            if self.timeout is not None:
+                raise exceptions.LockTimeoutError("Migration lock %s not "
+                    "acquired within %ss" % (self.name, self.timeout))
+            log.info('Waiting for migration lock %s', self.name)
+
+    def _release(self):
+        self.connection.execute(text('SELECT RELEASE_LOCK(:name)'),
+            name=self.name)
+
+
+class RowLock(MigrationLock):
+    """Claims a row in `table`, for databases without advisory locks.
+
+    The row names its holder as ``host:pid``. A row left behind by a
+    killed process of this host is removed when the lock is acquired,
+    rows of other hosts by :meth:`break_lock` with `force`.
+
+    SQLite also uses this lock: an exclusive transaction held for the
+    whole migration would block the migration's own connections.
+    """
+
+    def __init__(self, engine, name, timeout=None, table=None):
+        super(RowLock, self).__init__(engine, name, timeout)
+        self.table = Table(table, MetaData(),
+            Column('name', String(250), primary_key=True),
+            Column('owner', String(255)),
+            Column('acquired', DateTime))
+        self.owner = '%s:%d' % (socket.gethostname(), os.getpid())
+
+    def _wait(self):
+        self.table.create(bind=self.connection, checkfirst=True)
+        super(RowLock, self)._wait()
+
+    def _try_acquire(self):
+        trans = self.connection.begin()
+        try:
+            self.connection.execute(self.table.insert().values(
+                name=self.name, owner=self.owner,
+                acquired=datetime.utcnow()))
+            trans.commit()
+        except sa_exceptions.IntegrityError:
+            # the row of the lock exists
+            trans.rollback()
+            row = self._read(self.connection)
+            if row is not None and self._stale(row):
+                log.warning('Removing migration lock %s of %s, which no '
+                            'longer runs', self.name, row['owner'])
+                self._delete(self.connection, row['owner'])
+                return self._try_acquire()
+            return False
+        except sa_exceptions.OperationalError, e:
+            trans.rollback()
+            if is_lock_timeout(self.connection.dialect.name, e):
+                # the database is locked by a running migration (SQLite)
+                return False
+            raise
+        return True
+
+    def _release(self):
+        self._delete(self.connection, self.owner)
+
+    def break_lock(self, force=False):
+        connection = self.engine.connect()
+        try:
+            if not self.table.exists(bind=connection):
+                return None
+            row = self._read(connection)
+            if row is None:
+                return None
+            if not force and not self._stale(row):
+                raise exceptions.KnownError("Migration lock %s is held by "
+                    "%s since %s, which may still run; force it if it "
+                    "doesn't" % (self.name, row['owner'], row['acquired']))
+            self._delete(connection, row['owner'])
+        finally:
+            connection.close()
+        log.warning('Removed migration lock %s of %s', self.name,
+                    row['owner'])
+        return '%s since %s' % (row['owner'], row['acquired'])
+
+    def _read(self, connection):
+        return connection.execute(self.table.select(
+            self.table.c.name == self.name)).fetchone()
+
+    def _delete(self, connection, owner):
+        connection.execute(self.table.delete(and_(
+            self.table.c.name == self.name,
+            self.table.c.owner == owner)))
+
+    def _stale(self, row):
+        """Whether the holder of `row` is a process of this host that no
+        longer runs"""
+        parts = (row['owner'] or '').rsplit(':', 1)
+        if len(parts) != 2:
+            return False
+        host, pid = parts
+        if host != socket.gethostname() or not pid.isdigit() or \
+                not hasattr(os, 'kill') or os.name != 'posix':
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except OSError, e:
+            return e.errno == errno.ESRCH
+        return False
+
+    def _holder(self):
+        try:
+            row = self._read(self.connection)
+        except sa_exceptions.DBAPIError:
+            row = None
+        if row is None:
+            return 'another connection'
+        return '%s since %s' % (row['owner'], row['acquired'])
+
+
+def get_lock(engine, name, timeout=None, table=None):
+    """Returns the :class:`MigrationLock` suitable for `engine`.
+
+    :param table: name of the lock table used by :class:`RowLock`
+    """
+    if engine.name == 'postgresql':
+        return PostgreSQLLock(engine, name, timeout)
+    elif engine.name == 'mysql':
+        return MySQLLock(engine, name, timeout)
+    return RowLock(engine, name, timeout, table=table)
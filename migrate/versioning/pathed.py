@@ -18,7 +18,8 @@ class Pathed(KeyedInstance):
     A class associated with a path/directory tree.
 
     Only one instance of this class may exist for a particular file;
-    __new__ will return an existing instance if possible
+    an existing instance is returned if possible, unless one of the
+    :meth:`_watched` paths was modified since it was created.
     """
     parent = None
 
@@ -26,6 +27,24 @@ class Pathed(KeyedInstance):
     def _key(cls, path):
         return str(path)
 
+    @classmethod
+    def _stamp(cls, path, *p, **k):
+        """Modification times and sizes of the :meth:`_watched` paths"""
+        stamp = []
+        for watched in cls._watched(str(path)):
+            try:
+                st = os.stat(watched)
+            except OSError:
+                stamp.append(None)
+            else:
+                stamp.append((st.st_mtime, st.st_size))
+        return tuple(stamp)
+
+    @classmethod
+    def _watched(cls, path):
+        """Paths whose modification makes an instance stale"""
+        return [path]
+
     def __init__(self, path):
         self.path = path
         if self.__class__.parent is not None:
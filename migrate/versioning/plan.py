@@ -0,0 +1,349 @@
+"""
+   Estimate the cost of an upgrade before running it.
+
+   :func:`plan` captures the statements each change script of the
+   changeset would execute on a mocked engine, like ``--preview_sql``,
+   and classifies them for the database:
+
+   ``metadata``
+     only the catalog changes (creating tables, adding nullable
+     columns, renaming)
+   ``scan``
+     the table is read, e.g. to validate a new foreign key
+   ``index``
+     an index is built over the table
+   ``rewrite``
+     every row is rewritten: type changes on PostgreSQL, most column
+     changes on MySQL, SQLite table rebuilds, updates of all rows
+
+   Row counts and sizes of the tables are read from the database's
+   catalog and divided by the throughput of the class of operation to
+   estimate durations. Databases without such statistics, like SQLite
+   and SQL Server, only know the row counts of the tables when they
+   are counted, which scans each table.
+
+   Scripts reading from the database, like reflecting tables, can't run
+   on a mocked engine; their steps are reported without operations.
+
+   .. versionadded:: 0.7.2
+"""
+import re
+import logging
+
+from migrate.versioning.script import PythonScript
+
+
+log = logging.getLogger(__name__)
+
+METADATA = 'metadata'
+SCAN = 'scan'
+INDEX = 'index'
+REWRITE = 'rewrite'
+
+# classes of operations, from the cheapest
+CLASSES = (METADATA, SCAN, INDEX, REWRITE)
+
+# rows per second processed by each class of operation
+THROUGHPUT = {SCAN: 500000, INDEX: 100000, REWRITE: 50000}
+
+# seconds taken by an operation changing the catalog only
+METADATA_DURATION = 0.01
+
+# (database or None for all, class, pattern matching the statement with
+# whitespace collapsed), the first match classifies the statement
+RULES = [
+    # SQLite alters tables by copying them, see SQLiteHelper
+    ('sqlite', REWRITE,
+     r'INSERT INTO (?P<table>\S+) .*SELECT .* FROM migration_tmp'),
+    ('postgresql', REWRITE,
+     r'ALTER TABLE (?P<table>\S+) ALTER COLUMN \S+ TYPE '),
+    ('postgresql', SCAN,
+     r'ALTER TABLE (?P<table>\S+) ALTER COLUMN \S+ SET NOT NULL'),
+    ('mysql', REWRITE,
+     r'ALTER TABLE (?P<table>\S+) (CHANGE|MODIFY|DROP COLUMN|'
+     r'ADD (?!CONSTRAINT|INDEX|UNIQUE|PRIMARY|FOREIGN|KEY))'),
+    ('oracle', REWRITE,
+     r'ALTER TABLE (?P<table>\S+) (MODIFY|DROP (?!CONSTRAINT|PRIMARY|UNIQUE))'),
+    (None, INDEX, r'CREATE (UNIQUE )?INDEX \S+ ON (?P<table>[^\s(]+)'),
+    (None, INDEX,
+     r'ALTER TABLE (?P<table>\S+) ADD (CONSTRAINT \S+ )?(PRIMARY KEY|UNIQUE)'),
+    (None, SCAN,
+     r'ALTER TABLE (?P<table>\S+) ADD (CONSTRAINT \S+ )?(FOREIGN KEY|CHECK)'),
+    (None, REWRITE, r'UPDATE (?P<table>\S+) SET '),
+    (None, REWRITE, r'INSERT INTO (?P<table>\S+) .*SELECT '),
+    (None, SCAN, r'DELETE FROM (?P<table>\S+)'),
+    (None, METADATA,
+     r'(ALTER|CREATE|DROP) TABLE (?P<table>[^\s(]+)'),
+]
+RULES = [(database, kind, re.compile(pattern, re.I))
+         for database, kind, pattern in RULES]
+
+# row counts and sizes in bytes of the tables in the current schema
+CATALOG = {
+    'postgresql': "SELECT c.relname, c.reltuples, "
+        "pg_total_relation_size(c.oid) FROM pg_class c "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relkind = 'r' AND n.nspname = current_schema()",
+    'mysql': "SELECT table_name, table_rows, data_length + index_length "
+        "FROM information_schema.tables WHERE table_schema = DATABASE()",
+    'oracle': "SELECT t.table_name, t.num_rows, t.blocks * s.block_size "
+        "FROM user_tables t LEFT OUTER JOIN user_tablespaces s "
+        "ON s.tablespace_name = t.tablespace_name",
+}
+
+
+class Operation(object):
+    """A statement of a change script.
+
+    :param sql: the statement
+    :param kind: its class, one of :data:`CLASSES`
+    :param table: name of the table it works on, if known
+    """
+
+    def __init__(self, sql, kind, table=None):
+        self.sql = sql
+        self.kind = kind
+        self.table = table
+        self.rows = None
+        self.size = None
+        self.duration = None
+
+    def __repr__(self):
+        return '<Operation %s %s>' % (self.kind, self.table)
+
+
+class Step(object):
+    """Operations of a change script.
+
+    :param error: why the script couldn't be previewed, if it couldn't
+    """
+
+    def __init__(self, start_version, end_version, script, operations=(),
+                 error=None):
+        self.start_version = start_version
+        self.end_version = end_version
+        self.script = script
+        self.operations = list(operations)
+        self.error = error
+
+    def __repr__(self):
+        return '<Step %s -> %s %s>' % (self.start_version, self.end_version,
+                                       self.kind)
+
+    @property
+    def kind(self):
+        """Most disruptive class of the operations, :keyword:`None` if the
+        script couldn't be previewed"""
+        if self.error is not None:
+            return None
+        kinds = [CLASSES.index(op.kind) for op in self.operations]
+        return CLASSES[max(kinds + [0])]
+
+    @property
+    def duration(self):
+        """Estimated seconds, :keyword:`None` if unknown"""
+        if self.error is not None:
+            return None
+        return sum([op.duration or 0 for op in self.operations])
+
+
+def parse_throughput(value):
+    """Returns throughput figures of ``class=rows,...`` strings"""
+    if not isinstance(value, basestring):
+        return value
+    figures = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        kind, rows = item.split('=')
+        figures[kind.strip()] = float(rows)
+    return figures
+
+
+def classify(sql, database):
+    """Returns the :class:`Operation` of statement `sql` on `database`"""
+    sql = ' '.join(sql.split())
+    for rule_database, kind, pattern in RULES:
+        if rule_database not in (None, database):
+            continue
+        match = pattern.match(sql)
+        if match is not None:
+            return Operation(sql, kind, _unquote(match.group('table')))
+    return Operation(sql, METADATA)
+
+
+def _unquote(name):
+    name = name.split('.')[-1]
+    return name.strip('"`[]').lower()
+
+
+def table_sizes(engine, tables, count=False):
+    """Returns a dict mapping the names of `tables` to their row count
+    and size in bytes, as far as the database knows them.
+
+    :param count: count the rows of `tables` with ``SELECT count(*)``,
+      a full scan of each table, when the database has no catalog
+      statistics; otherwise their sizes are unknown
+    """
+    sizes = {}
+    query = CATALOG.get(engine.dialect.name)
+    if query is not None:
+        for name, rows, size in engine.execute(query):
+            name = engine.dialect.normalize_name(name).lower()
+            if rows is not None:
+                rows = int(rows)
+                if rows < 0:
+                    # never analyzed
+                    rows = None
+            if size is not None:
+                size = int(size)
+            sizes[name] = (rows, size)
+        return sizes
+
+    existing = set([name.lower() for name in engine.table_names()])
+    preparer = engine.dialect.identifier_preparer
+    for name in tables:
+        if name not in existing:
+            continue
+        rows = None
+        if count:
+            rows = engine.execute('SELECT count(*) FROM %s' %
+                                  preparer.quote_identifier(name)).scalar()
+        sizes[name] = (rows, None)
+    return sizes
+
+
+def plan(schema, version=None, throughput=None, migration=None,
+         count=False):
+    """Returns the :class:`Step` instances of upgrading or downgrading
+    `schema` to `version`, with their operations and estimated durations.
+
+    :param schema: :class:`~migrate.versioning.schema.ControlledSchema`
+    :param throughput: rows per second of each class of operation,
+      overriding :data:`THROUGHPUT`
+    :param migration: :class:`~migrate.versioning.repository.MigrationPlan`
+      to estimate instead of the one to `version`
+    :param count: count the rows of the tables on databases without
+      catalog statistics, see :func:`table_sizes`
+    """
+    figures = dict(THROUGHPUT)
+    figures.update(parse_throughput(throughput) or {})
+    database = schema.engine.dialect.name
+    url = str(schema.engine.engine.url)
+
+    if migration is None:
+        migration = schema.plan(version)
+    steps = []
+    for ver, change in migration:
+        step = Step(ver, ver + migration.step, change)
+        try:
+            if isinstance(change, PythonScript):
+                statements = change.capture_sql(url, migration.step)
+            else:
+                statements = [sql for sql in change.source().split(';')
+                              if sql.strip()]
+        except Exception, e:
+            log.debug('Could not preview %s', change.path, exc_info=True)
+            step.error = '%s: %s' % (e.__class__.__name__, e)
+        else:
+            step.operations = [classify(sql, database)
+                               for sql in statements]
+        steps.append(step)
+
+    tables = set()
+    for step in steps:
+        for op in step.operations:
+            if op.kind != METADATA and op.table:
+                tables.add(op.table)
+    sizes = table_sizes(schema.engine, tables, count)
+
+    for step in steps:
+        for op in step.operations:
+            if op.kind == METADATA:
+                op.duration = METADATA_DURATION
+                continue
+            # tables created by the upgrade are empty
+            op.rows, op.size = sizes.get(op.table, (0, None))
+            if op.rows is None and op.table in sizes:
+                # existing table of unknown size
+                continue
+            op.duration = METADATA_DURATION + \
+                float(op.rows or 0) / figures[op.kind]
+    return steps
+
+
+def report(steps, limit=5):
+    """Returns a text report of `steps`: every step with its operations,
+    then the `limit` riskiest ones"""
+    lines = []
+    for step in steps:
+        lines.append(_describe(step))
+        if step.error is not None:
+            lines.append('    could not be previewed: %s' % step.error)
+        for op in step.operations:
+            sql = op.sql
+            if len(sql) > 60:
+                sql = sql[:57] + '...'
+            if op.duration is None:
+                rows = 'unknown size'
+            elif op.rows is None:
+                rows = ''
+            else:
+                rows = '%d rows' % op.rows
+                if op.size is not None:
+                    rows += ', %s' % _format_size(op.size)
+            lines.append('    %-8s %-20s %-25s %s' % (op.kind,
+                op.table or '-', rows, sql))
+
+    known = [step for step in steps if step.error is None]
+    total = sum([step.duration for step in known])
+    lines.append('')
+    lines.append('%d steps, estimated %s' % (len(steps),
+                                             _format_duration(total)))
+    unknown = len(steps) - len(known)
+    if unknown:
+        lines.append('%d steps could not be estimated' % unknown)
+    unsized = len([op for step in known for op in step.operations
+                   if op.duration is None])
+    if unsized:
+        lines.append('%d operations on tables of unknown size are not '
+                     'included, count their rows with --count' % unsized)
+
+    ranked = sorted(steps, key=_risk, reverse=True)[:limit]
+    if ranked:
+        lines.append('Riskiest steps:')
+        for step in ranked:
+            lines.append('  ' + _describe(step))
+    return '\n'.join(lines)
+
+
+def _risk(step):
+    # steps that couldn't be previewed first, they may do anything
+    if step.error is not None:
+        return (1, 0, 0)
+    return (0, step.duration, CLASSES.index(step.kind))
+
+
+def _describe(step):
+    if step.error is not None:
+        cost = 'unknown'
+    else:
+        cost = '%s, %s' % (step.kind, _format_duration(step.duration))
+    return '%s -> %s: %s (%s)' % (step.start_version, step.end_version,
+                                  cost, step.script.path)
+
+
+def _format_duration(seconds):
+    if seconds < 60:
+        return '%.2fs' % seconds
+    if seconds < 3600:
+        return '%.1fmin' % (seconds / 60)
+    return '%.1fh' % (seconds / 3600)
+
+
+def _format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return '%d%s' % (size, unit)
+        size /= 1024
+    return '%dTB' % size
@@ -0,0 +1,268 @@
+"""
+   Record the SQL of change scripts once, replay it on similar databases.
+
+   Upgrading a database with ``--record=FILE`` stores the statements
+   executed by each Python change script, along with a fingerprint of
+   the schema the script ran on. Upgrading another database with
+   ``--replay=FILE`` executes the stored statements directly, without
+   importing the script, reflecting tables or compiling DDL, as long as
+   the database's schema has the same fingerprint. Otherwise, and for
+   steps that weren't recorded, the change scripts run as usual.
+
+   Only scripts whose statements don't depend on the data in the
+   database can be replayed. Scripts can opt out with a module level
+   ``replay = False``. SQL change scripts always run as usual, so do
+   steps resuming from checkpoints, which are not recorded since they
+   only execute the statements of the remaining work. Statements on the
+   tables of migrate itself, like the checkpoint table, are not recorded.
+
+   Recording requires SQLAlchemy 0.7.
+
+   .. versionadded:: 0.7.2
+"""
+import os
+import re
+import weakref
+import logging
+import threading
+
+try:
+    import json
+except ImportError:
+    # python < 2.6
+    import simplejson as json
+
+try:
+    from hashlib import sha1
+except ImportError:
+    # python 2.4
+    from sha import new as sha1
+
+from sqlalchemy import MetaData
+
+from migrate import exceptions
+from migrate.changeset import SQLA_07
+from migrate.versioning.script import PythonScript
+from migrate.versioning.checkpoint import get_checkpoints
+
+
+log = logging.getLogger(__name__)
+
+FORMAT = 1
+
+# statements reading the schema or data are not recorded
+READ_ONLY = ('select', 'pragma', 'show', 'describe', 'explain')
+
+_capture = threading.local()
+_instrumented = weakref.WeakKeyDictionary()
+
+
+def fingerprint(engine, exclude=()):
+    """Returns a SHA1 digest of the tables, columns and indexes in the
+    database, ignoring tables named in `exclude`"""
+    meta = MetaData()
+    meta.reflect(bind=engine)
+    tables = []
+    for table in meta.sorted_tables:
+        if table.name in exclude:
+            continue
+        columns = [(col.name, repr(col.type), col.nullable, col.primary_key)
+                   for col in table.columns]
+        indexes = [(index.name, index.unique,
+                    [col.name for col in index.columns])
+                   for index in table.indexes]
+        indexes.sort()
+        tables.append((table.name, columns, indexes))
+    tables.sort()
+    return sha1(repr(tables)).hexdigest()
+
+
+def _instrument(engine):
+    """Install the listener capturing statements executed on `engine`"""
+    if not SQLA_07:
+        raise exceptions.NotSupportedError("Recording change scripts "
+            "requires SQLAlchemy 0.7")
+    from sqlalchemy import event
+
+    if engine in _instrumented:
+        return
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        statements = getattr(_capture, 'statements', None)
+        if statements is None:
+            return
+        words = statement.split(None, 1)
+        if not words or words[0].lower() in READ_ONLY:
+            return
+        if _capture.internal.search(statement):
+            # checkpoints and the like, maintained by migrate
+            return
+        statements.append((statement, parameters))
+
+    # SQLAlchemy 0.7 listeners can't be removed, they stay inactive
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    _instrumented[engine] = True
+
+
+class Recording(object):
+    """Statements of change scripts stored in the JSON file `path`.
+
+    :param schema: :class:`~migrate.versioning.schema.ControlledSchema`
+      being upgraded
+    """
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self.steps = dict()
+        # statements on tables of migrate aren't recorded
+        self.internal = re.compile(r'\b(%s)\b' % '|'.join(
+            [re.escape(name) for name in schema.repository.internal_tables]),
+            re.IGNORECASE)
+        # the schema is known to match the recording
+        self.trusted = False
+        if os.path.exists(path):
+            fd = open(path)
+            try:
+                data = json.load(fd)
+            finally:
+                fd.close()
+            if data.get('format') != FORMAT or \
+                    data.get('repository') != schema.repository.id:
+                raise exceptions.KnownError("%s is not a recording of "
+                    "repository %s" % (path, schema.repository.id))
+            if data.get('database') == self.database:
+                self.steps = data['steps']
+
+    @property
+    def database(self):
+        return self.schema.engine.dialect.name
+
+    def _key(self, ver, step):
+        return '%d:%d' % (ver, ver + step)
+
+    def fingerprint(self):
+        return fingerprint(self.schema.engine,
+                           self.schema.repository.internal_tables)
+
+    def save(self):
+        """Write the recording to its file"""
+        fd = open(self.path, 'w')
+        try:
+            json.dump(dict(format=FORMAT, repository=self.schema.repository.id,
+                           database=self.database, steps=self.steps), fd,
+                      indent=1)
+        finally:
+            fd.close()
+
+    def recorder(self, ver, change, step):
+        """Returns a script running `change` and recording its
+        statements"""
+        if not isinstance(change, PythonScript):
+            return change
+        # connections only see listeners installed before they were made,
+        # the step's connection is made after this
+        _instrument(self.schema.engine.engine)
+        return RecordingScript(change, self, self._key(ver, step))
+
+    def replayer(self, ver, change, step):
+        """Returns a script replaying the recorded statements of
+        `change`, or `change` itself if they can't be replayed"""
+        if not isinstance(change, PythonScript):
+            # SQL scripts don't change the schema differently on
+            # databases matching the recording
+            return change
+        entry = self.steps.get(self._key(ver, step))
+        if entry is None or entry.get('statements') is None:
+            log.info('%s has no recording, running it', change.path)
+            self.trusted = False
+            return change
+        if not self.trusted and self.fingerprint() != entry['fingerprint']:
+            log.info('Schema differs from the recording of %s, running it',
+                     change.path)
+            self.trusted = False
+            return change
+        return ReplayScript(change, self, entry['statements'])
+
+
+class _ScriptProxy(object):
+    """Stands in for a change script"""
+
+    def __init__(self, script, recording):
+        self.script = script
+        self.recording = recording
+
+    def __getattr__(self, name):
+        return getattr(self.script, name)
+
+
+class RecordingScript(_ScriptProxy):
+
+    def __init__(self, script, recording, key):
+        super(RecordingScript, self).__init__(script, recording)
+        self.key = key
+
+    def run(self, engine, step):
+        if not getattr(self.script.module, 'replay', True):
+            self.recording.steps[self.key] = dict(fingerprint=None,
+                                                  statements=None)
+            return self.script.run(engine, step)
+
+        checkpoints = get_checkpoints(engine)
+        if checkpoints is not None and checkpoints.load(engine):
+            log.info('%s resumes from checkpoints, it is not recorded',
+                     self.script.path)
+            return self.script.run(engine, step)
+
+        entry = dict(fingerprint=self.recording.fingerprint())
+        _capture.internal = self.recording.internal
+        _capture.statements = statements = []
+        try:
+            ret = self.script.run(engine, step)
+        finally:
+            _capture.statements = None
+        try:
+            json.dumps(statements)
+        except (TypeError, ValueError):
+            log.warning('%s used parameters that can not be recorded, it '
+                        'will not be replayed', self.script.path)
+            statements = None
+        entry['statements'] = statements
+        self.recording.steps[self.key] = entry
+        return ret
+
+
+class ReplayScript(_ScriptProxy):
+
+    def __init__(self, script, recording, statements):
+        super(ReplayScript, self).__init__(script, recording)
+        self.statements = statements
+
+    def run(self, engine, step):
+        connection = engine.connect()
+        rowcount = 0
+        try:
+            transaction = connection.begin()
+            try:
+                for statement, parameters in self.statements:
+                    if parameters:
+                        result = connection.execute(statement, parameters)
+                    else:
+                        result = connection.execute(statement)
+                    if not result.returns_rows and result.rowcount > 0:
+                        rowcount += result.rowcount
+            except:
+                transaction.rollback()
+                # the schema may no longer match the recording
+                self.recording.trusted = False
+                raise
+            transaction.commit()
+        finally:
+            # engine may be the connection of the step
+            if connection is not engine:
+                connection.close()
+        self.recording.trusted = True
+        log.debug('Replayed %d statements of %s', len(self.statements),
+                  self.script.path)
+        return rowcount
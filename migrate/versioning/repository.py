@@ -6,11 +6,14 @@ import shutil
 import string
 import logging
 
-from pkg_resources import resource_filename
-from tempita import Template as TempitaTemplate
+try:
+    import json
+except ImportError:
+    # python < 2.6
+    import simplejson as json
 
 from migrate import exceptions
-from migrate.versioning import version, pathed, cfgparse
+from migrate.versioning import version, pathed, cfgparse, bundle
 from migrate.versioning.template import Template
 from migrate.versioning.config import *
 
@@ -33,6 +36,8 @@ class Changeset(dict):
         self.step = k.pop('step', 1)
         self.start = version.VerNum(start)
         self.end = self.start
+        # keys in the order they were added, which is step order
+        self._keys = []
         for change in changes:
             self.add(change)
 
@@ -43,22 +48,20 @@ class Changeset(dict):
         """
         In a series of upgrades x -> y, keys are version x. Sorted.
         """
-        ret = super(Changeset, self).keys()
-        # Reverse order if downgrading
-        ret.sort(reverse=(self.step < 1))
-        return ret
+        return list(self._keys)
 
     def values(self):
-        return [self[k] for k in self.keys()]
+        return [self[k] for k in self._keys]
 
     def items(self):
-        return zip(self.keys(), self.values())
+        return [(k, self[k]) for k in self._keys]
 
     def add(self, change):
         """Add new change to changeset"""
         key = self.end
         self.end += self.step
         self[key] = change
+        self._keys.append(key)
 
     def run(self, *p, **k):
         """Run the changeset scripts"""
@@ -66,22 +69,147 @@ class Changeset(dict):
             script.run(*p, **k)
 
 
+class MigrationPlan(object):
+    """The steps migrating a database from one version to another, fixed
+    when the plan is made.
+
+    Iterating a plan yields ``(version, script)`` pairs in the order
+    they run, like a :class:`Changeset`. The SHA1 of every script is
+    recorded, so a plan can be saved with :meth:`save`, reviewed and
+    applied later with :meth:`load`, which refuses plans whose scripts
+    changed since.
+
+    :param repository: :class:`Repository` of the scripts
+    :param database: name of the database the scripts were chosen for
+    :param start: version the plan starts at
+    :param steps: ``(version, script)`` pairs, in order
+    :param step: 1 for upgrades, -1 for downgrades
+
+    .. versionadded:: 0.7.2
+    """
+
+    FORMAT = 1
+
+    def __init__(self, repository, database, start, steps, step=1):
+        self.repository = repository
+        self.database = database
+        self.start = version.VerNum(start)
+        self.step = step
+        self.steps = tuple(steps)
+        self.end = self.start + step * len(self.steps)
+        self.checksums = tuple([change.checksum()
+                                for ver, change in self.steps])
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __repr__(self):
+        return '<MigrationPlan %s -> %s>' % (self.start, self.end)
+
+    def to_dict(self):
+        """Returns the plan as a JSON serializable dict"""
+        steps = []
+        for (ver, change), checksum in zip(self.steps, self.checksums):
+            steps.append(dict(version=int(ver),
+                              script=os.path.basename(change.path),
+                              sha1=checksum))
+        return dict(format=self.FORMAT, repository=self.repository.id,
+                    database=self.database, start=int(self.start),
+                    end=int(self.end), step=self.step, steps=steps)
+
+    def save(self, path):
+        """Write the plan to the JSON file `path`"""
+        fd = open(path, 'w')
+        try:
+            json.dump(self.to_dict(), fd, indent=1)
+        finally:
+            fd.close()
+
+    @classmethod
+    def load(cls, path, repository):
+        """Read a plan saved with :meth:`save`.
+
+        :raises: :exc:`~migrate.exceptions.KnownError` if the plan was
+          made for another repository, or if one of its scripts is
+          missing or changed
+        """
+        if isinstance(repository, basestring):
+            repository = Repository(repository)
+        fd = open(path)
+        try:
+            data = json.load(fd)
+        finally:
+            fd.close()
+        if data.get('format') != cls.FORMAT or \
+                data.get('repository') != repository.id:
+            raise exceptions.KnownError("%s is not a plan of repository %s"
+                % (path, repository.id))
+
+        step = data['step']
+        if step > 0:
+            operation = 'upgrade'
+        else:
+            operation = 'downgrade'
+        steps = []
+        for entry in data['steps']:
+            ver = version.VerNum(entry['version'])
+            # downgrades run the script of the version they start from
+            script_ver = ver + max(step, 0)
+            try:
+                change = repository.version(script_ver).script(
+                    data['database'], operation)
+            except (KeyError, AssertionError), e:
+                raise exceptions.KnownError("Script %s of %s is missing: %s"
+                    % (entry['script'], path, e))
+            if os.path.basename(change.path) != entry['script']:
+                raise exceptions.KnownError("Version %s of %s runs %s, the "
+                    "repository has %s" % (script_ver, path, entry['script'],
+                                           os.path.basename(change.path)))
+            steps.append((ver, change))
+
+        plan = cls(repository, data['database'], data['start'], steps, step)
+        for entry, checksum in zip(data['steps'], plan.checksums):
+            if entry['sha1'] != checksum:
+                raise exceptions.KnownError("%s changed since %s was made"
+                    % (entry['script'], path))
+        return plan
+
+
 class Repository(pathed.Pathed):
-    """A project's change script repository"""
+    """A project's change script repository
+
+    `path` is either a repository directory or a bundle file created
+    by :func:`migrate.versioning.bundle.create`.
+    """
 
     _config = 'migrate.cfg'
     _versions = 'versions'
+    bundle = None
 
     def __init__(self, path):
         log.debug('Loading repository %s...' % path)
         self.verify(path)
         super(Repository, self).__init__(path)
-        self.config = cfgparse.Config(os.path.join(self.path, self._config))
-        self.versions = version.Collection(os.path.join(self.path,
-                                                      self._versions))
+        if bundle.is_bundle(path):
+            self.bundle = bundle.Bundle(path)
+            self.config = self.bundle.config
+            self.versions = self.bundle.versions
+        else:
+            self.config = cfgparse.Config(os.path.join(self.path,
+                                                       self._config))
+            self.versions = version.Collection(os.path.join(self.path,
+                                                          self._versions))
         log.debug('Repository %s loaded successfully' % path)
         log.debug('Config: %r' % self.config.to_dict())
 
+    @classmethod
+    def _watched(cls, path):
+        return [path, os.path.join(path, cls._config),
+                os.path.join(path, cls._versions)]
+
     @classmethod
     def verify(cls, path):
         """
@@ -89,6 +217,8 @@ class Repository(pathed.Pathed):
 
         :raises: :exc:`InvalidRepositoryError <migrate.exceptions.InvalidRepositoryError>`
         """
+        if bundle.is_bundle(path):
+            return
         # Ensure the existence of required files
         try:
             cls.require_found(path)
@@ -113,10 +243,17 @@ class Repository(pathed.Pathed):
         if options is None:
             options = {}
         options.setdefault('version_table', 'migrate_version')
+        options.setdefault('history_table', '')
+        options.setdefault('lock_timeout', '')
+        options.setdefault('ddl_lock_timeout', '')
+        options.setdefault('ddl_retries', '')
+        options.setdefault('depends_on', '')
         options.setdefault('repository_id', name)
         options.setdefault('required_dbs', [])
         options.setdefault('use_timestamp_numbering', '0')
 
+        from tempita import Template as TempitaTemplate
+
         tmpl = open(os.path.join(tmpl_dir, cls._config)).read()
         ret = TempitaTemplate(tmpl).substitute(options)
 
@@ -156,11 +293,13 @@ class Repository(pathed.Pathed):
         
         k['use_timestamp_numbering'] = self.use_timestamp_numbering
         self.versions.create_new_python_version(description, **k)
+        self._restamp(self.path)
 
     def create_script_sql(self, database, description, **k):
         """API to :meth:`migrate.versioning.version.Collection.create_new_sql_version`"""
         k['use_timestamp_numbering'] = self.use_timestamp_numbering
         self.versions.create_new_sql_version(database, description, **k)
+        self._restamp(self.path)
 
     @property
     def latest(self):
@@ -172,6 +311,82 @@ class Repository(pathed.Pathed):
         """Returns version_table name specified in config"""
         return self.config.get('db_settings', 'version_table')
 
+    @property
+    def history_table(self):
+        """Returns history_table name specified in config or
+        :keyword:`None` if the migration history is disabled"""
+        if not self.config.has_option('db_settings', 'history_table'):
+            return None
+        return self.config.get('db_settings', 'history_table') or None
+
+    @property
+    def lock_table(self):
+        """Returns the name of the table used to lock migrations on
+        databases without advisory locks"""
+        return '%s_lock' % self.version_table
+
+    @property
+    def applied_table(self):
+        """Returns the name of the table recording versions applied
+        ahead of the version in version_table, see
+        :mod:`migrate.versioning.graph`"""
+        return '%s_applied' % self.version_table
+
+    @property
+    def checkpoint_table(self):
+        """Returns the name of the table holding the checkpoints of
+        change scripts, see :mod:`migrate.versioning.checkpoint`"""
+        return '%s_checkpoint' % self.version_table
+
+    @property
+    def lock_timeout(self):
+        """Returns lock_timeout in seconds specified in config or
+        :keyword:`None` to wait for the migration lock forever"""
+        if not self.config.has_option('db_settings', 'lock_timeout'):
+            return None
+        timeout = self.config.get('db_settings', 'lock_timeout')
+        if not timeout:
+            return None
+        return float(timeout)
+
+    @property
+    def ddl_policy(self):
+        """Returns the :class:`~migrate.changeset.policy.DDLPolicy` built
+        from ddl_lock_timeout and ddl_retries in config, or :keyword:`None`
+        if neither is set"""
+        options = {}
+        for name, option, convert in (('lock_timeout', 'ddl_lock_timeout',
+                                       float),
+                                      ('retries', 'ddl_retries', int)):
+            if self.config.has_option('db_settings', option):
+                value = self.config.get('db_settings', option)
+                if value:
+                    options[name] = convert(value)
+        if not options:
+            return None
+        from migrate.changeset.policy import DDLPolicy
+        return DDLPolicy(**options)
+
+    @property
+    def depends_on(self):
+        """Returns the ids of the repositories listed in depends_on in
+        config, whose upgrades have to run before this repository's
+        when they share a database"""
+        if not self.config.has_option('db_settings', 'depends_on'):
+            return []
+        value = self.config.get('db_settings', 'depends_on')
+        return [name.strip() for name in value.split(',') if name.strip()]
+
+    @property
+    def internal_tables(self):
+        """Returns names of the tables maintained by migrate itself,
+        which are excluded from schema comparisons"""
+        tables = [self.version_table, self.lock_table, self.applied_table,
+                  self.checkpoint_table]
+        if self.history_table:
+            tables.append(self.history_table)
+        return tables
+
     @property
     def id(self):
         """Returns repository id specified in config"""
@@ -193,6 +408,8 @@ class Repository(pathed.Pathed):
         # TODO: deletes repo
         super(Repository, cls).clear()
         version.Collection.clear()
+        bundle.Bundle.clear()
+        bundle.BundledCollection.clear()
 
     def changeset(self, database, start, end=None):
         """Create a changeset to migrate this database from ver. start to end/latest.
@@ -226,6 +443,16 @@ class Repository(pathed.Pathed):
         ret = Changeset(start, step=step, *changes)
         return ret
 
+    def plan(self, database, start, end=None):
+        """Returns the :class:`MigrationPlan` migrating `database` from
+        version `start` to `end` (latest if None given).
+
+        .. versionadded:: 0.7.2
+        """
+        changeset = self.changeset(database, start, end)
+        return MigrationPlan(self, database, changeset.start, changeset,
+                             changeset.step)
+
     @classmethod
     def create_manage_file(cls, file_, **opts):
         """Create a project management script (manage.py)
@@ -236,6 +463,8 @@ class Repository(pathed.Pathed):
         mng_file = Template(opts.pop('templates_path', None))\
             .get_manage(theme=opts.pop('templates_theme', None))
 
+        from tempita import Template as TempitaTemplate
+
         tmpl = open(mng_file).read()
         fd = open(file_, 'w')
         fd.write(TempitaTemplate(tmpl).substitute(opts))
@@ -2,34 +2,76 @@
    Database schema version management.
 """
 import sys
+import time
+import socket
+import getpass
 import logging
+from datetime import datetime
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # python < 2.7
+    from sqlalchemy.util import OrderedDict
 
 from sqlalchemy import (Table, Column, MetaData, String, Text, Integer,
-    create_engine)
-from sqlalchemy.sql import and_
+    Float, DateTime, Sequence, create_engine)
+from sqlalchemy.sql import and_, or_, desc, select
 from sqlalchemy import exceptions as sa_exceptions
 from sqlalchemy.sql import bindparam
 
-from migrate import exceptions
+from migrate import exceptions, events
 from migrate.changeset import SQLA_07
-from migrate.versioning import genmodel, schemadiff
+from migrate.changeset.policy import is_lock_timeout
+from migrate.versioning import genmodel, schemadiff, locking
 from migrate.versioning.repository import Repository
+from migrate.versioning.checkpoint import Checkpoints, checkpoint_table
+from migrate.versioning.graph import applied_table
 from migrate.versioning.util import load_model
 from migrate.versioning.version import VerNum
 
 
 log = logging.getLogger(__name__)
 
+def version_table(name, meta):
+    """Returns the definition of the version table `name` in `meta`.
+
+    .. versionadded:: 0.7.2
+    """
+    return Table(
+        name, meta,
+        Column('repository_id', String(250), primary_key=True),
+        Column('repository_path', Text),
+        Column('version', Integer), )
+
+
 class ControlledSchema(object):
-    """A database under version control"""
+    """A database under version control
 
-    def __init__(self, engine, repository):
+    :param verify: reflect the version table from the database and
+      check its columns instead of using its known definition
+    :param data: row of the version table already read for this
+      repository, see :class:`ControlledSchemaGroup`
+
+    .. attribute:: ddl_policy
+
+      :class:`~migrate.changeset.policy.DDLPolicy` of the DDL statements
+      executed by change scripts, defaults to the repository's
+    """
+
+    def __init__(self, engine, repository, verify=False, data=None):
         if isinstance(repository, basestring):
             repository = Repository(repository)
         self.engine = engine
         self.repository = repository
+        self.ddl_policy = repository.ddl_policy
         self.meta = MetaData(engine)
-        self.load()
+        self.verify = verify
+        if data is None:
+            self.load()
+        else:
+            self.table = self._load_table_version()
+            self.version = data['version']
 
     def __eq__(self, other):
         """Compare two schemas by repositories and versions"""
@@ -38,10 +80,9 @@ class ControlledSchema(object):
 
     def load(self):
         """Load controlled schema version info from DB"""
-        tname = self.repository.version_table
         try:
-            if not hasattr(self, 'table') or self.table is None:
-                    self.table = Table(tname, self.meta, autoload=True)
+            if getattr(self, 'table', None) is None:
+                self.table = self._load_table_version()
 
             result = self.engine.execute(self.table.select(
                 self.table.c.repository_id == str(self.repository.id)))
@@ -54,6 +95,21 @@ class ControlledSchema(object):
         self.version = data['version']
         return data
 
+    def _load_table_version(self):
+        """Returns the version table. It is only reflected from the
+        database in verify mode, its shape is fixed by
+        :meth:`_create_table_version`."""
+        tname = self.repository.version_table
+        if not self.verify:
+            return version_table(tname, self.meta)
+        table = Table(tname, self.meta, autoload=True)
+        missing = [name for name in ('repository_id', 'version')
+                   if name not in table.c]
+        if missing:
+            raise exceptions.DatabaseNotControlledError(
+                "%s has no column %s" % (tname, ', '.join(missing)))
+        return table
+
     def drop(self):
         """
         Remove version control from a database.
@@ -75,11 +131,22 @@ class ControlledSchema(object):
         Uses self.version for start version and engine.name
         to get database name.
         """
-        database = self.engine.name
+        # engine may be a connection
+        database = self.engine.dialect.name
         start_ver = self.version
         changeset = self.repository.changeset(database, start_ver, version)
         return changeset
 
+    def plan(self, version=None):
+        """Returns the :class:`~migrate.versioning.repository.MigrationPlan`
+        migrating this database from its version to `version` (latest if
+        None given).
+
+        .. versionadded:: 0.7.2
+        """
+        return self.repository.plan(self.engine.dialect.name, self.version,
+                                    version)
+
     def runchange(self, ver, change, step):
         startver = ver
         endver = ver + step
@@ -87,26 +154,229 @@ class ControlledSchema(object):
         if self.version != startver:
             raise exceptions.InvalidVersionError("%s is not %s" % \
                                                      (self.version, startver))
+        # versions applied ahead would be run again
+        applied = self.applied_ahead()
+        if applied:
+            raise exceptions.KnownError("Versions %s of %s were applied "
+                "ahead of version %s by a parallel upgrade, finish it with "
+                "'upgrade --workers'" % (', '.join(map(str, applied)),
+                                         self.repository.id, self.version))
         # Run the change
-        change.run(self.engine, step)
+        started = datetime.utcnow()
+        timer = time.time()
+        rowcount = self.run_step(change, startver, step)
+        duration = time.time() - timer
+        finished = datetime.utcnow()
 
         # Update/refresh database version
         self.update_repository_table(startver, endver)
         self.load()
 
+        if self.repository.history_table:
+            self.update_history_table(startver, endver, change,
+                started, finished, duration, rowcount)
+
+    def run_step(self, change, startver, step):
+        """Run `change` from version `startver` by `step` on a connection
+        of its own and return what it returns.
+
+        A step failing with a lock timeout or a deadlock has been rolled
+        back by its transaction. It runs again, up to
+        :attr:`ddl_policy`'s retries times and waiting longer before each
+        retry. Scripts setting ``transactional = False``, whose
+        statements may have been committed, and SQL scripts are not run
+        again.
+
+        .. versionadded:: 0.7.2
+        """
+        endver = startver + step
+        retries = 0
+        if self.ddl_policy is not None and self._retryable(change):
+            retries = self.ddl_policy.retries
+        attempt = 0
+        while True:
+            connection = self.engine.connect()
+            try:
+                try:
+                    bind = self.with_checkpoints(
+                        self.with_ddl_policy(connection), startver, endver,
+                        change)
+                    return events.run('step', change.run, bind, step,
+                        script=change, start_version=startver,
+                        end_version=endver)
+                except sa_exceptions.DBAPIError, e:
+                    if attempt >= retries or \
+                            not is_lock_timeout(connection.dialect.name, e):
+                        raise
+            finally:
+                # engine may be a connection, connect() returns it
+                if connection is not self.engine:
+                    connection.close()
+            delay = self.ddl_policy.delay(attempt)
+            attempt += 1
+            log.warning('Lock timeout in %s, running it again (%d of %d) '
+                        'in %.1fs: %s', change.path, attempt, retries, delay,
+                        e.orig)
+            time.sleep(delay)
+
+    def _retryable(self, change):
+        """Whether `change` runs in a transaction of its own, which a
+        failure rolls back entirely"""
+        if getattr(self.engine, 'in_transaction', None) and \
+                self.engine.in_transaction():
+            # the caller's transaction can't be run again
+            return False
+        module = getattr(change, 'module', None)
+        if module is None:
+            return False
+        return getattr(module, 'transactional', True)
+
+    def applied_ahead(self):
+        """Returns the versions applied ahead of :attr:`version` by a
+        :class:`~migrate.versioning.graph.Scheduler`, lowest first
+
+        .. versionadded:: 0.7.2
+        """
+        table = applied_table(self.repository.applied_table, MetaData())
+        if not table.exists(bind=self.engine):
+            return []
+        query = select([table.c.version],
+                       table.c.repository_id == str(self.repository.id),
+                       order_by=[table.c.version])
+        return [VerNum(row[0]) for row in self.engine.execute(query)]
+
+    def with_ddl_policy(self, connection):
+        """Returns `connection` with :attr:`ddl_policy` set as its
+        ``ddl_policy`` execution option"""
+        if self.ddl_policy is None:
+            return connection
+        return connection.execution_options(ddl_policy=self.ddl_policy)
+
+    def with_checkpoints(self, connection, startver, endver, change):
+        """Returns `connection` with the
+        :class:`~migrate.versioning.checkpoint.Checkpoints` of the step
+        from `startver` to `endver` set as its ``migrate_checkpoints``
+        execution option"""
+        return connection.execution_options(migrate_checkpoints=Checkpoints(
+            self.repository, startver, endver, change))
+
+    def checkpoints(self):
+        """Returns rows of the checkpoint table for this repository, by
+        step"""
+        table = checkpoint_table(self.repository.checkpoint_table,
+                                 MetaData())
+        if not table.exists(bind=self.engine):
+            return []
+        query = table.select(
+            table.c.repository_id == str(self.repository.id),
+            order_by=[table.c.start_version, table.c.end_version,
+                      table.c.name])
+        return self.engine.execute(query).fetchall()
+
+    def clear_checkpoints(self, version=None):
+        """Delete the checkpoints of this repository, only those of the
+        steps starting or ending at `version` if given, so that their
+        scripts start over.
+
+        :returns: number of checkpoints deleted
+        """
+        table = checkpoint_table(self.repository.checkpoint_table,
+                                 MetaData())
+        if not table.exists(bind=self.engine):
+            return 0
+        clause = table.c.repository_id == str(self.repository.id)
+        if version is not None:
+            clause = and_(clause, or_(table.c.start_version == int(version),
+                                      table.c.end_version == int(version)))
+        return self.engine.execute(table.delete(clause)).rowcount
+
     def update_repository_table(self, startver, endver):
         """Update version_table with new information"""
         update = self.table.update(and_(self.table.c.version == int(startver),
              self.table.c.repository_id == str(self.repository.id)))
         self.engine.execute(update, version=int(endver))
 
-    def upgrade(self, version=None):
+    def update_history_table(self, startver, endver, change, started,
+                             finished, duration, rowcount=None):
+        """Record an applied change script in history_table"""
+        table = self._load_table_history()
+        if int(endver) > int(startver):
+            direction = 'upgrade'
+        else:
+            direction = 'downgrade'
+        try:
+            username = getpass.getuser()
+        except Exception:
+            username = None
+        self.engine.execute(table.insert().values(
+            repository_id=str(self.repository.id),
+            start_version=int(startver),
+            end_version=int(endver),
+            direction=direction,
+            script_path=change.path,
+            script_hash=change.checksum(),
+            started=started,
+            finished=finished,
+            duration=duration,
+            rows_affected=rowcount,
+            hostname=socket.gethostname(),
+            username=username))
+
+    def history(self, limit=None):
+        """Returns rows of history_table for this repository, slowest
+        change scripts first.
+
+        :param limit: maximum number of rows to return
+        :raises: :exc:`KnownError` if history_table is not configured
+        """
+        if not self.repository.history_table:
+            raise exceptions.KnownError("Migration history is disabled, "
+                "set history_table in migrate.cfg of %s" % self.repository)
+        table = self._load_table_history()
+        query = table.select(
+            table.c.repository_id == str(self.repository.id),
+            order_by=[desc(table.c.duration)], limit=limit)
+        return self.engine.execute(query).fetchall()
+
+    def _load_table_history(self):
+        """Returns history_table, creating it in the database if this
+        database was put under version control before the history was
+        enabled"""
+        if getattr(self, 'history_table', None) is None:
+            self.history_table = self._create_table_history(
+                self.engine, self.repository)
+        return self.history_table
+
+    def lock(self, timeout=None):
+        """Returns the :class:`~migrate.versioning.locking.MigrationLock`
+        serializing migrations of this database.
+
+        :param timeout: seconds to wait for the lock, defaults to the
+          repository's lock_timeout
+        """
+        if timeout is None:
+            timeout = self.repository.lock_timeout
+        # the lock holds its own connection, engine may be a connection
+        return locking.get_lock(self.engine.engine,
+            'migrate:%s' % self.repository.id, timeout,
+            table=self.repository.lock_table)
+
+    def upgrade(self, version=None, lock_timeout=None):
         """
         Upgrade (or downgrade) to a specified version, or latest version.
+
+        Concurrent upgrades wait for each other, see :meth:`lock`.
         """
-        changeset = self.changeset(version)
-        for ver, change in changeset:
-            self.runchange(ver, change, changeset.step)
+        lock = self.lock(lock_timeout)
+        lock.acquire()
+        try:
+            # another process may have migrated while we were waiting
+            self.load()
+            changeset = self.changeset(version)
+            for ver, change in changeset:
+                self.runchange(ver, change, changeset.step)
+        finally:
+            lock.release()
 
     def update_db_from_model(self, model):
         """
@@ -115,7 +385,7 @@ class ControlledSchema(object):
         model = load_model(model)
 
         diff = schemadiff.getDiffOfModelAgainstDatabase(
-            model, self.engine, excludeTables=[self.repository.version_table]
+            model, self.engine, excludeTables=self.repository.internal_tables
             )
         genmodel.ModelGenerator(diff,self.engine).runB2A()
 
@@ -137,7 +407,8 @@ class ControlledSchema(object):
             repository = Repository(repository)
         version = cls._validate_version(repository, version)
         table = cls._create_table_version(engine, repository, version)
-        # TODO: history table
+        if repository.history_table:
+            cls._create_table_history(engine, repository)
         # Load repository information and return
         return cls(engine, repository)
 
@@ -167,14 +438,7 @@ class ControlledSchema(object):
         :raises: :exc:`DatabaseAlreadyControlledError`
         """
         # Create tables
-        tname = repository.version_table
-        meta = MetaData(engine)
-
-        table = Table(
-            tname, meta,
-            Column('repository_id', String(250), primary_key=True),
-            Column('repository_path', Text),
-            Column('version', Integer), )
+        table = version_table(repository.version_table, MetaData(engine))
 
         # there can be multiple repositories/schemas in the same db
         if not table.exists():
@@ -193,6 +457,37 @@ class ControlledSchema(object):
                            version=int(version)))
         return table
 
+    @classmethod
+    def _create_table_history(cls, engine, repository):
+        """
+        Creates the migration history table in a database if it
+        doesn't exist yet.
+        """
+        tname = repository.history_table
+        meta = MetaData(engine)
+
+        table = Table(
+            tname, meta,
+            Column('id', Integer, Sequence('%s_id_seq' % tname),
+                   primary_key=True),
+            Column('repository_id', String(250)),
+            Column('start_version', Integer),
+            Column('end_version', Integer),
+            Column('direction', String(10)),
+            Column('script_path', Text),
+            Column('script_hash', String(40)),
+            Column('started', DateTime),
+            Column('finished', DateTime),
+            Column('duration', Float),
+            Column('rows_affected', Integer),
+            Column('hostname', String(255)),
+            Column('username', String(255)), )
+
+        # there can be multiple repositories/schemas in the same db
+        if not table.exists():
+            table.create()
+        return table
+
     @classmethod
     def compare_model_to_db(cls, engine, model, repository):
         """
@@ -203,7 +498,7 @@ class ControlledSchema(object):
         model = load_model(model)
 
         diff = schemadiff.getDiffOfModelAgainstDatabase(
-            model, engine, excludeTables=[repository.version_table])
+            model, engine, excludeTables=repository.internal_tables)
         return diff
 
     @classmethod
@@ -215,6 +510,141 @@ class ControlledSchema(object):
             repository = Repository(repository)
 
         diff = schemadiff.getDiffOfModelAgainstDatabase(
-            MetaData(), engine, excludeTables=[repository.version_table]
+            MetaData(), engine, excludeTables=repository.internal_tables
             )
         return genmodel.ModelGenerator(diff, engine, declarative).genBDefinition()
+
+
+class ControlledSchemaGroup(object):
+    """Several repositories under version control in the same database.
+
+    The versions of all repositories are read with one query per
+    version table. :meth:`upgrade` runs on a single connection and
+    upgrades repositories listed in another repository's `depends_on`
+    first; otherwise repositories keep the order they are given in.
+
+    :param engine: SQLAlchemy engine
+    :param repositories: repositories or their paths
+    :raises: :exc:`KnownError <migrate.exceptions.KnownError>` if the
+      dependencies can't be satisfied
+    """
+
+    def __init__(self, engine, repositories):
+        self.engine = engine
+        repos = []
+        for repository in repositories:
+            if isinstance(repository, basestring):
+                repository = Repository(repository)
+            repos.append(repository)
+        self.repositories = self._sort(repos)
+        self.load()
+
+    @classmethod
+    def _sort(cls, repositories):
+        """Returns `repositories` in dependency order"""
+        by_id = dict([(repo.id, repo) for repo in repositories])
+        ordered = []
+        visiting = []
+
+        def visit(repo):
+            if repo in ordered:
+                return
+            if repo.id in visiting:
+                raise exceptions.KnownError("Circular dependency between "
+                    "repositories %s" % ', '.join(visiting))
+            visiting.append(repo.id)
+            for name in repo.depends_on:
+                if name not in by_id:
+                    raise exceptions.KnownError("Repository %s depends on "
+                        "%s, which is not part of the group" % (repo.id, name))
+                visit(by_id[name])
+            visiting.remove(repo.id)
+            ordered.append(repo)
+
+        for repo in repositories:
+            visit(repo)
+        return ordered
+
+    def load(self, bind=None):
+        """Read the versions of all repositories.
+
+        :param bind: engine or connection used by the loaded schemas,
+          the group's engine by default
+        :raises: :exc:`DatabaseNotControlledError
+          <migrate.exceptions.DatabaseNotControlledError>`
+        """
+        if bind is None:
+            bind = self.engine
+        tables = OrderedDict()
+        for repo in self.repositories:
+            tables.setdefault(repo.version_table, []).append(repo)
+
+        schemas = {}
+        for tname, repos in tables.iteritems():
+            table = version_table(tname, MetaData())
+            query = table.select(table.c.repository_id.in_(
+                [str(repo.id) for repo in repos]))
+            try:
+                rows = bind.execute(query).fetchall()
+            except sa_exceptions.DBAPIError:
+                cls, exc, tb = sys.exc_info()
+                raise exceptions.DatabaseNotControlledError, exc.__str__(), tb
+            rows = dict([(row['repository_id'], row) for row in rows])
+            for repo in repos:
+                if repo.id not in rows:
+                    raise exceptions.DatabaseNotControlledError(
+                        "Repository %s is not under version control" % repo.id)
+                schemas[repo.id] = ControlledSchema(bind, repo,
+                    data=rows[repo.id])
+        self.schemas = schemas
+
+    @property
+    def versions(self):
+        """Dictionary of versions by repository id"""
+        return dict([(name, schema.version)
+                     for name, schema in self.schemas.iteritems()])
+
+    def upgrade(self, versions=None, lock_timeout=None):
+        """Upgrade (or downgrade) all repositories.
+
+        The migration locks of all repositories are taken, in dependency
+        order, before the versions are read again and change scripts run
+        on one connection. Repositories are downgraded in reverse
+        dependency order, so that the repositories depending on another
+        one are downgraded first, then upgraded in dependency order.
+
+        :param versions: dictionary of target versions by repository id;
+          repositories not in it are upgraded to their latest version
+        :param lock_timeout: see :meth:`ControlledSchema.lock`
+        """
+        if versions is None:
+            versions = {}
+        locks = []
+        try:
+            for repo in self.repositories:
+                lock = self.schemas[repo.id].lock(lock_timeout)
+                lock.acquire()
+                locks.append(lock)
+
+            connection = self.engine.connect()
+            try:
+                self.load(connection)
+                downgrades = []
+                upgrades = []
+                for repo in self.repositories:
+                    schema = self.schemas[repo.id]
+                    changeset = schema.changeset(versions.get(repo.id))
+                    if changeset.step < 0:
+                        downgrades.insert(0, (schema, changeset))
+                    else:
+                        upgrades.append((schema, changeset))
+                for schema, changeset in downgrades + upgrades:
+                    for ver, change in changeset:
+                        schema.runchange(ver, change, changeset.step)
+            finally:
+                connection.close()
+        finally:
+            locks.reverse()
+            for lock in locks:
+                lock.release()
+        self.load()
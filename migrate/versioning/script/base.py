@@ -2,6 +2,12 @@
 # -*- coding: utf-8 -*-
 import logging
 
+try:
+    from hashlib import sha1
+except ImportError:
+    # python 2.4
+    from sha import new as sha1
+
 from migrate import exceptions
 from migrate.versioning.config import operations
 from migrate.versioning import pathed
@@ -50,6 +56,12 @@ class BaseScript(pathed.Pathed):
         fd.close()
         return ret
 
+    def checksum(self):
+        """:returns: SHA1 hex digest of the script source.
+        :rtype: string
+        """
+        return sha1(self.source()).hexdigest()
+
     def run(self, engine):
         """Core of each BaseScript subclass.
         This method executes the script.
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import shutil
 import warnings
 import logging
@@ -8,7 +9,6 @@ import inspect
 from StringIO import StringIO
 
 import migrate
-from migrate.versioning import genmodel, schemadiff
 from migrate.versioning.config import operations
 from migrate.versioning.template import Template
 from migrate.versioning.script import base
@@ -51,6 +51,8 @@ class PythonScript(base.BaseScript):
         :rtype: string
         """
 
+        from migrate.versioning import genmodel, schemadiff
+
         if isinstance(repository, basestring):
             # oh dear, an import cycle!
             from migrate.versioning.repository import Repository
@@ -63,7 +65,7 @@ class PythonScript(base.BaseScript):
         diff = schemadiff.getDiffOfModelAgainstModel(
             model,
             oldmodel,
-            excludeTables=[repository.version_table])
+            excludeTables=repository.internal_tables)
         # TODO: diff can be False (there is no difference?)
         decls, upgradeCommands, downgradeCommands = \
             genmodel.ModelGenerator(diff,engine).genB2AMigration()
@@ -84,16 +86,18 @@ class PythonScript(base.BaseScript):
         return contents
 
     @classmethod
-    def verify_module(cls, path):
+    def verify_module(cls, path, module=None):
         """Ensure path is a valid script
 
         :param path: Script location
+        :param module: Already loaded module, imported from `path` if not given
         :type path: string
         :raises: :exc:`InvalidScriptError <migrate.exceptions.InvalidScriptError>`
         :returns: Python module
         """
         # Try to import and get the upgrade() func
-        module = import_path(path)
+        if module is None:
+            module = import_path(path)
         try:
             assert callable(module.upgrade)
         except Exception, e:
@@ -118,14 +122,45 @@ class PythonScript(base.BaseScript):
 
         return go(url, step, **args)
 
+    def capture_sql(self, url, step):
+        """Runs the script on a mocked engine like :meth:`preview_sql`
+
+        :returns: statements the script executes, compiled for the
+          database of `url`
+
+        .. versionadded:: 0.7.2
+        """
+        from sqlalchemy import create_engine
+
+        statements = []
+        def executor(sql, *multiparams, **params):
+            if not isinstance(sql, basestring):
+                sql = unicode(sql.compile(dialect=engine.dialect))
+            statements.append(sql.strip())
+
+        engine = create_engine(url, strategy='mock', executor=executor)
+        self.run(engine, step)
+        return statements
+
     def run(self, engine, step):
         """Core method of Script file.
         Exectues :func:`update` or :func:`downgrade` functions
 
-        :param engine: SQLAlchemy Engine
+        The function receives a :class:`MigrationContext
+        <migrate.versioning.context.MigrationContext>` running everything
+        on one connection, in a transaction committed when it returns or
+        at each checkpoint. The checkpoints set on `engine` with the
+        ``migrate_checkpoints`` execution option are deleted when it
+        returns. Scripts setting ``transactional = False`` at module
+        level receive `engine` unchanged and manage their transactions
+        themselves.
+
+        :param engine: SQLAlchemy Engine or Connection
         :param step: Operation to run
         :type engine: string
         :type step: int
+        :returns: number of rows affected by the statements of the script,
+          :keyword:`None` for scripts managing their transactions
         """
         if step > 0:
             op = 'upgrade'
@@ -142,15 +177,56 @@ class PythonScript(base.BaseScript):
             raise TypeError("upgrade/downgrade functions must accept engine"
                 " parameter (since version 0.5.4)")
 
-        script_func(engine)
+        if not hasattr(engine, 'begin'):
+            # mock engines of preview_sql() have no connections
+            script_func(engine)
+            return
+
+        if not getattr(self.module, 'transactional', True):
+            # e.g. CREATE INDEX CONCURRENTLY can't run in a transaction
+            script_func(engine)
+            return
+
+        from migrate.versioning.context import MigrationContext
+        from migrate.versioning.checkpoint import get_checkpoints
+        if isinstance(engine, MigrationContext):
+            engine = engine.connection
+        connection = engine.contextual_connect()
+        try:
+            checkpoints = get_checkpoints(connection)
+            context = MigrationContext(connection, connection.begin(),
+                                       checkpoints)
+            try:
+                script_func(context)
+                if checkpoints is not None:
+                    checkpoints.clear(connection)
+            except:
+                context.transaction.rollback()
+                raise
+            context.transaction.commit()
+        finally:
+            if connection is not engine:
+                connection.close()
+        return context.rowcount
 
     @property
     def module(self):
         """Calls :meth:`migrate.versioning.script.py.verify_module`
         and returns it.
+
+        The module is imported again when the script was modified since,
+        cached repositories keep their script instances.
         """
-        if not hasattr(self, '_module'):
+        stamp = self._stamp(self.path)
+        if getattr(self, '_module_stamp', None) != stamp:
+            if hasattr(self, '_module'):
+                # the bytecode only records the second of the
+                # modification, an edit within it would be ignored
+                for compiled in (self.path + 'c', self.path + 'o'):
+                    if os.path.exists(compiled):
+                        os.remove(compiled)
             self._module = self.verify_module(self.path)
+            self._module_stamp = stamp
         return self._module
 
     def _func(self, funcname):
@@ -3,6 +3,7 @@
 import logging
 import shutil
 
+from migrate import events
 from migrate.versioning.script import base
 from migrate.versioning.template import Template
 
@@ -25,7 +26,16 @@ class SqlScript(base.BaseScript):
 
     # TODO: why is step parameter even here?
     def run(self, engine, step=None, executemany=True):
-        """Runs SQL script through raw dbapi execute call"""
+        """Runs SQL script through raw dbapi execute call
+
+        The script runs on the DBAPI connection of `engine` when it is a
+        connection, e.g. the connection of a step. On SQLite, whose
+        ``executescript()`` commits first, the statements of the script
+        are not rolled back with the rest of the step.
+
+        :returns: number of rows affected by the script or
+          :keyword:`None` if the database driver doesn't tell
+        """
         text = self.source()
         # Don't rely on SA's autocommit here
         # (SA uses .startswith to check if a commit is needed. What if script
@@ -34,16 +44,31 @@ class SqlScript(base.BaseScript):
         try:
             trans = conn.begin()
             try:
-                # HACK: SQLite doesn't allow multiple statements through
-                # its execute() method, but it provides executescript() instead
-                dbapi = conn.engine.raw_connection()
-                if executemany and getattr(dbapi, 'executescript', None):
-                    dbapi.executescript(text)
-                else:
-                    conn.execute(text)
+                rowcount = events.run('ddl', self._execute, conn, text,
+                    executemany, sql=text)
                 trans.commit()
             except:
                 trans.rollback()
                 raise
         finally:
-            conn.close()
+            # engine may be the connection of the step
+            if conn is not engine:
+                conn.close()
+        return rowcount
+
+    def _execute(self, conn, text, executemany):
+        # HACK: SQLite doesn't allow multiple statements through
+        # its execute() method, but it provides executescript() instead
+        # the DBAPI connection of conn, which may be in a transaction of
+        # the caller
+        dbapi = conn.connection
+        if executemany and getattr(dbapi, 'executescript', None):
+            changes = getattr(dbapi, 'total_changes', None)
+            dbapi.executescript(text)
+            if changes is None:
+                return None
+            return dbapi.total_changes - changes
+        rowcount = conn.execute(text).rowcount
+        if rowcount < 0:
+            return None
+        return rowcount
@@ -0,0 +1,198 @@
+"""
+   Persistent migrate server, see :func:`migrate.versioning.api.serve`.
+
+   The server listens on a Unix domain socket. Each request is one line
+   holding a JSON object::
+
+       {"command": "upgrade", "args": ["sqlite:///project.db"],
+        "kwargs": {"repository": "my_repository"}}
+
+   and is answered with one line::
+
+       {"result": 3, "output": ["0 -> 1... ", "done", ...]}
+
+   or, when the command failed::
+
+       {"error": "...", "type": "KnownError", "output": [...]}
+
+   Repositories, compiled change scripts and the engines of the
+   `keep_engines` most recently used databases (see
+   :data:`migrate.versioning.util.engines`) are kept between requests.
+   Requests are handled one at a time.
+
+   .. versionadded:: 0.7.2
+"""
+import os
+import errno
+import socket
+import inspect
+import logging
+import SocketServer
+
+try:
+    import json
+except ImportError:
+    # python < 2.6
+    import simplejson as json
+
+from migrate import exceptions
+from migrate.versioning import api
+from migrate.versioning.util import engines
+from migrate.versioning.version import VerNum
+
+
+log = logging.getLogger(__name__)
+
+# engines kept between requests by default
+KEEP_ENGINES = 8
+
+
+class OutputCollector(logging.Handler):
+    """Collects messages logged by a command"""
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.INFO)
+        self.output = []
+
+    def emit(self, record):
+        self.output.append(record.getMessage())
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            response = self.server.dispatch(line)
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+class Server(SocketServer.UnixStreamServer):
+    """Runs :mod:`~migrate.versioning.api` commands received on the
+    Unix domain socket `path`.
+
+    :param path: socket path, only accessible by the current user
+    :param keep_engines: number of database engines kept open between
+      requests
+    :param defaults: default keyword arguments of every command, like
+      the ones passed to :func:`migrate.versioning.shell.main`
+    """
+
+    def __init__(self, path, keep_engines=KEEP_ENGINES, **defaults):
+        self.path = path
+        self.defaults = defaults
+        self._keep = engines.keep
+        engines.keep = int(keep_engines)
+        self._remove_stale_socket(path)
+        umask = os.umask(0077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+        finally:
+            os.umask(umask)
+        log.info('Serving on %s', path)
+
+    @classmethod
+    def _remove_stale_socket(cls, path):
+        if not os.path.exists(path):
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                sock.connect(path)
+            except socket.error, e:
+                if e.args[0] != errno.ECONNREFUSED:
+                    raise
+                # left behind by a server that was killed
+                os.remove(path)
+                return
+        finally:
+            sock.close()
+        raise exceptions.KnownError("A server is already listening on %s"
+                                    % path)
+
+    def dispatch(self, line):
+        """Run the command of request `line`.
+
+        :returns: response dictionary
+        """
+        collector = OutputCollector()
+        logger = logging.getLogger('migrate.versioning.api')
+        level = logger.level
+        logger.setLevel(logging.INFO)
+        logger.addHandler(collector)
+        try:
+            try:
+                request = json.loads(line)
+                result = self.run(request.get('command'),
+                    request.get('args', []), request.get('kwargs', {}))
+            except Exception, e:
+                log.debug('Request %r failed', line, exc_info=True)
+                return dict(error=str(e), type=e.__class__.__name__,
+                            output=collector.output)
+        finally:
+            logger.removeHandler(collector)
+            logger.setLevel(level)
+        return dict(result=self._jsonable(result), output=collector.output)
+
+    def run(self, command, args, kwargs):
+        """Run `command` with positional `args` and `kwargs`, mapping
+        arguments like :func:`migrate.versioning.shell.main`"""
+        if command not in api.__all__ or command == 'serve':
+            raise exceptions.UsageError("Invalid command %s" % command)
+        func = getattr(api, command)
+
+        opts = dict(self.defaults)
+        for key, value in kwargs.items():
+            opts[str(key)] = value
+        f_args = inspect.getargspec(func)[0]
+        required = [arg for arg in f_args if arg not in opts]
+        if len(args) > len(required):
+            raise exceptions.UsageError("Too many arguments for command %s"
+                                        % command)
+        opts.update(zip(required, args))
+        return func(**opts)
+
+    def _jsonable(self, value):
+        if value is None or isinstance(value, (bool, int, long, float,
+                                               basestring)):
+            return value
+        if isinstance(value, VerNum):
+            return int(value)
+        return str(value)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        engines.keep = self._keep
+        engines.close_all()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def call(path, command, *args, **kwargs):
+    """Run `command` in the server listening on `path`.
+
+    :returns: result of the command
+    :raises: :exc:`ServerError <migrate.exceptions.ServerError>` if the
+      command failed
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(dict(command=command, args=args,
+                                     kwargs=kwargs)) + '\n')
+        fd = sock.makefile('r')
+        try:
+            response = json.loads(fd.readline())
+        finally:
+            fd.close()
+    finally:
+        sock.close()
+    if 'error' in response:
+        raise exceptions.ServerError('%s: %s' % (response['type'],
+                                                 response['error']))
+    return response['result']
@@ -8,7 +8,7 @@ import inspect
 import logging
 from optparse import OptionParser, BadOptionError
 
-from migrate import exceptions
+from migrate import exceptions, events
 from migrate.versioning import api
 from migrate.versioning.config import *
 from migrate.versioning.util import asbool
@@ -90,6 +90,17 @@ def main(argv=None, **kwargs):
                       dest="disable_logging",
                       default=False,
                       help="Use this option to disable logging configuration")
+    parser.add_option("-p", "--profile",
+                      action="store_true",
+                      dest="profile",
+                      default=False,
+                      help="Print the slowest SQL statements after the "
+                      "command finished")
+    parser.add_option("--profile_limit",
+                      dest="profile_limit",
+                      type="int",
+                      default=10,
+                      help="Number of statements printed by --profile")
     help_commands = ['help', '-h', '--help']
     HELP = False
 
@@ -202,13 +213,24 @@ def main(argv=None, **kwargs):
         parser.error("Not enough arguments for command %s: %s not specified" \
             % (command, ', '.join(required)))
 
+    profile = asbool(kwargs.pop('profile', False))
+    profile_limit = int(kwargs.pop('profile_limit', 10))
+    if profile:
+        reporter = events.TimingReporter(profile_limit)
+        reporter.install()
+
     # handle command
     try:
-        ret = command_func(**kwargs)
-        if ret is not None:
-            log.info(ret)
-    except (exceptions.UsageError, exceptions.KnownError), e:
-        parser.error(e.args[0])
+        try:
+            ret = command_func(**kwargs)
+            if ret is not None:
+                log.info(ret)
+        except (exceptions.UsageError, exceptions.KnownError), e:
+            parser.error(e.args[0])
+    finally:
+        if profile:
+            reporter.uninstall()
+            log.info(reporter.report())
 
 if __name__ == "__main__":
     main()
@@ -5,8 +5,6 @@ import os
 import shutil
 import sys
 
-from pkg_resources import resource_filename
-
 from migrate.versioning.config import *
 from migrate.versioning import pathed
 
@@ -40,10 +38,17 @@ class Template(pathed.Pathed):
     pkg = 'migrate.versioning.templates'
     _manage = 'manage.py_tmpl'
 
-    def __new__(cls, path=None):
+    @classmethod
+    def _key(cls, path=None):
+        if path is None:
+            path = cls._find_path(cls.pkg)
+        return super(Template, cls)._key(path)
+
+    @classmethod
+    def _stamp(cls, path=None):
         if path is None:
             path = cls._find_path(cls.pkg)
-        return super(Template, cls).__new__(cls, path)
+        return super(Template, cls)._stamp(path)
 
     def __init__(self, path=None):
         if path is None:
@@ -57,6 +62,7 @@ class Template(pathed.Pathed):
     @classmethod
     def _find_path(cls, pkg):
         """Returns absolute path to dotted python package."""
+        from pkg_resources import resource_filename
         tmp_pkg = pkg.rsplit('.', 1)
 
         if len(tmp_pkg) != 1:
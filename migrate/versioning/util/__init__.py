@@ -2,14 +2,12 @@
 # -*- coding: utf-8 -*-
 """.. currentmodule:: migrate.versioning.util"""
 
+import os
+import atexit
 import warnings
 import logging
+import threading
 from decorator import decorator
-from pkg_resources import EntryPoint
-
-from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
-from sqlalchemy.pool import StaticPool
 
 from migrate import exceptions
 from migrate.versioning.util.keyedinstance import KeyedInstance
@@ -32,6 +30,7 @@ def load_model(dotted_name):
             warnings.warn('model should be in form of module.model:User '
                 'and not module.model.User', exceptions.MigrateDeprecationWarning)
             dotted_name = ':'.join(dotted_name.rsplit('.', 1))
+        from pkg_resources import EntryPoint
         return EntryPoint.parse('x=%s' % dotted_name).load(False)
     else:
         # Assume it's already loaded.
@@ -110,14 +109,28 @@ def construct_engine(engine, **opts):
         keyword parameters override ``engine_dict`` values.
 
     """
+    from sqlalchemy import create_engine
+    from sqlalchemy.engine import Engine
+
     if isinstance(engine, Engine):
         return engine
     elif not isinstance(engine, basestring):
         raise ValueError("you need to pass either an existing engine or a database uri")
 
+    kwargs = engine_options(**opts)
+    log.debug('Constructing engine')
+    return create_engine(engine, **kwargs)
+
+def engine_options(**opts):
+    """Returns `create_engine` keyword arguments given by the
+    ``engine_dict`` and ``engine_arg_*`` options of
+    :func:`construct_engine`.
+
+    .. versionadded:: 0.7.2
+    """
     # get options for create_engine
     if opts.get('engine_dict') and isinstance(opts['engine_dict'], dict):
-        kwargs = opts['engine_dict']
+        kwargs = dict(opts['engine_dict'])
     else:
         kwargs = dict()
 
@@ -133,11 +146,144 @@ def construct_engine(engine, **opts):
     for key, value in opts.iteritems():
         if key.startswith('engine_arg_'):
             kwargs[key[11:]] = guess_obj_type(value)
+    return kwargs
 
-    log.debug('Constructing engine')
-    # TODO: return create_engine(engine, poolclass=StaticPool, **kwargs)
-    # seems like 0.5.x branch does not work with engine.dispose and staticpool
-    return create_engine(engine, **kwargs)
+
+class EngineRegistry(object):
+    """Engines shared by :mod:`migrate.versioning.api` calls.
+
+    Engines are keyed by their URL and `create_engine` options, so
+    nested and concurrent commands on the same database use one
+    connection pool. Each :meth:`acquire` has to be followed by a
+    :meth:`release`. Engines no longer in use are kept for the next
+    commands until :meth:`close_all`, called at exit. When `keep` is
+    set, only the `keep` most recently used of them are kept and the
+    others are disposed, like :func:`api.serve
+    <migrate.versioning.api.serve>` does.
+
+    Pools can't be shared with forked processes: engines made by
+    another process are forgotten, without being disposed, and created
+    again.
+
+    :param keep: number of engines not in use to keep, :keyword:`None`
+      keeps them all
+
+    .. versionadded:: 0.7.2
+    """
+
+    def __init__(self, keep=None):
+        # key: [engine, references, owned]
+        self.engines = dict()
+        self.keep = keep
+        # keys of the owned engines not in use, least recently used first
+        self._idle = []
+        self._pid = os.getpid()
+        self._lock = threading.RLock()
+
+    def _key(self, url, kwargs):
+        from sqlalchemy.engine.url import make_url
+
+        items = [(key, repr(value)) for key, value in kwargs.iteritems()]
+        items.sort()
+        return (str(make_url(url)), tuple(items))
+
+    def _check_pid(self):
+        if os.getpid() != self._pid:
+            # the parent process still uses the connections of the pools
+            self.engines.clear()
+            self._idle = []
+            self._pid = os.getpid()
+
+    def acquire(self, engine, **opts):
+        """Returns the engine for `engine` and `opts`, constructing it
+        if needed, see :func:`construct_engine` for parameters.
+
+        Engine instances are returned as they are, unless they were
+        made available with :meth:`share`.
+        """
+        from sqlalchemy import create_engine
+        from sqlalchemy.engine import Engine
+
+        if isinstance(engine, Engine):
+            return engine
+        elif not isinstance(engine, basestring):
+            raise ValueError("you need to pass either an existing engine or a database uri")
+
+        kwargs = engine_options(**opts)
+        if kwargs.get('strategy') == 'mock':
+            # mock engines record statements for a single call
+            return create_engine(engine, **kwargs)
+        key = self._key(engine, kwargs)
+
+        self._lock.acquire()
+        try:
+            self._check_pid()
+            if key not in self.engines:
+                log.debug('Constructing engine')
+                self.engines[key] = [create_engine(engine, **kwargs), 0, True]
+            if key in self._idle:
+                self._idle.remove(key)
+            entry = self.engines[key]
+            entry[1] += 1
+            return entry[0]
+        finally:
+            self._lock.release()
+
+    def release(self, engine):
+        """Give back an engine returned by :meth:`acquire`. It is
+        disposed if it was the last user and more than `keep` engines
+        aren't in use."""
+        self._lock.acquire()
+        try:
+            self._check_pid()
+            for key, entry in self.engines.items():
+                if entry[0] is engine and entry[1] > 0:
+                    entry[1] -= 1
+                    if not entry[1] and entry[2]:
+                        self._idle.append(key)
+                        self._dispose_idle(self.keep)
+                    break
+        finally:
+            self._lock.release()
+
+    def share(self, engine):
+        """Use `engine`, created by the caller, for API calls given its
+        URL without engine options. The caller remains responsible for
+        disposing it; :meth:`close_all` only forgets it."""
+        self._lock.acquire()
+        try:
+            self.engines[self._key(str(engine.url), {})] = [engine, 0, False]
+        finally:
+            self._lock.release()
+
+    def close_all(self):
+        """Dispose and forget all engines that aren't in use.
+
+        :returns: number of engines still in use
+        """
+        self._lock.acquire()
+        try:
+            self._check_pid()
+            self._dispose_idle(0)
+            for key, (engine, references, owned) in self.engines.items():
+                if not references:
+                    # shared by the caller, who disposes it
+                    del self.engines[key]
+            return len(self.engines)
+        finally:
+            self._lock.release()
+
+    def _dispose_idle(self, keep):
+        if keep is None:
+            return
+        while len(self._idle) > keep:
+            engine = self.engines.pop(self._idle.pop(0))[0]
+            log.debug('Disposing SQLAlchemy engine %s', engine)
+            engine.dispose()
+
+#: :class:`EngineRegistry` used by :func:`with_engine`
+engines = EngineRegistry()
+atexit.register(engines.close_all)
 
 @decorator
 def with_engine(f, *a, **kw):
@@ -147,20 +293,18 @@ def with_engine(f, *a, **kw):
     Passes engine parameters to :func:`construct_engine` and
     resulting parameter is available as kw['engine'].
 
-    Engine is disposed after wrapped function is executed.
+    .. versionchanged:: 0.7.2
+       Engines are taken from and given back to :data:`engines`, which
+       keeps them for the following calls.
 
     .. versionadded: 0.6.0
     """
-    url = a[0]
-    engine = construct_engine(url, **kw)
-
+    engine = engines.acquire(a[0], **kw)
     try:
         kw['engine'] = engine
         return f(*a, **kw)
     finally:
-        if isinstance(engine, Engine):
-            log.debug('Disposing SQLAlchemy engine %s', engine)
-            engine.dispose()
+        engines.release(engine)
 
 
 class Memoize:
@@ -1,34 +1,97 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # python < 2.7
+    from sqlalchemy.util import OrderedDict
+
+
+class KeyedInstanceType(type):
+    """Metaclass of :class:`KeyedInstance`, looks up existing instances
+    before creating new ones"""
+
+    def __call__(cls, *p, **k):
+        key = cls._key(*p, **k)
+        stamp = cls._stamp(*p, **k)
+        instances = cls._registry()
+
+        cls._lock.acquire()
+        try:
+            entry = instances.pop(key, None)
+            if entry is not None and entry[1] == stamp:
+                # most recently used entries are kept at the end
+                instances[key] = entry
+                return entry[0]
+        finally:
+            cls._lock.release()
+
+        instance = super(KeyedInstanceType, cls).__call__(*p, **k)
+
+        cls._lock.acquire()
+        try:
+            instances[key] = (instance, stamp)
+            while len(instances) > cls.max_instances:
+                del instances[iter(instances).next()]
+        finally:
+            cls._lock.release()
+        return instance
+
 
 class KeyedInstance(object):
     """A class whose instances have a unique identifier of some sort
     No two instances with the same unique ID should exist - if we try to create
-    a second instance, the first should be returned. 
+    a second instance, the first should be returned.
+
+    Existing instances are returned without calling __init__ again,
+    unless :meth:`_stamp` changed since they were created. At most
+    `max_instances` instances are kept per class, least recently used
+    ones are forgotten first.
     """
+    __metaclass__ = KeyedInstanceType
 
     _instances = dict()
+    _lock = threading.RLock()
 
-    def __new__(cls, *p, **k):
-        instances = cls._instances
-        clskey = str(cls)
-        if clskey not in instances:
-            instances[clskey] = dict()
-        instances = instances[clskey]
+    max_instances = 1024
 
-        key = cls._key(*p, **k)
-        if key not in instances:
-            instances[key] = super(KeyedInstance, cls).__new__(cls)
-        return instances[key]
+    @classmethod
+    def _registry(cls):
+        clskey = str(cls)
+        if clskey not in cls._instances:
+            cls._instances[clskey] = OrderedDict()
+        return cls._instances[clskey]
 
     @classmethod
     def _key(cls, *p, **k):
         """Given a unique identifier, return a dictionary key
-        This should be overridden by child classes, to specify which parameters 
+        This should be overridden by child classes, to specify which parameters
         should determine an object's uniqueness
         """
         raise NotImplementedError()
 
+    @classmethod
+    def _stamp(cls, *p, **k):
+        """Given the same parameters as :meth:`_key`, return a value that
+        changes whenever an existing instance becomes stale, for example
+        a modification time. :keyword:`None` by default: instances never
+        become stale.
+        """
+        return None
+
+    def _restamp(self, *p, **k):
+        """Record the current :meth:`_stamp` for this instance, created
+        with parameters `p` and `k`, after it changed its own files and
+        updated itself accordingly"""
+        cls = self.__class__
+        cls._lock.acquire()
+        try:
+            cls._registry()[cls._key(*p, **k)] = (self, cls._stamp(*p, **k))
+        finally:
+            cls._lock.release()
+
     @classmethod
     def clear(cls):
         # Allow cls.clear() as well as uniqueInstance.clear(cls)
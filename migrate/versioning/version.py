@@ -78,11 +78,20 @@ class Collection(pathed.Pathed):
             else:
                 pass  # Must be a helper file or something, let's ignore it.
 
-        # Create the versions member where the keys
-        # are VerNum's and the values are Version's.
+        self._load_versions(tempVersions)
+
+    def _load_versions(self, files):
+        """Create the versions member where the keys
+        are VerNum's and the values are Version's.
+
+        :param files: dict mapping version numbers to script file names
+        """
         self.versions = dict()
-        for num, files in tempVersions.items():
-            self.versions[VerNum(num)] = Version(num, path, files)
+        for num, filelist in files.items():
+            self.versions[VerNum(num)] = self._make_version(num, filelist)
+
+    def _make_version(self, num, filelist):
+        return Version(num, self.path, filelist)
 
     @property
     def latest(self):
@@ -113,6 +122,7 @@ class Collection(pathed.Pathed):
 
         script.PythonScript.create(filepath, **k)
         self.versions[ver] = Version(ver, self.path, [filename])
+        self._restamp(self.path)
         
     def create_new_sql_version(self, database, description, **k):
         """Create SQL files for new version"""
@@ -133,6 +143,7 @@ class Collection(pathed.Pathed):
             filepath = self._version_path(filename)
             script.SqlScript.create(filepath, **k)
             self.versions[ver].add_script(filepath)
+        self._restamp(self.path)
         
     def version(self, vernum=None):
         """Returns latest Version if vernum is not given.
@@ -215,13 +226,17 @@ class Version(object):
                 "(needs to be ###_description_database_operation.sql)")
 
         # File the script into a dictionary
-        self.sql.setdefault(dbms, {})[op] = script.SqlScript(path)
+        self.sql.setdefault(dbms, {})[op] = self._make_script(
+            script.SqlScript, path)
 
     def _add_script_py(self, path):
         if self.python is not None:
             raise exceptions.ScriptError('You can only have one Python script '
                 'per version, but you have: %s and %s' % (self.python, path))
-        self.python = script.PythonScript(path)
+        self.python = self._make_script(script.PythonScript, path)
+
+    def _make_script(self, cls, path):
+        return cls(path)
 
 
 class Extensions: